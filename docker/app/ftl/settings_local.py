@@ -33,6 +33,12 @@ Remote storage requires:
 """
 DEFAULT_FILE_STORAGE = os.getenv("DEFAULT_FILE_STORAGE", FTLStorages.FILE_SYSTEM)
 
+"""
+Offload documents and thumbnails transfers to uWSGI (FILE_SYSTEM storage only)
+- Set FTL_FILE_OFFLOAD env to `X-Sendfile` to enable it (see ftl.enums.FTLFileOffloads docstring)
+"""
+FTL_FILE_OFFLOAD = os.getenv("FTL_FILE_OFFLOAD")
+
 """
 DOCUMENT PROCESSING PLUGINS (order is important)
 ================================================
@@ -51,6 +57,32 @@ FTL_DOC_PROCESSING_PLUGINS = [
     FTLPlugins.SEARCH_ENGINE_PGSQL_TSVECTOR,
 ]
 
+"""
+Staged document processing, each processing stage runs in its own queue (see ftl.enums.FTLProcessingStages docstring)
+- Set DOC_PROCESSING_STAGED env to `True` to enable it, and add `ocr,extract,index,thumb` to WORKER_QUEUES env
+"""
+FTL_DOC_PROCESSING_STAGED = bool(strtobool(os.getenv("DOC_PROCESSING_STAGED", "False")))
+
+"""
+Tika servers used for text extraction, a local Tika server is started if none is set
+- Set TIKA_SERVER_ENDPOINTS env to a comma separated list of urls (eg. `http://tika1:9998,http://tika2:9998`)
+"""
+FTL_TIKA_SERVER_ENDPOINTS = [
+    url for url in os.getenv("TIKA_SERVER_ENDPOINTS", "").split(",") if url
+]
+
+"""
+OCR jobs, the OCR services are not waited for by the workers (see FTL_OCR_JOBS in ftl.settings)
+- Set OCR_JOBS env to `True` to enable it
+"""
+FTL_OCR_JOBS = bool(strtobool(os.getenv("OCR_JOBS", "False")))
+
+"""
+Address of the app reachable by the OCR services, to be called back when their jobs are done
+- Set PROCESSING_CALLBACK_HOST env to the internal url of a web instance (eg. `http://ftl-app:8000`)
+"""
+FTL_PROCESSING_CALLBACK_HOST = os.getenv("PROCESSING_CALLBACK_HOST")
+
 """
 EXTRA SETTINGS FOR REMOTE STORAGE OR OCR_GOOGLE_VISION_SYNC 
 """
@@ -86,6 +118,8 @@ DEFAULT_FROM_EMAIL = os.getenv("DEFAULT_FROM_EMAIL", "noreply@localhost")
 
 # Redis for Celery
 CELERY_BROKER_URL = os.getenv("CELERY_REDIS_URL", "redis://redis:6379/0")
+# Required to OCR large PDF by chunks of pages (see FTL_OCR_PAGES_PER_CHUNK)
+CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND_URL", CELERY_BROKER_URL)
 
 # Redis for cache backend
 CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://redis:6379/15")
@@ -109,6 +109,8 @@ class FTLDocumentAdmin(admin.ModelAdmin):
         "deleted",
         "ocrized",
         "ocr_retry",
+        "ocr_retry_at",
+        "ocr_retry_plugins",
         "type",
     )
 
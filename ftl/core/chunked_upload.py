@@ -0,0 +1,148 @@
+#  Copyright (c) 2021 Exotic Matter SAS. All rights reserved.
+#  Licensed under the Business Source License. See LICENSE at project root for more information.
+import hashlib
+import io
+import os
+
+from django.core.files.base import File
+from django.core.files.storage import default_storage
+
+from core.direct_upload import get_direct_upload_name
+from core.mimes import guess_mimetype, mimetype_to_ext, MIME_SAMPLE_SIZE
+
+# Delay advised to the clients before finalizing again an upload being assembled, in seconds
+ASSEMBLY_RETRY_AFTER = 5
+
+
+class FTLSequentialReader:
+    """
+    Read-only file-like object over a sequence of streams, as if they were a single file. The streams are read only
+    once, so neither the request body nor the uploaded chunks are ever loaded entirely in memory.
+
+    `streams` is an iterable of file-like objects (lazily opened if it is a generator), `size` is the total size
+    expected by the storage backends. The md5 of the data is computed on the fly, and its first and last bytes are kept
+    to guess its mimetype.
+    """
+
+    def __init__(self, streams, size):
+        self.size = size
+        self.closed = False
+        self._streams = iter(streams)
+        self._current = None
+        self._position = 0
+        self._md5 = hashlib.md5()
+        self._head = b""
+        self._foot = b""
+
+    def read(self, size=-1):
+        data = b""
+
+        while size < 0 or len(data) < size:
+            if self._current is None:
+                self._current = next(self._streams, None)
+                if self._current is None:
+                    break
+
+            chunk = self._current.read(-1 if size < 0 else size - len(data))
+            if not chunk:
+                self._close_current()
+                continue
+
+            data += chunk
+
+        self._position += len(data)
+        self._md5.update(data)
+        if len(self._head) < MIME_SAMPLE_SIZE:
+            self._head += data[: MIME_SAMPLE_SIZE - len(self._head)]
+        self._foot = (self._foot + data[-MIME_SAMPLE_SIZE:])[-MIME_SAMPLE_SIZE:]
+        return data
+
+    def seekable(self):
+        return False
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        # Storage backends rewind the file before reading it, which is a no-op at the start of the streams
+        if self._position == 0 and offset == 0 and whence in (os.SEEK_SET, os.SEEK_CUR):
+            return 0
+        raise io.UnsupportedOperation("seek")
+
+    def tell(self):
+        return self._position
+
+    def hexdigest(self):
+        return self._md5.hexdigest()
+
+    def guess_mimetype(self, filename=None):
+        """
+        Same as `guess_mimetype` on the data read
+        """
+        foot = self._foot if self._position > MIME_SAMPLE_SIZE else b""
+        return guess_mimetype(io.BytesIO(self._head + foot), filename=filename)
+
+    def close(self):
+        self._close_current()
+        for stream in self._streams:
+            stream.close()
+        self.closed = True
+
+    def _close_current(self):
+        if self._current is not None:
+            if hasattr(self._current, "close"):
+                self._current.close()
+            self._current = None
+
+
+def save_chunk(upload, offset, stream, length):
+    """
+    Store a chunk of a resumable upload. Return the number of bytes stored, a partially received chunk is deleted.
+    """
+    name = upload.get_chunk_name(offset)
+    reader = FTLSequentialReader([stream], length)
+
+    # Leftover of a previous attempt which failed before the upload offset was updated
+    if default_storage.exists(name):
+        default_storage.delete(name)
+
+    try:
+        saved_name = default_storage.save(name, File(reader, name))
+    except Exception:
+        default_storage.delete(name)
+        raise
+
+    received = reader.tell()
+    if saved_name != name or received != length:
+        default_storage.delete(saved_name)
+        return 0
+
+    return received
+
+
+def open_chunks(upload):
+    """
+    Return a reader over all the chunks of a resumable upload, in order
+    """
+    chunks_streams = (
+        default_storage.open(upload.get_chunk_name(offset), "rb")
+        for offset in sorted(upload.chunks)
+    )
+    return FTLSequentialReader(chunks_streams, upload.size)
+
+
+def assemble_chunks(upload):
+    """
+    Store the document of a complete resumable upload from its chunks, which are read once. Return the stored name,
+    the md5 and the mimetype guessed from the content.
+    """
+    chunks_reader = open_chunks(upload)
+    try:
+        name = default_storage.save(
+            get_direct_upload_name(mimetype_to_ext(upload.type)), File(chunks_reader)
+        )
+    finally:
+        chunks_reader.close()
+
+    return (
+        name,
+        chunks_reader.hexdigest(),
+        chunks_reader.guess_mimetype(filename=upload.filename),
+    )
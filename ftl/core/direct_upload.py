@@ -0,0 +1,202 @@
+#  Copyright (c) 2021 Exotic Matter SAS. All rights reserved.
+#  Licensed under the Business Source License. See LICENSE at project root for more information.
+import hashlib
+import posixpath
+import uuid
+from base64 import b64encode, b64decode
+from datetime import timedelta
+from io import BytesIO
+
+from django.conf import settings
+from django.core import signing
+from django.core.files.storage import default_storage
+from django.urls import reverse
+
+from core.mimes import guess_mimetype, MIME_SAMPLE_SIZE
+from ftl.enums import FTLStorages
+
+# Delay to upload the document to the storage and finalize the upload
+DIRECT_UPLOAD_MAX_AGE = timedelta(hours=1)
+
+_SIGNING_SALT = "core.direct_upload"
+
+
+def sign_direct_upload(values):
+    return signing.dumps(values, salt=_SIGNING_SALT)
+
+
+def unsign_direct_upload(token):
+    """Raise `signing.BadSignature` if the token is invalid or expired"""
+    return signing.loads(token, salt=_SIGNING_SALT, max_age=DIRECT_UPLOAD_MAX_AGE)
+
+
+def get_direct_upload_name(extension):
+    return f"uploads/{uuid.uuid4()}{extension}"
+
+
+class FTLDirectUploadBase:
+    """
+    Direct upload of documents to the storage, the document binary doesn't go through Django.
+
+    The client first gets an upload url, PUT the document to it, then finalize the upload. The md5 of the document is
+    signed in the upload url when the storage supports it, so the storage refuses corrupted uploads.
+    """
+
+    def get_upload_request(self, request, name, mime, md5, token):
+        """
+        Return the url and the headers to use to PUT the document
+        """
+        raise NotImplementedError
+
+    def get_metadata(self, name):
+        """
+        Return size, md5 (hex) and mime of the uploaded document, None if the document hasn't been uploaded. The mime
+        is guessed from the content, not from the type declared by the client.
+        """
+        raise NotImplementedError
+
+    def _read_range(self, name, start, end):
+        """
+        Return the bytes `start` to `end` (included) of the uploaded document
+        """
+        raise NotImplementedError
+
+    def _guess_mimetype(self, name, size):
+        """
+        Same as `guess_mimetype` on the uploaded document, only its first and last bytes are downloaded
+        """
+        if not size:
+            return None
+
+        head = self._read_range(name, 0, min(size, MIME_SAMPLE_SIZE) - 1)
+        foot = b""
+        if size > MIME_SAMPLE_SIZE:
+            foot = self._read_range(name, size - MIME_SAMPLE_SIZE, size - 1)
+
+        return guess_mimetype(BytesIO(head + foot), filename=name)
+
+    @staticmethod
+    def _content_md5(md5):
+        return b64encode(bytes.fromhex(md5)).decode("ascii")
+
+    @staticmethod
+    def _get_key(name):
+        """
+        Return the object key of `name` in the bucket, including the storage location (AWS_LOCATION or GS_LOCATION)
+        """
+        from storages.utils import clean_name
+
+        return clean_name(
+            posixpath.join(
+                default_storage.location, default_storage.generate_filename(name)
+            )
+        ).lstrip("/")
+
+
+class FTLDirectUploadS3(FTLDirectUploadBase):
+    def get_upload_request(self, request, name, mime, md5, token):
+        url = default_storage.bucket.meta.client.generate_presigned_url(
+            "put_object",
+            Params={
+                "Bucket": default_storage.bucket_name,
+                "Key": self._get_key(name),
+                "ContentType": mime,
+                "ContentMD5": self._content_md5(md5),
+            },
+            ExpiresIn=int(DIRECT_UPLOAD_MAX_AGE.total_seconds()),
+        )
+        return (
+            url,
+            {"Content-Type": mime, "Content-MD5": self._content_md5(md5)},
+        )
+
+    def get_metadata(self, name):
+        from botocore.exceptions import ClientError
+
+        try:
+            head = default_storage.bucket.meta.client.head_object(
+                Bucket=default_storage.bucket_name, Key=self._get_key(name)
+            )
+        except ClientError:
+            return None
+
+        # ETag is the md5 of the object, except for multipart uploads (not used by presigned PUT)
+        return (
+            head["ContentLength"],
+            head["ETag"].strip('"'),
+            self._guess_mimetype(name, head["ContentLength"]),
+        )
+
+    def _read_range(self, name, start, end):
+        obj = default_storage.bucket.meta.client.get_object(
+            Bucket=default_storage.bucket_name,
+            Key=self._get_key(name),
+            Range=f"bytes={start}-{end}",
+        )
+        return obj["Body"].read()
+
+
+class FTLDirectUploadGCS(FTLDirectUploadBase):
+    def get_upload_request(self, request, name, mime, md5, token):
+        blob = default_storage.bucket.blob(self._get_key(name))
+        url = blob.generate_signed_url(
+            version="v4",
+            expiration=DIRECT_UPLOAD_MAX_AGE,
+            method="PUT",
+            content_type=mime,
+            content_md5=self._content_md5(md5),
+        )
+        return (
+            url,
+            {"Content-Type": mime, "Content-MD5": self._content_md5(md5)},
+        )
+
+    def get_metadata(self, name):
+        blob = default_storage.bucket.get_blob(self._get_key(name))
+        if blob is None:
+            return None
+
+        return (
+            blob.size,
+            b64decode(blob.md5_hash).hex(),
+            self._guess_mimetype(name, blob.size),
+        )
+
+    def _read_range(self, name, start, end):
+        blob = default_storage.bucket.blob(self._get_key(name))
+        return blob.download_as_string(start=start, end=end)
+
+
+class FTLDirectUploadLocal(FTLDirectUploadBase):
+    """
+    Fallback for storages without presigned urls (FILE_SYSTEM), the document is PUT to a Django view authorized by
+    the signed token. Documents larger than FTL_MAX_DIRECT_UPLOAD_SIZE are refused.
+    """
+
+    def get_upload_request(self, request, name, mime, md5, token):
+        url = request.build_absolute_uri(
+            reverse("api_direct_upload_local", kwargs={"token": token})
+        )
+        return url, {"Content-Type": mime}
+
+    def get_metadata(self, name):
+        if not default_storage.exists(name):
+            return None
+
+        with default_storage.open(name, "rb") as f:
+            mime = guess_mimetype(f, filename=name)
+
+            md5 = hashlib.md5()
+            for data in f.chunks():
+                md5.update(data)
+
+        return default_storage.size(name), md5.hexdigest(), mime
+
+
+def get_direct_upload_backend():
+    if settings.DEFAULT_FILE_STORAGE == FTLStorages.AWS_S3:
+        return FTLDirectUploadS3()
+    elif settings.DEFAULT_FILE_STORAGE == FTLStorages.GCS:
+        return FTLDirectUploadGCS()
+    else:
+        return FTLDirectUploadLocal()
@@ -18,6 +18,22 @@ ERROR_CODES_DETAILS = {
         "Missing parameter `file` or/and `json` in POST body"
     ),
     "ftl_file_empty": _("The file is empty"),
+    "ftl_file_too_large": _("The file is too large"),
+    "ftl_missing_name_or_md5_in_body": _(
+        "Missing or invalid parameter `name` or/and `md5` in body"
+    ),
+    "ftl_direct_upload_invalid_token": _("Invalid or expired upload token"),
+    "ftl_direct_upload_not_found": _("The document hasn't been uploaded"),
+    "ftl_missing_name_or_size_in_body": _(
+        "Missing or invalid parameter `name` or/and `size` in body"
+    ),
+    "ftl_processing_callback_invalid_token": _("Invalid or expired callback token"),
+    "ftl_upload_invalid_chunk": _(
+        "Invalid or incomplete chunk, please retry from the current offset"
+    ),
+    "ftl_upload_offset_mismatch": _("Chunk offset doesn't match the upload offset"),
+    "ftl_upload_incomplete": _("All the chunks haven't been uploaded"),
+    "ftl_invalid_cursor": _("Invalid or malformed parameter `cursor`"),
     "ftl_thumbnail_generation_error": _("The thumbnail could not be decoded"),
     "ftl_too_many_reminders": _(
         "Too many reminders have been created for this document"
@@ -32,5 +48,35 @@ class BadRequestError(APIException):
     default_code = "bad_request"
 
 
+class ConflictError(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = _("Conflict")
+    default_code = "conflict"
+
+
 class PluginUnsupportedStorage(Exception):
     pass
+
+
+class TikaServersBusy(Exception):
+    pass
+
+
+class OCRFailed(Exception):
+    """
+    Raised by an OCR plugin when the service didn't return any text (eg. timeout), the OCR is retried later
+    """
+
+    pass
+
+
+class ProcessingSuspended(Exception):
+    """
+    Raised by a plugin which submitted a job to an asynchronous service, the processing is resumed once the job is
+    done (see `core.models.FTLOCRJob`). `pages_chunks` are the stored chunks of a document OCRized by pages.
+    """
+
+    def __init__(self, job_id, pages_chunks=None):
+        super().__init__(job_id)
+        self.job_id = job_id
+        self.pages_chunks = pages_chunks
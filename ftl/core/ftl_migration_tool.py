@@ -41,3 +41,45 @@ def clean_user_permission(apps, schema_editor):
     for user in all_users:
         user.user_permissions.clear()
         user.save()
+
+
+def update_documents_counters(apps, schema_editor):
+    from core.models import refresh_documents_counters
+
+    FTLDocument = apps.get_model("core", "FTLDocument")
+    FTLDocumentReminder = apps.get_model("core", "FTLDocumentReminder")
+    FTLDocumentSharing = apps.get_model("core", "FTLDocumentSharing")
+
+    refresh_documents_counters(
+        FTLDocument.objects.all(),
+        {FTLDocumentReminder: "reminders_count", FTLDocumentSharing: "shares_count",},
+    )
+
+
+def create_documents_blobs(apps, schema_editor):
+    """
+    Register a blob for each distinct content of the orgs, so new uploads can be deduplicated against existing
+    documents. Only one document per content is linked, the other ones keep their own binary.
+    """
+    FTLDocument = apps.get_model("core", "FTLDocument")
+    FTLDocumentBlob = apps.get_model("core", "FTLDocumentBlob")
+
+    documents = (
+        FTLDocument.objects.filter(
+            deleted=False, md5__isnull=False, binary__isnull=False
+        )
+        .exclude(binary="")
+        .order_by("org_id", "md5", "size", "created")
+        .distinct("org_id", "md5", "size")
+        .only("id", "org_id", "md5", "size", "binary")
+    )
+
+    for document in documents.iterator():
+        blob = FTLDocumentBlob.objects.create(
+            org_id=document.org_id,
+            md5=document.md5,
+            size=document.size,
+            binary=document.binary.name,
+            refs=1,
+        )
+        FTLDocument.objects.filter(pk=document.pk).update(blob=blob)
@@ -0,0 +1,80 @@
+#  Copyright (c) 2021 Exotic Matter SAS. All rights reserved.
+#  Licensed under the Business Source License. See LICENSE at project root for more information.
+
+import time
+
+from django.core.management import BaseCommand
+from django.db import connection
+from django.utils.translation import gettext as _
+
+INDEX_NAME = "core_ftldoc_tsvector_gin"
+INDEX_TABLE = "core_ftldocument"
+INDEX_DEFINITION = "USING gin (tsvector) WHERE deleted = false"
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the documents search index (GIN on tsvector) without locking the documents table. "
+        "Run it before `migrate` on instances with a lot of documents, the migration will then skip the index creation."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rebuild",
+            action="store_true",
+            help="Drop and recreate the index even if it already exists",
+        )
+
+    def handle(self, *args, **options):
+        # CREATE INDEX CONCURRENTLY can't be executed inside a transaction block (eg. during tests)
+        concurrently = "" if connection.in_atomic_block else "CONCURRENTLY "
+
+        with connection.cursor() as cursor:
+            valid = self._index_valid(cursor)
+
+            # A failed concurrent build leaves an invalid index behind which is never used by PgSQL
+            if valid is False or (valid is not None and options["rebuild"]):
+                self.stdout.write(
+                    self.style.MIGRATE_HEADING(
+                        _("Dropping index %(name)s") % {"name": INDEX_NAME}
+                    )
+                )
+                cursor.execute(f"DROP INDEX {concurrently}IF EXISTS {INDEX_NAME}")
+            elif valid:
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        _("Index %(name)s already exists") % {"name": INDEX_NAME}
+                    )
+                )
+                return
+
+            self.stdout.write(
+                self.style.MIGRATE_HEADING(
+                    _("Building index %(name)s (may take a while)")
+                    % {"name": INDEX_NAME}
+                )
+            )
+
+            start_time = time.time()
+            cursor.execute(
+                f"CREATE INDEX {concurrently}IF NOT EXISTS {INDEX_NAME} ON {INDEX_TABLE} {INDEX_DEFINITION}"
+            )
+            end_time = time.time()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                _("Index %(name)s built in %(time)s seconds")
+                % {"name": INDEX_NAME, "time": round(end_time - start_time, 2)}
+            )
+        )
+
+    def _index_valid(self, cursor):
+        """
+        Return None if the index doesn't exist, else its validity flag
+        """
+        cursor.execute(
+            "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = %s",
+            [INDEX_NAME],
+        )
+        row = cursor.fetchone()
+        return row[0] if row else None
@@ -1,27 +1,58 @@
 #  Copyright (c) 2020 Exotic Matter SAS. All rights reserved.
 #  Licensed under the Business Source License. See LICENSE at project root for more information.
 
+import hashlib
 import os
-import pathlib
 import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
 
-from django.core.files.base import File
+from django.core.files.base import File, ContentFile
+from django.core.files.storage import default_storage
 from django.core.management import BaseCommand
+from django.db import transaction, IntegrityError
 from django.utils import timezone
 from django.utils.translation import gettext as _
 from django.utils.translation import ngettext
 
-from core.models import FTLFolder, FTLDocument, FTLUser
+from core.chunked_upload import FTLSequentialReader
+from core.mimes import guess_mimetype, mimetype_to_ext
+from core.models import FTLFolder, FTLDocument, FTLUser, FTLDocumentBlob
+from core.processing.proc_pgsql_tsvector import SEARCH_VECTOR
+from core.tasks import apply_ftl_processing_batch, PROCESSING_BATCH_SIZE
+from ftl.enums import FTLPlugins
 
 
 class Command(BaseCommand):
-    help = "Mass import PDF documents and folder tree to FTL"
+    help = (
+        "Mass import documents and folder tree to FTL. Documents are stored in parallel and saved by batches, an "
+        "interrupted import can be resumed by running the same command again (see --checkpoint)."
+    )
     user = None
 
     def add_arguments(self, parser):
         parser.add_argument("-p", "--path", nargs="?", type=str, required=True)
         parser.add_argument("-u", "--email", nargs="?", type=str, required=True)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="Number of documents stored in parallel (default 4)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Number of documents saved and submitted for processing at once (default 100)",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            type=str,
+            default=None,
+            help="File listing the already imported documents, to resume an interrupted import, deleted once all the "
+            "documents are imported (default .import_docs.<key>.checkpoint in current directory, the key is derived "
+            "from the org, the user and the imported path)",
+        )
 
     def handle(self, *args, **options):
         self.stdout.write(
@@ -31,10 +62,41 @@ class Command(BaseCommand):
             )
         )
 
-        self.user = FTLUser.objects.get(email=options["email"])
+        # Org is loaded once, documents are prepared in worker threads without database access
+        self.user = FTLUser.objects.select_related("org").get(email=options["email"])
+        self.batch_size = options["batch_size"]
+        self.imported_count = 0
+        self.failed_count = 0
+        self.batch = list()
+        self._futures_paths = dict()
+        # Binaries stored but not yet used by a saved document
+        self._unsaved_binaries = set()
+
+        checkpoint_path = options["checkpoint"] or self._get_default_checkpoint_path(
+            options["path"]
+        )
+        self.imported_paths = self._read_checkpoint(checkpoint_path)
+        if self.imported_paths:
+            self.stdout.write(
+                self.style.MIGRATE_HEADING(
+                    ngettext(
+                        "Resuming import, one document already imported",
+                        "Resuming import, %(count)s documents already imported",
+                        len(self.imported_paths),
+                    )
+                    % {"count": len(self.imported_paths)}
+                )
+            )
 
         start_time = time.time()
-        count = self._explore_and_import(options["path"])
+
+        try:
+            self._import(options["path"], checkpoint_path, options["workers"])
+        except BaseException:
+            # Interrupted import or failed batch, documents not saved are stored again when resuming
+            self._delete_unsaved_binaries()
+            raise
+
         end_time = time.time()
 
         self.stdout.write(
@@ -42,54 +104,316 @@ class Command(BaseCommand):
                 ngettext(
                     "One document successfully imported in %(time)s",
                     "%(count)s documents successfully imported in %(time)s",
-                    count,
+                    self.imported_count,
                 )
-                % {"count": count, "time": round(end_time - start_time, 2)}
+                % {
+                    "count": self.imported_count,
+                    "time": round(end_time - start_time, 2),
+                }
             )
         )
 
-    def _explore_and_import(self, path, ftl_parent_folder=None, count=0):
-        items_to_import = os.scandir(path)
-        _count = count
+        if not self.failed_count:
+            # Import done, a next import of the same tree starts over
+            os.remove(checkpoint_path)
+        else:
+            self.stdout.write(
+                self.style.ERROR(
+                    ngettext(
+                        "One document could not be imported, run the command again to retry",
+                        "%(count)s documents could not be imported, run the command again to retry",
+                        self.failed_count,
+                    )
+                    % {"count": self.failed_count}
+                )
+            )
 
-        for item in items_to_import:
-            if item.is_dir():
-                folder = FTLFolder()
-                folder.name = item.name
-                folder.parent = ftl_parent_folder
-                folder.org = self.user.org
-                folder.save()
+    def _import(self, path, checkpoint_path, workers):
+        with open(checkpoint_path, "a") as self.checkpoint, ThreadPoolExecutor(
+            max_workers=workers
+        ) as executor:
+            # Limit the number of documents waiting to be stored, to not walk the whole tree in advance
+            max_pending = workers * 2
+            pending = set()
 
-                self.stdout.write(
-                    self.style.SUCCESS(
-                        _("Created folder %(name)s") % {"name": item.name}
-                    )
+            for document_path, ftl_folder in self._explore(path):
+                if document_path in self.imported_paths:
+                    continue
+
+                future = executor.submit(
+                    self._store_document, document_path, ftl_folder
                 )
+                self._futures_paths[future] = document_path
+                pending.add(future)
 
-                _count += self._explore_and_import(item.path, folder, count)
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    self._collect(done)
 
-            elif item.is_file():
-                file = item
+            self._collect(pending)
+            self._save_batch()
 
-                if pathlib.Path(file.path).suffix.lower() == ".pdf":
+    def _explore(self, path, ftl_parent_folder=None):
+        """
+        Walk the tree and create the folders, yield the files to import with their folder
+        """
+        for item in os.scandir(path):
+            if item.is_dir():
+                # Existing folders are reused when resuming an import
+                folder, created = FTLFolder.objects.get_or_create(
+                    org=self.user.org, parent=ftl_parent_folder, name=item.name
+                )
+
+                if created:
                     self.stdout.write(
                         self.style.SUCCESS(
-                            _("Imported document %(name)s") % {"name": file.name}
+                            _("Created folder %(name)s") % {"name": item.name}
                         )
                     )
 
-                    with open(file.path, "rb") as f:
-                        document = FTLDocument()
-                        document.ftl_folder = ftl_parent_folder
-                        document.ftl_user = self.user
-                        document.binary = File(f)
-                        document.org = self.user.org
-                        document.title = file.name
-                        document.created = timezone.make_aware(
-                            datetime.fromtimestamp(int(os.path.getmtime(file.path))),
-                            timezone.get_current_timezone(),
-                        )
-                        document.save()
-                        _count += 1
+                yield from self._explore(item.path, folder)
+
+            elif item.is_file():
+                yield os.path.abspath(item.path), ftl_parent_folder
+
+    def _store_document(self, path, ftl_folder):
+        """
+        Run in worker threads, store the document binary and return the document to save (no database access here).
+        Return None if the document type isn't supported.
+        """
+        with open(path, "rb") as f:
+            mime = guess_mimetype(f, filename=path)
+            extension = mimetype_to_ext(mime)
+            if not extension:
+                return None
+
+            f.seek(0)
+            size = os.fstat(f.fileno()).st_size
+
+            document = FTLDocument()
+            document.ftl_folder = ftl_folder
+            document.ftl_user = self.user
+            document.org = self.user.org
+            document.title = os.path.basename(path)
+            document.created = timezone.make_aware(
+                datetime.fromtimestamp(int(os.path.getmtime(path))),
+                timezone.get_current_timezone(),
+            )
+            document.type = mime
+            document.size = size
+
+            # The md5 is computed while the document is stored, the file is read only once
+            reader = FTLSequentialReader([f], size)
+            document.binary.name = f"document{extension}"
+            document.binary.save(document.binary.name, File(reader), save=False)
+            document.md5 = reader.hexdigest()
+
+        return document
+
+    def _collect(self, futures):
+        for future in futures:
+            path = self._futures_paths.pop(future, None)
+
+            try:
+                document = future.result()
+            except Exception as e:
+                self.failed_count += 1
+                self.stderr.write(
+                    _("Could not import %(path)s: %(error)s")
+                    % {"path": path, "error": e}
+                )
+                continue
+
+            if document is None:
+                self.stdout.write(
+                    self.style.WARNING(
+                        _("Skipped unsupported document %(path)s") % {"path": path}
+                    )
+                )
+                continue
+
+            self._unsaved_binaries.add(document.binary.name)
+            self.batch.append((path, document))
+            if len(self.batch) >= self.batch_size:
+                self._save_batch()
+
+    def _save_batch(self):
+        if not self.batch:
+            return
+
+        paths = [path for path, document in self.batch]
+        documents = [document for path, document in self.batch]
+
+        with transaction.atomic():
+            duplicate_documents = self._share_blobs(documents)
+            processed_documents = self._reuse_processing_results(duplicate_documents)
+            FTLDocument.objects.bulk_create(documents)
+
+            if processed_documents:
+                # Title and note may differ from the duplicates, only the search vector has to be computed
+                FTLDocument.objects.filter(
+                    pk__in=[document.pk for document in processed_documents]
+                ).update(tsvector=SEARCH_VECTOR)
+
+        self._unsaved_binaries.difference_update(
+            document.binary.name for document in documents
+        )
+
+        # Only new documents are processed
+        processed_pks = {document.pk for document in processed_documents}
+        documents_to_process = [
+            document for document in documents if document.pk not in processed_pks
+        ]
+        for i in range(0, len(documents_to_process), PROCESSING_BATCH_SIZE):
+            apply_ftl_processing_batch.delay(
+                [
+                    document.pid
+                    for document in documents_to_process[i : i + PROCESSING_BATCH_SIZE]
+                ],
+                force=[FTLPlugins.LANG_DETECTOR_LANGID],
+            )
+
+        # Documents are only marked as imported once saved
+        self.checkpoint.write("".join(f"{path}\n" for path in paths))
+        self.checkpoint.flush()
+
+        self.imported_count += len(documents)
+        self.batch = list()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                ngettext(
+                    "One document imported",
+                    "%(count)s documents imported",
+                    self.imported_count,
+                )
+                % {"count": self.imported_count}
+            )
+        )
+
+    def _share_blobs(self, documents):
+        """
+        Documents already in the org (or in the batch) share the existing binary (see `FTLDocumentBlob`). Return the
+        documents using the binary of a document saved before the batch.
+        """
+        org = self.user.org
+        blobs = {
+            (blob.md5, blob.size): blob
+            for blob in FTLDocumentBlob.objects.select_for_update().filter(
+                org=org, md5__in={document.md5 for document in documents}
+            )
+        }
+
+        new_blobs = dict()
+        for document in documents:
+            key = (document.md5, document.size)
+            if key not in blobs and key not in new_blobs:
+                new_blobs[key] = FTLDocumentBlob(
+                    org=org,
+                    md5=document.md5,
+                    size=document.size,
+                    binary=document.binary.name,
+                    refs=0,
+                )
+
+        try:
+            with transaction.atomic():
+                FTLDocumentBlob.objects.bulk_create(new_blobs.values())
+            blobs.update(new_blobs)
+        except IntegrityError:
+            # Identical documents uploaded concurrently, the new binaries of this batch are not shared
+            pass
+
+        used_blobs = set()
+        duplicate_documents = list()
+        for document in documents:
+            key = (document.md5, document.size)
+            blob = blobs.get(key)
+            if not blob:
+                continue
+
+            if document.binary.name != blob.binary.name:
+                default_storage.delete(document.binary.name)
+                self._unsaved_binaries.discard(document.binary.name)
+                document.binary = blob.binary.name
+
+            if key not in new_blobs:
+                duplicate_documents.append(document)
+
+            document.blob = blob
+            blob.refs += 1
+            used_blobs.add(blob)
+
+        FTLDocumentBlob.objects.bulk_update(used_blobs, ["refs"])
+
+        return duplicate_documents
+
+    @staticmethod
+    def _reuse_processing_results(documents):
+        """
+        Copy the processing results of the latest identical document, like an upload does (see `use_document_blob`).
+        Return the documents which don't need to be processed.
+        """
+        latest_duplicates = {
+            duplicate.blob_id: duplicate
+            for duplicate in FTLDocument.objects.filter(
+                blob__in={document.blob_id for document in documents}, deleted=False
+            )
+            .order_by("blob_id", "-created")
+            .distinct("blob_id")
+        }
+
+        processed_documents = list()
+        for document in documents:
+            processed_doc = latest_duplicates.get(document.blob_id)
+            if not processed_doc or not processed_doc.tsvector:
+                continue
+
+            document.content_text = processed_doc.content_text
+            document.language = processed_doc.language
+            document.count_pages = processed_doc.count_pages
+            document.ocrized = processed_doc.ocrized
+
+            if processed_doc.thumbnail_binary:
+                with processed_doc.thumbnail_binary.open("rb") as f:
+                    document.thumbnail_binary = ContentFile(f.read(), "thumb.png")
+
+            processed_documents.append(document)
+
+        return processed_documents
+
+    def _delete_unsaved_binaries(self):
+        # Documents stored by the workers but not collected yet
+        for future in self._futures_paths:
+            if not future.cancelled() and future.exception() is None:
+                document = future.result()
+                if document is not None:
+                    self._unsaved_binaries.add(document.binary.name)
+
+        for name in self._unsaved_binaries:
+            try:
+                default_storage.delete(name)
+            except Exception as e:
+                # except is very broad but it can be anything depending of the storage backend
+                self.stderr.write(
+                    _("Could not delete %(name)s: %(error)s")
+                    % {"name": name, "error": e}
+                )
+        self._unsaved_binaries = set()
+
+    def _get_default_checkpoint_path(self, path):
+        """
+        Checkpoint of the import of `path` for the user, imports of the same tree for other users or orgs don't share it
+        """
+        key = hashlib.sha1(
+            f"{self.user.org_id}:{self.user.id}:{os.path.abspath(path)}".encode("utf-8")
+        ).hexdigest()[:16]
+        return f".import_docs.{key}.checkpoint"
+
+    @staticmethod
+    def _read_checkpoint(checkpoint_path):
+        if not os.path.exists(checkpoint_path):
+            return set()
 
-        return _count
+        with open(checkpoint_path, "r") as f:
+            return {line.rstrip("\n") for line in f if line.strip()}
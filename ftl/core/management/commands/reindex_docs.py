@@ -2,13 +2,15 @@
 #  Licensed under the Business Source License. See LICENSE at project root for more information.
 
 import time
+from itertools import islice
 
+from celery import group
 from django.core.management import BaseCommand
 from django.utils.translation import gettext as _
 from django.utils.translation import ngettext
 
 from core.models import FTLDocument
-from core.tasks import apply_ftl_processing
+from core.tasks import apply_ftl_processing_batch, PROCESSING_BATCH_SIZE
 from ftl.enums import FTLPlugins
 
 
@@ -37,6 +39,21 @@ class Command(BaseCommand):
             " ftl.enums.FTLPlugins",
         )
 
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Number of documents fetched from the database and submitted at once (default 500)",
+        )
+
+        parser.add_argument(
+            "--rate",
+            type=float,
+            default=50,
+            help="Maximum number of documents submitted per second, to not flood the processing queue "
+            "(default 50, 0 to disable)",
+        )
+
     def handle(self, *args, **options):
         pids = options["docs_pid"][0]
         all_docs = "*" in pids
@@ -69,10 +86,8 @@ class Command(BaseCommand):
             )
             query = query.filter(pid__in=pids)
 
-        docs = query
-
         start_time = time.time()
-        documents_count = len(docs)
+        documents_count = query.count()
 
         self.stdout.write(
             self.style.MIGRATE_HEADING(
@@ -85,14 +100,30 @@ class Command(BaseCommand):
             )
         )
 
-        for doc in docs:
-            self.stdout.write(
-                _("Submitted for reindexing %(title)s") % {"title": doc.title}
-            )
-            apply_ftl_processing.delay(
-                doc.pid, doc.org.pk, doc.ftl_user.pk, force=plugins_forced
-            )
-            self.stdout.write(self.style.SUCCESS(_("OK")))
+        # Only the pids are fetched, by chunks, documents are never loaded in memory all at once
+        batch_size = options["batch_size"]
+        docs_pids = query.values_list("pid", flat=True).iterator(chunk_size=batch_size)
+
+        submitted_count = 0
+        while True:
+            batch = list(islice(docs_pids, batch_size))
+            if not batch:
+                break
+
+            # Each task processes several documents, all the tasks of a batch are published with the same broker
+            # connection
+            group(
+                [
+                    apply_ftl_processing_batch.s(
+                        batch[i : i + PROCESSING_BATCH_SIZE], force=plugins_forced
+                    )
+                    for i in range(0, len(batch), PROCESSING_BATCH_SIZE)
+                ]
+            ).apply_async()
+            submitted_count += len(batch)
+
+            self._throttle(start_time, submitted_count, options["rate"])
+            self._print_progress(start_time, submitted_count, documents_count)
 
         end_time = time.time()
 
@@ -101,8 +132,37 @@ class Command(BaseCommand):
                 ngettext(
                     "One document successfully submitted for reindexing in %(time)s seconds",
                     "%(count)s documents successfully submitted for reindexing in %(time)s seconds",
-                    documents_count,
+                    submitted_count,
                 )
-                % {"count": documents_count, "time": round(end_time - start_time, 2)}
+                % {"count": submitted_count, "time": round(end_time - start_time, 2)}
+            )
+        )
+
+    @staticmethod
+    def _throttle(start_time, submitted_count, rate):
+        if not rate:
+            return
+
+        delay = submitted_count / rate - (time.time() - start_time)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _print_progress(self, start_time, submitted_count, documents_count):
+        elapsed = time.time() - start_time
+        # Documents created during the reindexing are submitted too
+        remaining_count = max(documents_count - submitted_count, 0)
+        eta = elapsed / submitted_count * remaining_count
+
+        self.stdout.write(
+            _(
+                "Submitted %(submitted)s/%(total)s documents (%(percent)s%%), ETA %(eta)s seconds"
             )
+            % {
+                "submitted": submitted_count,
+                "total": documents_count,
+                "percent": min(
+                    round(submitted_count * 100 / max(documents_count, 1)), 100
+                ),
+                "eta": round(eta),
+            }
         )
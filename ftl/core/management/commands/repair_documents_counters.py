@@ -0,0 +1,52 @@
+#  Copyright (c) 2021 Exotic Matter SAS. All rights reserved.
+#  Licensed under the Business Source License. See LICENSE at project root for more information.
+
+import time
+
+from django.core.management import BaseCommand
+from django.utils.translation import gettext as _
+from django.utils.translation import ngettext
+
+from core.models import FTLDocument, DOCUMENT_COUNTERS, refresh_documents_counters
+
+
+class Command(BaseCommand):
+    help = "Recompute documents reminders and shares counters"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--org",
+            type=str,
+            help="Only repair documents of the organization with this slug",
+        )
+
+    def handle(self, *args, **options):
+        query = FTLDocument.objects.all()
+
+        if options["org"]:
+            self.stdout.write(
+                self.style.MIGRATE_HEADING(
+                    _("Repairing documents counters for org %(org)s")
+                    % {"org": options["org"]}
+                )
+            )
+            query = query.filter(org__slug=options["org"])
+        else:
+            self.stdout.write(
+                self.style.MIGRATE_HEADING(_("Repairing ALL documents counters"))
+            )
+
+        start_time = time.time()
+        documents_count = refresh_documents_counters(query, DOCUMENT_COUNTERS)
+        end_time = time.time()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                ngettext(
+                    "One document repaired in %(time)s seconds",
+                    "%(count)s documents repaired in %(time)s seconds",
+                    documents_count,
+                )
+                % {"count": documents_count, "time": round(end_time - start_time, 2)}
+            )
+        )
@@ -0,0 +1,39 @@
+#  Copyright (c) 2021 Exotic Matter SAS. All rights reserved.
+#  Licensed under the Business Source License. See LICENSE at project root for more information.
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+from django.db.models import Q
+
+
+class Migration(migrations.Migration):
+    """
+    The index is created with `IF NOT EXISTS` so instances with a lot of documents can build it without locking
+    `core_ftldocument` by running `python manage.py create_search_index` before applying this migration.
+    """
+
+    dependencies = [
+        ("core", "0014_auto_20201223_1015"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    sql="CREATE INDEX IF NOT EXISTS core_ftldoc_tsvector_gin ON core_ftldocument "
+                    "USING gin (tsvector) WHERE deleted = false",
+                    reverse_sql="DROP INDEX IF EXISTS core_ftldoc_tsvector_gin",
+                ),
+            ],
+            state_operations=[
+                migrations.AddIndex(
+                    model_name="ftldocument",
+                    index=django.contrib.postgres.indexes.GinIndex(
+                        condition=Q(deleted=False),
+                        fields=["tsvector"],
+                        name="core_ftldoc_tsvector_gin",
+                    ),
+                ),
+            ],
+        ),
+    ]
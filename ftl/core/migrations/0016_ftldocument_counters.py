@@ -0,0 +1,29 @@
+#  Copyright (c) 2021 Exotic Matter SAS. All rights reserved.
+#  Licensed under the Business Source License. See LICENSE at project root for more information.
+
+from django.db import migrations, models
+
+from core.ftl_migration_tool import update_documents_counters
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0015_ftldocument_tsvector_gin"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ftldocument",
+            name="reminders_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="ftldocument",
+            name="shares_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(
+            update_documents_counters, reverse_code=migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,60 @@
+#  Copyright (c) 2021 Exotic Matter SAS. All rights reserved.
+#  Licensed under the Business Source License. See LICENSE at project root for more information.
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from core.ftl_migration_tool import create_documents_blobs
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0017_ftldocumentupload"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FTLDocumentBlob",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("md5", models.CharField(max_length=32)),
+                ("size", models.BigIntegerField()),
+                ("binary", models.FileField(max_length=256, upload_to="")),
+                ("refs", models.IntegerField(default=0)),
+                (
+                    "org",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="core.FTLOrg",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="ftldocumentblob",
+            constraint=models.UniqueConstraint(
+                fields=("org", "md5", "size"), name="one_blob_per_content"
+            ),
+        ),
+        migrations.AddField(
+            model_name="ftldocument",
+            name="blob",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                to="core.FTLDocumentBlob",
+            ),
+        ),
+        migrations.RunPython(
+            create_documents_blobs, reverse_code=migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,75 @@
+#  Copyright (c) 2021 Exotic Matter SAS. All rights reserved.
+#  Licensed under the Business Source License. See LICENSE at project root for more information.
+
+import uuid
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.fields.jsonb
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0018_ftldocumentblob"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FTLOCRJob",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "pid",
+                    models.UUIDField(db_index=True, default=uuid.uuid4, editable=False),
+                ),
+                ("plugin", models.CharField(max_length=255)),
+                ("job_id", models.TextField()),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("done", "Done"),
+                            ("failed", "Failed"),
+                        ],
+                        db_index=True,
+                        default="pending",
+                        max_length=16,
+                    ),
+                ),
+                (
+                    "force",
+                    django.contrib.postgres.fields.jsonb.JSONField(default=bool),
+                ),
+                (
+                    "resume_plugins",
+                    django.contrib.postgres.fields.ArrayField(
+                        base_field=models.CharField(max_length=255),
+                        default=list,
+                        size=None,
+                    ),
+                ),
+                ("created", models.DateTimeField(default=django.utils.timezone.now),),
+                ("edited", models.DateTimeField(auto_now=True)),
+                (
+                    "ftl_doc",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="ocr_jobs",
+                        to="core.FTLDocument",
+                    ),
+                ),
+            ],
+        ),
+    ]
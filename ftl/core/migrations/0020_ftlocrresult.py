@@ -0,0 +1,56 @@
+#  Copyright (c) 2021 Exotic Matter SAS. All rights reserved.
+#  Licensed under the Business Source License. See LICENSE at project root for more information.
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0019_ftlocrjob"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FTLOCRResult",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("md5", models.CharField(max_length=32)),
+                ("size", models.BigIntegerField()),
+                ("plugin", models.CharField(max_length=255)),
+                ("config", models.CharField(blank=True, max_length=255)),
+                ("content_text", models.TextField(blank=True)),
+                ("text_size", models.IntegerField(default=0)),
+                ("created", models.DateTimeField(default=django.utils.timezone.now),),
+                (
+                    "last_used",
+                    models.DateTimeField(
+                        db_index=True, default=django.utils.timezone.now
+                    ),
+                ),
+                (
+                    "org",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="core.FTLOrg",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="ftlocrresult",
+            constraint=models.UniqueConstraint(
+                fields=("org", "md5", "size", "plugin", "config"),
+                name="one_ocr_result_per_content",
+            ),
+        ),
+    ]
@@ -0,0 +1,31 @@
+#  Copyright (c) 2021 Exotic Matter SAS. All rights reserved.
+#  Licensed under the Business Source License. See LICENSE at project root for more information.
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0021_ftldocument_ocr_retry_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FTLDirectUpload",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=256, unique=True)),
+                ("created", models.DateTimeField(default=django.utils.timezone.now),),
+            ],
+        ),
+    ]
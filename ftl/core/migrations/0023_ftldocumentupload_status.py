@@ -0,0 +1,38 @@
+#  Copyright (c) 2021 Exotic Matter SAS. All rights reserved.
+#  Licensed under the Business Source License. See LICENSE at project root for more information.
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0022_ftldirectupload"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ftldocumentupload",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("uploading", "Uploading"),
+                    ("assembling", "Assembling"),
+                    ("assembled", "Assembled"),
+                    ("failed", "Failed"),
+                ],
+                default="uploading",
+                max_length=16,
+            ),
+        ),
+        migrations.AddField(
+            model_name="ftldocumentupload",
+            name="binary",
+            field=models.CharField(max_length=256, null=True),
+        ),
+        migrations.AddField(
+            model_name="ftldocumentupload",
+            name="error",
+            field=models.CharField(max_length=64, null=True),
+        ),
+    ]
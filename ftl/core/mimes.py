@@ -10,6 +10,8 @@ from django.core.files.uploadedfile import UploadedFile
 
 MIMETYPES_EXT_DICT = {}
 EXTS = []
+# Number of bytes read at the start and at the end of a file to guess its mimetype
+MIME_SAMPLE_SIZE = 8096
 
 for ext, mimes in settings.FTL_SUPPORTED_DOCUMENTS_TYPES.items():
     _ext = ext.lower()
@@ -44,11 +46,25 @@ def guess_mimetype(uploaded_file: UploadedFile, filename: str = None) -> Optiona
             ][0]
 
 
+def guess_mimetype_from_name(filename: str, mime: str = None) -> Optional[str]:
+    """
+    Guess mimetype when the file content isn't available yet, `mime` is returned if supported.
+    """
+    if mimetype_to_ext(mime):
+        return mime
+
+    suffix = Path(filename).suffix.lower() if filename else None
+    if suffix in EXTS:
+        return settings.FTL_SUPPORTED_DOCUMENTS_TYPES[suffix][0]
+
+    return None
+
+
 def _uploaded_file_obj_to_buffer(
-    uploaded_file: UploadedFile, sample_size: int = 8096
+    uploaded_file: UploadedFile, sample_size: int = MIME_SAMPLE_SIZE
 ) -> (bytes, bytes):
     """
-    Optimize memory usage by only returning the first and last 8096 bytes (default).
+    Optimize memory usage by only returning the first and last MIME_SAMPLE_SIZE bytes (default).
     """
     head = uploaded_file.read(sample_size)
     try:
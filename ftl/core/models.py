@@ -9,12 +9,25 @@ from django.conf import settings
 from django.contrib.auth.base_user import BaseUserManager
 from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User, AbstractUser, Permission
+from django.contrib.postgres.fields import ArrayField, JSONField
 from django.contrib.postgres.fields.citext import CICharField
+from django.contrib.postgres.indexes import GinIndex
 from django.contrib.postgres.search import SearchVectorField
 from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
 from django.core.validators import EmailValidator
-from django.db import models
-from django.db.models import UniqueConstraint, Q, ForeignKey
+from django.db import models, transaction, IntegrityError
+from django.db.models import (
+    UniqueConstraint,
+    Q,
+    ForeignKey,
+    F,
+    Subquery,
+    OuterRef,
+    Count,
+)
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save, post_delete
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from mptt.fields import TreeForeignKey
@@ -202,19 +215,66 @@ class FTLDocument(models.Model):
     deleted = models.BooleanField(default=False)
     ocrized = models.BooleanField(default=False)
     ocr_retry = models.IntegerField(default=0)
+    # Next retry of a failed OCR (see `record_ocr_failure`), None if no retry is scheduled
+    ocr_retry_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    # Paths of the failed OCR plugins
+    ocr_retry_plugins = ArrayField(
+        models.CharField(max_length=255), default=list, blank=True
+    )
     type = models.CharField(max_length=255, default="application/pdf")
+    # Denormalized counters to avoid aggregation when listing documents (see `DOCUMENT_COUNTERS`)
+    reminders_count = models.IntegerField(default=0)
+    shares_count = models.IntegerField(default=0)
+    # Binary shared with the documents of the org having the same content (see `FTLDocumentBlob`)
+    blob = models.ForeignKey(
+        "FTLDocumentBlob", on_delete=models.SET_NULL, null=True, blank=True
+    )
 
     class Meta:
         indexes = [
             models.Index(fields=["org", "pid"]),
             models.Index(fields=["org", "ftl_folder"]),
-            # TODO tsvector index missing
-            # GinIndex(fields=['tsvector']),
+            # Partial index used by the documents search, deleted documents are never searched.
+            # On large instances, build it with `create_search_index` before migrating (see the command help).
+            GinIndex(
+                fields=["tsvector"],
+                condition=Q(deleted=False),
+                name="core_ftldoc_tsvector_gin",
+            ),
         ]
 
     def __str__(self):
         return str(self.pid)
 
+    @property
+    def thumbnail_version(self):
+        """Thumbnails names are random, a new thumbnail always gets a new version"""
+        if not self.thumbnail_binary:
+            return None
+        return pathlib.Path(self.thumbnail_binary.name).stem
+
+    def save(
+        self, force_insert=False, force_update=False, using=None, update_fields=None
+    ):
+        """
+        Counters are only updated in SQL (see `DOCUMENT_COUNTERS`), they are not saved with the other fields unless
+        listed in `update_fields`, so saving an instance loaded earlier doesn't overwrite them with stale values.
+        """
+        if update_fields is None and not force_insert and not self._state.adding:
+            update_fields = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in DOCUMENT_COUNTERS.values()
+            ]
+
+        super().save(
+            force_insert=force_insert,
+            force_update=force_update,
+            using=using,
+            update_fields=update_fields,
+        )
+
     def mark_delete(self, async_delete=True, *args, **kwargs):
         self.deleted = True
         self.ftl_folder = None
@@ -234,6 +294,10 @@ class FTLDocument(models.Model):
         binary = self.binary
         thumbnail_binary = self.thumbnail_binary
 
+        # Binary still used by other documents
+        if self.blob_id and release_document_blob(self.blob_id):
+            binary = None
+
         if binary:
             try:
                 binary.delete(False)
@@ -273,6 +337,100 @@ class FTLDocument(models.Model):
         return super().delete(*args, **kwargs)
 
 
+# Content addressed binary of the documents, identical documents of an org share the same stored binary
+class FTLDocumentBlob(models.Model):
+    org = models.ForeignKey("FTLOrg", on_delete=models.CASCADE)
+    md5 = models.CharField(max_length=32)
+    size = models.BigIntegerField()
+    binary = models.FileField(max_length=256)
+    # Number of documents using this binary, deleted with the last document
+    refs = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.md5} ({self.refs})"
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(
+                fields=["org", "md5", "size"], name="one_blob_per_content"
+            ),
+        ]
+
+
+def use_document_blob(ftl_doc):
+    """
+    Make a new document use the binary of the identical documents of its org, if any. To be called before saving the
+    document, so its binary isn't stored twice.
+    Return a document of the same content which can be used to copy the processing results, None if there is none.
+    """
+    blob = (
+        FTLDocumentBlob.objects.select_for_update()
+        .filter(org=ftl_doc.org, md5=ftl_doc.md5, size=ftl_doc.size)
+        .first()
+    )
+    if not blob:
+        return None
+
+    # Binary already stored (direct and chunked uploads)
+    if (
+        ftl_doc.binary
+        and ftl_doc.binary._committed
+        and ftl_doc.binary.name != blob.binary.name
+    ):
+        ftl_doc.binary.delete(False)
+
+    ftl_doc.binary = blob.binary.name
+    ftl_doc.blob = blob
+    FTLDocumentBlob.objects.filter(pk=blob.pk).update(refs=F("refs") + 1)
+
+    return (
+        FTLDocument.objects.filter(blob=blob, deleted=False)
+        .exclude(pk=ftl_doc.pk)
+        .order_by("-created")
+        .first()
+    )
+
+
+def create_document_blob(ftl_doc):
+    """
+    Register the binary of a saved document, so next identical documents of its org will use it
+    """
+    try:
+        with transaction.atomic():
+            blob = FTLDocumentBlob.objects.create(
+                org=ftl_doc.org,
+                md5=ftl_doc.md5,
+                size=ftl_doc.size,
+                binary=ftl_doc.binary.name,
+                refs=1,
+            )
+    except IntegrityError:
+        # An identical document has been uploaded concurrently, this one keeps its own binary
+        return None
+
+    FTLDocument.objects.filter(pk=ftl_doc.pk).update(blob=blob)
+    ftl_doc.blob = blob
+    return blob
+
+
+def release_document_blob(blob_id):
+    """
+    Release the binary of a deleted document. Return True if the binary is still used by other documents.
+    """
+    with transaction.atomic():
+        blob = FTLDocumentBlob.objects.select_for_update().filter(pk=blob_id).first()
+        if not blob:
+            return False
+
+        blob.refs -= 1
+        if blob.refs > 0:
+            blob.save(update_fields=["refs"])
+            return True
+
+        blob.delete()
+        return False
+
+
 # FTL Folders
 class FTLFolder(MPTTModel):
     org = models.ForeignKey("FTLOrg", on_delete=models.CASCADE)
@@ -315,6 +473,34 @@ class FTLFolder(MPTTModel):
         ]
 
 
+def get_folders_paths(folders):
+    """
+    Resolve the path (ancestors including self, root first) of several folders with a single query, using MPTT
+    `tree_id` / `lft` / `rght` ranges instead of one `get_ancestors()` query per folder.
+    Return a dict of folder id -> list of FTLFolder.
+    """
+    folders = {folder.id: folder for folder in folders if folder}
+    if not folders:
+        return dict()
+
+    filters = Q()
+    for folder in folders.values():
+        filters |= Q(tree_id=folder.tree_id, lft__lte=folder.lft, rght__gte=folder.rght)
+
+    ancestors = list(FTLFolder.objects.filter(filters).order_by("tree_id", "lft"))
+
+    return {
+        folder.id: [
+            ancestor
+            for ancestor in ancestors
+            if ancestor.tree_id == folder.tree_id
+            and ancestor.lft <= folder.lft
+            and ancestor.rght >= folder.rght
+        ]
+        for folder in folders.values()
+    }
+
+
 # FTL Document sharing
 class FTLDocumentSharing(models.Model):
     pid = models.UUIDField(default=uuid.uuid4, editable=False, db_index=True)
@@ -363,6 +549,186 @@ class FTLDocumentReminder(models.Model):
         ]
 
 
+# Pending resumable upload, the document is created once all the chunks have been received
+class FTLDocumentUpload(models.Model):
+    UPLOADING = "uploading"
+    # The chunks are being assembled by `core.tasks.assemble_chunked_upload`
+    ASSEMBLING = "assembling"
+    ASSEMBLED = "assembled"
+    FAILED = "failed"
+    STATUSES = [
+        (UPLOADING, "Uploading"),
+        (ASSEMBLING, "Assembling"),
+        (ASSEMBLED, "Assembled"),
+        (FAILED, "Failed"),
+    ]
+
+    pid = models.UUIDField(default=uuid.uuid4, editable=False, db_index=True)
+    org = models.ForeignKey("FTLOrg", on_delete=models.CASCADE)
+    ftl_user = models.ForeignKey("FTLUser", on_delete=models.CASCADE)
+    filename = models.TextField()
+    type = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    # Offsets of the received chunks, each chunk is stored separately until the upload is finalized
+    chunks = ArrayField(models.BigIntegerField(), default=list)
+    md5 = models.CharField(max_length=32, null=True)
+    status = models.CharField(max_length=16, choices=STATUSES, default=UPLOADING)
+    # Name of the document stored from the chunks, once assembled
+    binary = models.CharField(max_length=256, null=True)
+    # Error code of a failed assembly, returned when the upload is finalized
+    error = models.CharField(max_length=64, null=True)
+    created = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return str(self.pid)
+
+    def get_chunk_name(self, offset):
+        return f"uploads/chunks/{self.pid}/{offset:012d}"
+
+    def delete(self, *args, **kwargs):
+        """Override to ensure chunks and assembled document files are deleted"""
+        names = [self.get_chunk_name(offset) for offset in self.chunks]
+        if self.binary:
+            names.append(self.binary)
+
+        for name in names:
+            try:
+                default_storage.delete(name)
+            except Exception as e:
+                # except is very broad but it can be anything depending of the storage backend
+                logger.warning("Could not delete upload chunk from storage backend", e)
+
+        return super().delete(*args, **kwargs)
+
+
+# Finalized direct upload, a direct upload token can only be used once (see `core.direct_upload`)
+class FTLDirectUpload(models.Model):
+    # Binary name signed in the token
+    name = models.CharField(max_length=256, unique=True)
+    created = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return self.name
+
+
+# OCR job submitted to an asynchronous OCR service, polled until done to resume the document processing (see
+# `core.tasks.poll_ocr_job`)
+class FTLOCRJob(models.Model):
+    PENDING = "pending"
+    DONE = "done"
+    FAILED = "failed"
+    STATUSES = [
+        (PENDING, "Pending"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    pid = models.UUIDField(default=uuid.uuid4, editable=False, db_index=True)
+    ftl_doc = ForeignKey(
+        "FTLDocument", on_delete=models.CASCADE, db_index=True, related_name="ocr_jobs",
+    )
+    # Path of the OCR plugin, as configured in FTL_DOC_PROCESSING_PLUGINS
+    plugin = models.CharField(max_length=255)
+    job_id = models.TextField()
+    status = models.CharField(
+        max_length=16, choices=STATUSES, default=PENDING, db_index=True
+    )
+    # `force` parameter of the suspended processing (boolean or list of plugins)
+    force = JSONField(default=bool)
+    # Plugins skipped while the OCR is running, applied once the job is done
+    resume_plugins = ArrayField(models.CharField(max_length=255), default=list)
+    created = models.DateTimeField(default=timezone.now)
+    edited = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.ftl_doc} - {self.plugin} ({self.status})"
+
+
+# OCR result of a document content, so reprocessing the document or an identical one doesn't run the OCR again (see
+# `FTLOCRBase`). Least recently used results are evicted when FTL_OCR_CACHE_MAX_SIZE is exceeded.
+class FTLOCRResult(models.Model):
+    org = models.ForeignKey("FTLOrg", on_delete=models.CASCADE)
+    md5 = models.CharField(max_length=32)
+    size = models.BigIntegerField()
+    # Path of the OCR plugin, as configured in FTL_DOC_PROCESSING_PLUGINS
+    plugin = models.CharField(max_length=255)
+    # Plugin configuration affecting the result (eg. languages)
+    config = models.CharField(max_length=255, blank=True)
+    content_text = models.TextField(blank=True)
+    text_size = models.IntegerField(default=0)
+    created = models.DateTimeField(default=timezone.now)
+    last_used = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.md5} - {self.plugin}"
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(
+                fields=["org", "md5", "size", "plugin", "config"],
+                name="one_ocr_result_per_content",
+            ),
+        ]
+
+
+# Related models counted in FTLDocument denormalized counters
+DOCUMENT_COUNTERS = {
+    FTLDocumentReminder: "reminders_count",
+    FTLDocumentSharing: "shares_count",
+}
+
+
+def _increment_document_counter(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counter = DOCUMENT_COUNTERS[sender]
+        FTLDocument.objects.filter(pk=instance.ftl_doc_id).update(
+            **{counter: F(counter) + 1}
+        )
+
+
+def _decrement_document_counter(sender, instance, **kwargs):
+    counter = DOCUMENT_COUNTERS[sender]
+    FTLDocument.objects.filter(pk=instance.ftl_doc_id, **{f"{counter}__gt": 0}).update(
+        **{counter: F(counter) - 1}
+    )
+
+
+for _counted_model in DOCUMENT_COUNTERS:
+    post_save.connect(
+        _increment_document_counter,
+        sender=_counted_model,
+        dispatch_uid=f"increment_{DOCUMENT_COUNTERS[_counted_model]}",
+    )
+    post_delete.connect(
+        _decrement_document_counter,
+        sender=_counted_model,
+        dispatch_uid=f"decrement_{DOCUMENT_COUNTERS[_counted_model]}",
+    )
+
+
+def refresh_documents_counters(documents, counted_models):
+    """
+    Recompute FTLDocument denormalized counters from the related tables in a single UPDATE.
+    `counted_models` is a dict of related model -> counter field name (see `DOCUMENT_COUNTERS`), it's given as
+    parameter to be usable with historical models in migrations.
+    """
+    values = dict()
+    for model, counter in counted_models.items():
+        values[counter] = Coalesce(
+            Subquery(
+                model.objects.filter(ftl_doc_id=OuterRef("pk"))
+                .order_by()
+                .values("ftl_doc_id")
+                .annotate(count=Count("pk"))
+                .values("count")
+            ),
+            0,
+        )
+
+    return documents.update(**values)
+
+
 class FTLModelPermissions(DjangoModelPermissions):
     """
     NOT USED FOR NOW
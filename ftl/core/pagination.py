@@ -0,0 +1,130 @@
+#  Copyright (c) 2021 Exotic Matter SAS. All rights reserved.
+#  Licensed under the Business Source License. See LICENSE at project root for more information.
+import binascii
+import json
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+
+from core.errors import ERROR_CODES_DETAILS, BadRequestError
+
+
+class FTLDocumentPagination(PageNumberPagination):
+    """
+    Default page number pagination, with an opt-in keyset (cursor) mode enabled with `?pagination=cursor`.
+
+    In keyset mode, the position of the last item of the page is stored in the `cursor` query param and the next page
+    is fetched with a `WHERE (field, id) < (value, last_id)` instead of an `OFFSET`. No total count is computed, so
+    the cost of a page doesn't depend on its depth. Only `created` and `title` orderings are supported (eg. not the
+    search rank), other orderings fall back to page number pagination.
+    """
+
+    mode_query_param = "pagination"
+    cursor_query_param = "cursor"
+    keyset_fields = ("created", "title")
+
+    keyset = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        ordering = self._get_keyset_ordering(queryset)
+
+        if request.query_params.get(self.mode_query_param) != "cursor" or not ordering:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.keyset = True
+        self.request = request
+
+        field = ordering.lstrip("-")
+        descending = ordering.startswith("-")
+        lookup = "lt" if descending else "gt"
+
+        # id is used as a tie breaker to get a stable ordering on non unique values (eg. same title)
+        queryset = queryset.order_by(ordering, "-id" if descending else "id")
+
+        encoded_cursor = request.query_params.get(self.cursor_query_param)
+        if encoded_cursor:
+            value, last_id = self._decode_cursor(encoded_cursor, field)
+            queryset = queryset.filter(
+                Q(**{f"{field}__{lookup}": value})
+                | Q(**{field: value, f"id__{lookup}": last_id})
+            )
+
+        # Fetch one more item to know if there is a next page
+        results = list(queryset[: self.page_size + 1])
+        self.page = results[: self.page_size]
+        self.next_cursor = (
+            self._encode_cursor(self.page[-1], field)
+            if len(results) > self.page_size
+            else None
+        )
+
+        return self.page
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+
+        return Response(
+            OrderedDict([("next", self.get_next_link()), ("results", data)])
+        )
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+
+        if not self.next_cursor:
+            return None
+
+        url = remove_query_param(
+            self.request.build_absolute_uri(), self.page_query_param
+        )
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_previous_link(self):
+        if not self.keyset:
+            return super().get_previous_link()
+
+        # Keyset mode only allows to scroll forward
+        return None
+
+    def _get_keyset_ordering(self, queryset):
+        order_by = queryset.query.order_by
+        if order_by and order_by[0].lstrip("-") in self.keyset_fields:
+            return order_by[0]
+
+        return None
+
+    def _encode_cursor(self, instance, field):
+        value = getattr(instance, field)
+        if field == "created":
+            value = value.isoformat()
+
+        payload = json.dumps({"v": value, "id": instance.id})
+        return urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+    def _decode_cursor(self, encoded_cursor, field):
+        try:
+            payload = json.loads(urlsafe_b64decode(encoded_cursor.encode("ascii")))
+            value, last_id = payload["v"], payload["id"]
+
+            # Values are used as is in the query, their types are checked (eg. a list title would be a server error)
+            if not isinstance(value, str) or "\x00" in value:
+                raise ValueError()
+            if not isinstance(last_id, int) or isinstance(last_id, bool):
+                raise ValueError()
+
+            if field == "created":
+                value = parse_datetime(value)
+                if value is None:
+                    raise ValueError()
+
+            return value, last_id
+        except (binascii.Error, ValueError, TypeError, KeyError):
+            raise BadRequestError(
+                ERROR_CODES_DETAILS["ftl_invalid_cursor"], "ftl_invalid_cursor",
+            )
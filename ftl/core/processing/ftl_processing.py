@@ -2,25 +2,67 @@
 #  Licensed under the Business Source License. See LICENSE at project root for more information.
 
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextvars import ContextVar, copy_context
+from datetime import timedelta
+from tempfile import TemporaryFile
 from uuid import UUID
 
+from celery import chord
 from django.conf import settings
-from django.db import transaction
+from django.core import signing
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction, connections, IntegrityError
+from django.urls import reverse
+from django.utils import timezone
 from django.utils.module_loading import import_string
 
-from core.errors import PluginUnsupportedStorage
-from core.models import FTLDocument
+from core.errors import PluginUnsupportedStorage, ProcessingSuspended, OCRFailed
+from core.models import FTLDocument, FTLOCRJob, FTLOCRResult
 from core.signals import pre_ftl_processing
+from ftl import celery
+from ftl.enums import FTLProcessingStages
 
 logger = logging.getLogger(__name__)
 
 
+# Processing context of the document being processed, see `FTLProcessingContext`
+_processing_context = ContextVar("processing_context", default=None)
+
+_JOB_CALLBACK_SIGNING_SALT = "core.processing.job_callback"
+
+
 class FTLDocProcessingBase:
     supported_documents_types = []  # mimetype of supported file format or * for all
+    # Write the document updates as soon as the plugin is done, for results too expensive to be lost if a next plugin
+    # crashes the worker
+    processing_checkpoint = False
+    # Document fields read and written by the plugin, used to run independent plugins concurrently (see
+    # `get_plugins_dependencies`). None runs the plugin after all the previous plugins and before all the next ones.
+    requires = None
+    provides = []
+    # Task (and queue) running the plugin when FTL_DOC_PROCESSING_STAGED is enabled
+    processing_stage = FTLProcessingStages.EXTRACT
 
     def process(self, ftl_doc, force):
         raise NotImplementedError
 
+    def check_health(self):
+        """
+        Called once when the worker process starts, raise an exception if the plugin can't work (eg. clients can't be
+        created). Should not make network calls, to not delay the worker startup.
+        """
+        pass
+
+    def poll_job(self, job_id, ftl_doc):
+        """
+        Plugins submitting a job to an asynchronous service (see `ProcessingSuspended`) return the document updates
+        once the job is done, None while it's running
+        """
+        raise NotImplementedError
+
 
 class FTLDocumentProcessing:
     """
@@ -40,45 +82,176 @@ class FTLDocumentProcessing:
             ):
                 self.plugins.append(my_class())
 
+    def check_health(self):
+        """
+        Check all the plugins and return the names of the failing ones, errors are logged but not raised
+        """
+        failing_plugins = list()
+
+        for plugin in self.plugins:
+            try:
+                plugin.check_health()
+            except Exception:
+                failing_plugins.append(plugin.__class__.__name__)
+                logger.exception(f"Plugin {plugin.__class__.__name__} is not healthy")
+
+        return failing_plugins
+
     def apply_processing(self, ftl_doc, force=False):
-        self._handle(ftl_doc, force=force)
+        """
+        Return the OCR jobs suspending the processing (see `FTLOCRJob`)
+        """
+        ocr_jobs = self._handle(ftl_doc, force=force)
         logger.info(f"{ftl_doc.pid} submitted to docs processing")
+        return ocr_jobs
+
+    def apply_processing_stage(self, ftl_doc, force, plugins_paths):
+        """
+        Apply only the plugins of a processing stage (see `get_stages`), return the OCR jobs suspending the processing
+        """
+        # The next stages don't run while the processing is suspended, their plugins are resumed with the skipped ones
+        pipeline_paths = [get_plugin_path(plugin) for plugin in self.plugins]
+        last_index = max(
+            [
+                pipeline_paths.index(path)
+                for path in plugins_paths
+                if path in pipeline_paths
+            ],
+            default=len(pipeline_paths),
+        )
+
+        ocr_jobs = self._handle(
+            ftl_doc,
+            force=force,
+            plugins_paths=plugins_paths,
+            next_plugins_paths=pipeline_paths[last_index + 1 :],
+        )
+        logger.info(f"{ftl_doc.pid} submitted to docs processing stage")
+        return ocr_jobs
+
+    def get_plugin(self, plugin_path):
+        """
+        Return the plugin instance configured with `plugin_path`, None if it isn't in the pipeline
+        """
+        for plugin in self.plugins:
+            if get_plugin_path(plugin) == plugin_path:
+                return plugin
+        return None
+
+    def get_plugins_reading(self, plugins_paths):
+        """
+        Return the paths of the next plugins reading the fields written by `plugins_paths` (see `requires`), directly or
+        through other plugins. They have to be forced when `plugins_paths` are applied again.
+        """
+        fields = set()
+        reading_plugins_paths = list()
+
+        for plugin in self.plugins:
+            plugin_path = get_plugin_path(plugin)
+            if plugin_path in plugins_paths:
+                fields |= set(getattr(plugin, "provides", []))
+            elif fields & set(getattr(plugin, "requires", None) or []):
+                fields |= set(getattr(plugin, "provides", []))
+                reading_plugins_paths.append(plugin_path)
+
+        return reading_plugins_paths
+
+    def get_stages(self):
+        """
+        Return the list of (stage, plugins paths) of the pipeline, consecutive plugins of the same stage are grouped so
+        the configured order is kept
+        """
+        stages = list()
+
+        for plugin in self.plugins:
+            stage = getattr(
+                plugin, "processing_stage", FTLDocProcessingBase.processing_stage
+            )
+            if stages and stages[-1][0] == stage:
+                stages[-1][1].append(get_plugin_path(plugin))
+            else:
+                stages.append((stage, [get_plugin_path(plugin)]))
+
+        return stages
 
-    def _handle(self, ftl_doc, force):
+    def _handle(self, ftl_doc, force, plugins_paths=None, next_plugins_paths=()):
         plugins_all = True if isinstance(force, bool) and force else False
         plugins_forced = force if isinstance(force, list) else []
         errors = list()
-        # for each registered processing plugin, apply processing
+        # Plugins which submitted an OCR job, with the job id
+        suspended = dict()
+
+        plugins = list()
         for plugin in self.plugins:
+            if (
+                plugins_paths is not None
+                and get_plugin_path(plugin) not in plugins_paths
+            ):
+                continue
+
             if (
                 ftl_doc.type in plugin.supported_documents_types
                 or "*" in plugin.supported_documents_types
             ):
+                plugins.append(plugin)
+            else:
+                logger.debug(
+                    f"Skipping plugin {plugin.__class__.__name__} on {ftl_doc.pid} (mimetype not supported)"
+                )
+
+        # Plugins updates are applied to `ftl_doc` and written at once at the end of the processing
+        with FTLProcessingContext(ftl_doc) as processing_context:
+
+            def run_plugin(plugin):
                 try:
                     logger.debug(
                         f"Executing plugin {plugin.__class__.__name__} on {ftl_doc.pid}"
                     )
                     pre_ftl_processing.send(sender=plugin.__class__, document=ftl_doc)
 
-                    # Refresh model to have latest update if any
-                    ftl_doc.refresh_from_db()
                     plugin.process(
                         ftl_doc,
-                        plugins_all
-                        or ".".join(
-                            [plugin.__class__.__module__, plugin.__class__.__qualname__]
-                        )
-                        in plugins_forced,
+                        plugins_all or get_plugin_path(plugin) in plugins_forced,
+                    )
+
+                    if getattr(plugin, "processing_checkpoint", False):
+                        processing_context.flush()
+
+                    # Only once the OCR result is written, a failing write is recorded as an OCR failure
+                    if isinstance(plugin, FTLOCRBase):
+                        record_ocr_success(ftl_doc)
+                except ProcessingSuspended as e:
+                    suspended[plugin] = e
+                    logger.info(
+                        f"Processing of {ftl_doc.pid} suspended by plugin {plugin.__class__.__name__} (job {e.job_id})"
+                    )
+                    return True
+                except PluginUnsupportedStorage:
+                    # Configuration error, retrying the OCR wouldn't help
+                    errors.append(plugin.__class__.__name__)
+                    logger.exception(
+                        f"Plugin {plugin.__class__.__name__} is misconfigured, {ftl_doc.pid} is not processed by it"
                     )
                 except Exception:
                     errors.append(plugin.__class__.__name__)
                     logger.exception(
                         f"Error while processing {ftl_doc.pid} with plugin {plugin.__class__.__name__}"
                     )
-            else:
-                logger.debug(
-                    f"Skipping plugin {plugin.__class__.__name__} on {ftl_doc.pid} (mimetype not supported)"
-                )
+
+                    if isinstance(plugin, FTLOCRBase):
+                        record_ocr_failure(ftl_doc, get_plugin_path(plugin))
+                return False
+
+            skipped_plugins = self._run_plugins(plugins, run_plugin)
+
+        if suspended:
+            return self._suspend(
+                ftl_doc,
+                force,
+                suspended,
+                [get_plugin_path(plugin) for plugin in skipped_plugins]
+                + list(next_plugins_paths),
+            )
 
         if errors:
             logger.error(
@@ -88,8 +261,257 @@ class FTLDocumentProcessing:
         else:
             logger.info(f"{ftl_doc.pid} was processed correctly")
 
+        return []
+
+    def _suspend(self, ftl_doc, force, suspended, resume_plugins_paths):
+        """
+        Save the OCR jobs of the suspended processing and schedule their polling (see `core.tasks.poll_ocr_job`), or
+        the OCR of their pages chunks
+        """
+        ocr_jobs = list()
+
+        for plugin, suspension in suspended.items():
+            ocr_jobs.append(
+                FTLOCRJob.objects.create(
+                    ftl_doc=ftl_doc,
+                    plugin=get_plugin_path(plugin),
+                    job_id=suspension.job_id,
+                    force=force,
+                    # Several OCR plugins are not expected, the skipped plugins are resumed only once
+                    resume_plugins=resume_plugins_paths if not ocr_jobs else [],
+                )
+            )
+
+        for ocr_job, suspension in zip(ocr_jobs, suspended.values()):
+            # Manual calls because of mutual import of FTLDocumentProcessing
+            if suspension.pages_chunks:
+                self._apply_ocr_pages_chunks(ocr_job, suspension.pages_chunks)
+            else:
+                celery.app.send_task(
+                    "core.tasks.poll_ocr_job",
+                    args=[str(ocr_job.pid)],
+                    countdown=getattr(settings, "FTL_OCR_JOB_POLL_INTERVAL", 10),
+                )
+
+        logger.info(
+            f"{ftl_doc.pid} processing suspended until OCR jobs are done ({len(resume_plugins_paths)} plugins to resume)"
+        )
+        return ocr_jobs
+
+    @staticmethod
+    def _apply_ocr_pages_chunks(ocr_job, pages_chunks):
+        """
+        OCR the pages chunks in parallel, one task each, the texts are merged in pages order once all are done
+        """
+        if getattr(settings, "FTL_DOC_PROCESSING_STAGED", False):
+            options = {"queue": FTLProcessingStages.OCR}
+        else:
+            options = {}
+
+        chord(
+            [
+                celery.app.signature(
+                    "core.tasks.apply_ocr_pages_chunk",
+                    args=[str(ocr_job.pid), chunk_name],
+                    options=options,
+                )
+                for chunk_name in pages_chunks
+            ]
+        )(
+            celery.app.signature(
+                "core.tasks.merge_ocr_pages_chunks",
+                args=[str(ocr_job.pid), pages_chunks],
+            )
+        )
+
+    def _run_plugins(self, plugins, run_plugin):
+        """
+        Run the plugins once their dependencies are done (see `get_plugins_dependencies`). Plugins ready at the same
+        time run concurrently in threads, a plugin ready alone runs in the current thread.
+
+        `run_plugin` returns True when the plugin suspended the processing, the plugins depending on it are skipped.
+        Return the skipped plugins.
+        """
+        dependencies = get_plugins_dependencies(plugins)
+        pending = list(range(len(plugins)))
+        done = set()
+        # Suspended plugins and the plugins depending on them
+        suspended = set()
+        skipped = list()
+        running = dict()
+        executor = None
+
+        try:
+            while pending or running:
+                ready = [i for i in pending if dependencies[i] <= done]
+                pending = [i for i in pending if i not in ready]
+
+                for i in [i for i in ready if dependencies[i] & suspended]:
+                    ready.remove(i)
+                    suspended.add(i)
+                    skipped.append(i)
+                    done.add(i)
+
+                if not ready and not running:
+                    continue
+
+                if len(ready) == 1 and not running:
+                    if run_plugin(plugins[ready[0]]):
+                        suspended.add(ready[0])
+                    done.add(ready[0])
+                    continue
+
+                if ready and executor is None:
+                    executor = ThreadPoolExecutor(
+                        max_workers=getattr(settings, "FTL_DOC_PROCESSING_THREADS", 4)
+                    )
+
+                for i in ready:
+                    future = executor.submit(
+                        _run_in_thread, copy_context(), run_plugin, plugins[i]
+                    )
+                    running[future] = i
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    i = running.pop(future)
+                    if future.result():
+                        suspended.add(i)
+                    done.add(i)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        return [plugins[i] for i in sorted(skipped)]
+
+
+def get_plugin_path(plugin):
+    """
+    Return the path of the plugin class, as configured in FTL_DOC_PROCESSING_PLUGINS
+    """
+    return ".".join([plugin.__class__.__module__, plugin.__class__.__qualname__])
+
+
+def record_ocr_failure(ftl_doc, plugin_path):
+    """
+    Schedule a retry of the failed OCR with an exponential backoff (see `core.tasks.batch_retry_ocr`), the document is
+    parked (not retried anymore) after FTL_OCR_MAX_RETRIES failures
+    """
+    ocr_retry = ftl_doc.ocr_retry + 1
+    max_retries = getattr(settings, "FTL_OCR_MAX_RETRIES", 5)
+
+    if ocr_retry > max_retries:
+        ocr_retry_at = None
+        logger.error(
+            f"OCR of {ftl_doc.pid} failed {ocr_retry} times, the document won't be retried"
+        )
+    else:
+        delay = min(
+            getattr(settings, "FTL_OCR_RETRY_DELAY", timedelta(minutes=5))
+            * 2 ** (ocr_retry - 1),
+            getattr(settings, "FTL_OCR_RETRY_MAX_DELAY", timedelta(days=1)),
+        )
+        ocr_retry_at = timezone.now() + delay
+        logger.warning(f"OCR of {ftl_doc.pid} will be retried in {delay}")
+
+    atomic_ftl_doc_update(
+        ftl_doc.pid,
+        {
+            "ocr_retry": ocr_retry,
+            "ocr_retry_at": ocr_retry_at,
+            "ocr_retry_plugins": sorted(set(ftl_doc.ocr_retry_plugins) | {plugin_path}),
+        },
+    )
+
+
+def record_ocr_success(ftl_doc):
+    if ftl_doc.ocr_retry or ftl_doc.ocr_retry_at or ftl_doc.ocr_retry_plugins:
+        atomic_ftl_doc_update(
+            ftl_doc.pid,
+            {"ocr_retry": 0, "ocr_retry_at": None, "ocr_retry_plugins": []},
+        )
+
+
+def get_job_callback_url(ftl_doc, plugin):
+    """
+    Return the signed url to call when the job submitted by `plugin` for `ftl_doc` is done (see
+    `core.views.ProcessingJobCallbackView`), None if FTL_PROCESSING_CALLBACK_HOST isn't set
+    """
+    callback_host = getattr(settings, "FTL_PROCESSING_CALLBACK_HOST", None)
+    if not callback_host:
+        return None
+
+    token = signing.dumps(
+        {"doc": str(ftl_doc.pid), "plugin": get_plugin_path(plugin)},
+        salt=_JOB_CALLBACK_SIGNING_SALT,
+    )
+    return callback_host.rstrip("/") + reverse(
+        "api_processing_job_callback", kwargs={"token": token}
+    )
+
+
+def unsign_job_callback(token):
+    """Raise `signing.BadSignature` if the token is invalid or expired"""
+    return signing.loads(
+        token,
+        salt=_JOB_CALLBACK_SIGNING_SALT,
+        max_age=getattr(settings, "FTL_OCR_JOB_TIMEOUT", timedelta(hours=1)),
+    )
+
+
+def get_plugins_dependencies(plugins):
+    """
+    Return, for each plugin index, the set of indexes of the previous plugins which have to be done before it runs.
+
+    Plugins declare the document fields they read (`requires`) and write (`provides`). A plugin depends on the
+    previous plugins writing a field it reads or writes, or reading a field it writes, so the configured order is
+    respected for each field. Plugins which don't declare `requires` depend on all the previous plugins, and all the
+    next plugins depend on them.
+    """
+    declarations = list()
+    for plugin in plugins:
+        requires = getattr(plugin, "requires", None)
+        if isinstance(requires, (list, tuple, set)):
+            provides = getattr(plugin, "provides", [])
+            declarations.append((set(requires), set(provides)))
+        else:
+            declarations.append(None)
+
+    dependencies = dict()
+    for i, declaration in enumerate(declarations):
+        dependencies[i] = set()
+
+        for j, previous_declaration in enumerate(declarations[:i]):
+            if declaration is None or previous_declaration is None:
+                dependencies[i].add(j)
+                continue
+
+            requires, provides = declaration
+            previous_requires, previous_provides = previous_declaration
+            if (
+                previous_provides & (requires | provides)
+                or previous_requires & provides
+            ):
+                dependencies[i].add(j)
+
+    return dependencies
+
+
+def _run_in_thread(context, run_plugin, plugin):
+    try:
+        # The processing context is shared with the threads
+        return context.run(run_plugin, plugin)
+    finally:
+        # Database connections are per thread
+        connections.close_all()
+
 
 class FTLOCRBase(FTLDocProcessingBase):
+    processing_checkpoint = True
+    requires = []
+    provides = ["content_text", "ocrized"]
+    processing_stage = FTLProcessingStages.OCR
+
     def __init__(self):
         self.log_prefix = f"[{self.__class__.__name__}]"
         self.supported_storages = []
@@ -98,7 +520,39 @@ class FTLOCRBase(FTLDocProcessingBase):
         if settings.DEFAULT_FILE_STORAGE in self.supported_storages:
             # If full text not already extracted
             if force or not ftl_doc.content_text.strip():
-                extracted_text = self._extract_text(ftl_doc.binary)
+                # Even when forced, an identical content isn't OCRized twice by the same plugin
+                cached_text = self.get_cached_text(ftl_doc)
+                if cached_text is not None:
+                    logger.info(
+                        f"{self.log_prefix} Using cached OCR result for document {ftl_doc.pid}"
+                    )
+                    atomic_ftl_doc_update(
+                        ftl_doc.pid, {"content_text": cached_text, "ocrized": True}
+                    )
+                    return
+
+                pages_chunks = self._split_pages(ftl_doc)
+                if pages_chunks:
+                    # Large documents are OCRized by chunks of pages in parallel, see `core.tasks.apply_ocr_pages_chunk`
+                    raise ProcessingSuspended(
+                        f"{len(pages_chunks)} pages chunks", pages_chunks
+                    )
+
+                if self.supports_jobs() and getattr(settings, "FTL_OCR_JOBS", False):
+                    # The worker doesn't wait for the OCR, the processing is resumed once the job is done
+                    raise ProcessingSuspended(
+                        self._submit_job(
+                            ftl_doc.binary, get_job_callback_url(ftl_doc, self)
+                        )
+                    )
+
+                extracted_text = self.extract_text(ftl_doc.binary)
+                if not extracted_text.strip():
+                    # Not cached nor written, the OCR is retried (see `record_ocr_failure`)
+                    raise OCRFailed(
+                        f"{self.log_prefix} No text extracted from document {ftl_doc.pid}"
+                    )
+                self.cache_text(ftl_doc, extracted_text)
 
                 atomic_ftl_doc_update(
                     ftl_doc.pid, {"content_text": extracted_text, "ocrized": True}
@@ -113,22 +567,278 @@ class FTLOCRBase(FTLDocProcessingBase):
                 f"{self.supported_storages})."
             )
 
+    def supports_jobs(self):
+        return type(self)._submit_job is not FTLOCRBase._submit_job
+
+    def poll_job(self, job_id, ftl_doc):
+        extracted_text = self._get_job_result(job_id, ftl_doc.binary)
+        if extracted_text is None:
+            return None
+
+        extracted_text = _decode_text(extracted_text)
+        self.cache_text(ftl_doc, extracted_text)
+        return {"content_text": extracted_text, "ocrized": True}
+
+    def extract_text(self, ftl_doc_binary):
+        """
+        Return the text of `ftl_doc_binary`, waiting for the OCR result (used for pages chunks). Raise `OCRFailed` if
+        the service didn't return the text in time.
+        """
+        extracted_text = self._extract_text(ftl_doc_binary)
+        if extracted_text is None:
+            raise OCRFailed(f"{self.log_prefix} No OCR result")
+        return _decode_text(extracted_text)
+
+    def get_config(self):
+        """
+        Return the plugin configuration affecting the OCR result (eg. languages), part of the OCR cache key
+        """
+        return ""
+
+    def get_cached_text(self, ftl_doc):
+        """
+        Return the text extracted by this plugin from a document of the same content (see `FTLOCRResult`), None if
+        there is none
+        """
+        ocr_results = self._get_cache_query(ftl_doc)
+        if ocr_results is None:
+            return None
+
+        ocr_result = ocr_results.only("pk", "content_text").first()
+        if ocr_result is None:
+            return None
+
+        ocr_results.filter(pk=ocr_result.pk).update(last_used=timezone.now())
+        return ocr_result.content_text
+
+    def cache_text(self, ftl_doc, extracted_text):
+        if extracted_text is None or self._get_cache_query(ftl_doc) is None:
+            return
+
+        try:
+            with transaction.atomic():
+                FTLOCRResult.objects.update_or_create(
+                    org_id=ftl_doc.org_id,
+                    md5=ftl_doc.md5,
+                    size=ftl_doc.size,
+                    plugin=get_plugin_path(self),
+                    config=self.get_config(),
+                    defaults={
+                        "content_text": extracted_text,
+                        "text_size": len(extracted_text),
+                        "last_used": timezone.now(),
+                    },
+                )
+        except IntegrityError:
+            # Same content OCRized concurrently
+            pass
+
+    def _get_cache_query(self, ftl_doc):
+        if not getattr(settings, "FTL_OCR_CACHE", True) or not ftl_doc.md5:
+            return None
+
+        return FTLOCRResult.objects.filter(
+            org_id=ftl_doc.org_id,
+            md5=ftl_doc.md5,
+            size=ftl_doc.size,
+            plugin=get_plugin_path(self),
+            config=self.get_config(),
+        )
+
+    def _split_pages(self, ftl_doc):
+        """
+        Store the pages of large PDF by chunks of FTL_OCR_PAGES_PER_CHUNK pages, return the names of the chunks or None
+        if the document isn't split
+        """
+        pages_per_chunk = getattr(settings, "FTL_OCR_PAGES_PER_CHUNK", 0)
+        if not pages_per_chunk or ftl_doc.type != "application/pdf":
+            return None
+
+        # Optional dependency, only required when FTL_OCR_PAGES_PER_CHUNK is set
+        from PyPDF2 import PdfFileReader, PdfFileWriter
+
+        chunks_names = list()
+        try:
+            with ftl_doc.binary.open("rb") as f:
+                reader = PdfFileReader(f, strict=False)
+                count_pages = reader.getNumPages()
+                if count_pages <= pages_per_chunk:
+                    return None
+
+                for first_page in range(0, count_pages, pages_per_chunk):
+                    writer = PdfFileWriter()
+                    for page in range(
+                        first_page, min(first_page + pages_per_chunk, count_pages)
+                    ):
+                        writer.addPage(reader.getPage(page))
+
+                    with TemporaryFile() as chunk:
+                        writer.write(chunk)
+                        chunk.seek(0)
+                        chunks_names.append(
+                            default_storage.save(
+                                f"ocr/chunks/{ftl_doc.pid}/{first_page:06d}.pdf",
+                                File(chunk),
+                            )
+                        )
+        except Exception:
+            # Eg. encrypted PDF, the document is OCRized at once
+            logger.exception(
+                f"{self.log_prefix} Document {ftl_doc.pid} could not be split in pages chunks"
+            )
+            for chunk_name in chunks_names:
+                default_storage.delete(chunk_name)
+            return None
+
+        return chunks_names
+
     def _extract_text(self, ftl_doc_binary):
         raise NotImplementedError
 
+    def _submit_job(self, ftl_doc_binary, callback_url=None):
+        """
+        Optional, submit the OCR of the document to an asynchronous service and return the job id (see
+        `_get_job_result`). Services supporting it call `callback_url` when the job is done.
+        """
+        raise NotImplementedError
+
+    def _get_job_result(self, job_id, ftl_doc_binary):
+        """
+        Return the text extracted by the job, None if the job is still running
+        """
+        raise NotImplementedError
+
+
+def _decode_text(extracted_text):
+    # Some services return the raw response content
+    if isinstance(extracted_text, bytes):
+        return extracted_text.decode("utf-8", errors="replace")
+    return extracted_text
+
+
+class FTLProcessingContext:
+    """
+    Accumulate the updates made by the plugins to the processed document, to write them in a single locked update
+    instead of one per plugin (see `atomic_ftl_doc_update`).
+
+    Plain values are applied to the in memory document, so next plugins see them, and written by `flush()`. Values
+    which can't be deferred (SQL expressions computed from other fields, files) are written right away, after the
+    pending values. When a write fails, the pending values are dropped and the in memory document restored.
+    """
+
+    def __init__(self, ftl_doc):
+        self.ftl_doc = ftl_doc
+        self.pending_values = dict()
+        # Values of the document before the pending values were applied, restored if they can't be written
+        self.original_values = dict()
+        # Results shared between the plugins, see `get_processing_result`
+        self.results = dict()
+        self._token = None
+        # Plugins may run concurrently in threads
+        self._lock = threading.RLock()
+        self._results_locks = dict()
+
+    def __enter__(self):
+        self._token = _processing_context.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _processing_context.reset(self._token)
+        self.flush()
+
+    def update(self, values: dict):
+        immediate_values = dict()
+
+        with self._lock:
+            for key, value in values.items():
+                if hasattr(value, "resolve_expression") or isinstance(value, File):
+                    immediate_values[key] = value
+                else:
+                    if key not in self.original_values:
+                        self.original_values[key] = getattr(self.ftl_doc, key)
+                    setattr(self.ftl_doc, key, value)
+                    self.pending_values[key] = value
+
+            if immediate_values:
+                self.flush(immediate_values)
+
+    def flush(self, immediate_values=None):
+        with self._lock:
+            values_list = [self.pending_values]
+            if immediate_values:
+                values_list.append(immediate_values)
+
+            try:
+                _locked_ftl_doc_update(self.ftl_doc.pid, values_list)
+            except Exception:
+                # Invalid values would make the next writes fail too (eg. the failure bookkeeping)
+                for key, value in self.original_values.items():
+                    setattr(self.ftl_doc, key, value)
+                raise
+            finally:
+                self.pending_values = dict()
+                self.original_values = dict()
+
+            # Computed values are reloaded from the database on next access
+            for key in immediate_values or {}:
+                self.ftl_doc.__dict__.pop(key, None)
+
+    def get_result_lock(self, key):
+        with self._lock:
+            return self._results_locks.setdefault(key, threading.Lock())
+
+
+def get_processing_result(ftl_doc, key, compute):
+    """
+    Return the result of `compute()`, computed once per processing of `ftl_doc` and shared by all its plugins (eg. the
+    Tika parsing). Outside of a processing, `compute()` is called each time.
+    """
+    processing_context = _processing_context.get()
+
+    if not processing_context or processing_context.ftl_doc.pid != ftl_doc.pid:
+        return compute()
+
+    # Plugins running concurrently wait for the result being computed
+    with processing_context.get_result_lock(key):
+        if key not in processing_context.results:
+            processing_context.results[key] = compute()
+        return processing_context.results[key]
+
 
 def atomic_ftl_doc_update(pid: UUID, values: dict):
     """
     Atomically update FTLDocument with the specified fields `values`
     Example usage:  atomic_ftl_doc_update(pid, {"content": "my value"})
+
+    During a processing (see `FTLProcessingContext`), updates of the processed document are deferred to the end of the
+    processing.
+    """
+    processing_context = _processing_context.get()
+
+    if processing_context and processing_context.ftl_doc.pid == pid:
+        processing_context.update(values)
+    else:
+        _locked_ftl_doc_update(pid, [values])
+
+
+def _locked_ftl_doc_update(pid: UUID, values_list: list):
+    """
+    Write the successive `values` dicts of `values_list`, one UPDATE each, under the same lock
     """
+    values_list = [values for values in values_list if values]
+    if not values_list:
+        return
+
     # issue #161
     with transaction.atomic():
         # select objects with a FOR UPDATE lock
         ftl_doc_update = FTLDocument.objects.select_for_update().get(pid=pid)
-        keys = list()
-        for key, value in values.items():
-            keys.append(key)
-            setattr(ftl_doc_update, key, value)
 
-        ftl_doc_update.save(update_fields=keys)
+        # SQL expressions are computed from the row values before the UPDATE, so values are written in order
+        for values in values_list:
+            keys = list()
+            for key, value in values.items():
+                keys.append(key)
+                setattr(ftl_doc_update, key, value)
+
+            ftl_doc_update.save(update_fields=keys)
@@ -3,9 +3,11 @@
 
 import logging
 import time
+from datetime import datetime, timedelta
 
 import boto3
 from django.conf import settings
+from django.utils.functional import cached_property
 
 from core.processing.ftl_processing import FTLOCRBase
 from ftl.enums import FTLStorages
@@ -26,21 +28,40 @@ class FTLOCRAwsTextract(FTLOCRBase):
     def __init__(self, aws_bucket=settings.AWS_STORAGE_BUCKET_NAME):
         super().__init__()
         self.aws_bucket = aws_bucket
-        self.client = boto3.client(
+        self.supported_storages = [FTLStorages.AWS_S3]
+        self.timeout = timedelta(minutes=5)
+
+    @cached_property
+    def client(self):
+        return boto3.client(
             aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
             aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
             service_name="textract",
             region_name="eu-west-1",
             endpoint_url="https://textract.eu-west-1.amazonaws.com",
         )
-        self.supported_storages = [FTLStorages.AWS_S3]
 
-    def _extract_text(self, ftl_doc_binary):
-        document_name = ftl_doc_binary.name
+    def check_health(self):
+        # Client is created lazily, at worker startup if possible
+        self.client
 
-        job_id = self._start_job(self.aws_bucket, document_name)
+    def _extract_text(self, ftl_doc_binary):
+        job_id = self._submit_job(ftl_doc_binary)
 
         first_response_chunk = self._get_job_response_once_completed(job_id)
+        return self._get_text(job_id, first_response_chunk)
+
+    def _submit_job(self, ftl_doc_binary, callback_url=None):
+        return self._start_job(self.aws_bucket, ftl_doc_binary.name)
+
+    def _get_job_result(self, job_id, ftl_doc_binary):
+        first_response_chunk = self.client.get_document_text_detection(JobId=job_id)
+        if first_response_chunk["JobStatus"] == "IN_PROGRESS":
+            return None
+
+        return self._get_text(job_id, first_response_chunk)
+
+    def _get_text(self, job_id, first_response_chunk):
         if first_response_chunk["JobStatus"] in ["SUCCEEDED", "PARTIAL_SUCCESS"]:
             if first_response_chunk["JobStatus"] == "PARTIAL_SUCCESS":
                 logger.warning(
@@ -75,7 +96,8 @@ class FTLOCRAwsTextract(FTLOCRBase):
         status = None
         response = {}
 
-        while first_iteration or status == "IN_PROGRESS":
+        expire = datetime.now() + self.timeout
+        while first_iteration or (status == "IN_PROGRESS" and datetime.now() < expire):
             time.sleep(5)
             response = self.client.get_document_text_detection(JobId=job_id)
             status = response["JobStatus"]
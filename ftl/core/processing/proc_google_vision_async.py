@@ -4,6 +4,8 @@
 import logging
 
 from django.conf import settings
+from django.utils.functional import cached_property
+from google.api_core import operations_v1
 from google.cloud import storage
 from google.cloud import vision
 from google.cloud import vision_v1
@@ -31,11 +33,8 @@ class FTLOCRGoogleVisionAsync(FTLOCRBase):
         gcs_bucket_name=settings.GS_BUCKET_NAME,
     ):
         super().__init__()
+        self.credentials = credentials
         self.gcs_bucket_name = gcs_bucket_name
-        self.bucket = storage.Client(
-            project=credentials.project_id, credentials=credentials
-        ).get_bucket(gcs_bucket_name)
-        self.client = vision_v1.ImageAnnotatorClient(credentials=credentials)
         self.supported_storages = [FTLStorages.GCS]
 
         self.mime_type = "application/pdf"
@@ -46,7 +45,50 @@ class FTLOCRGoogleVisionAsync(FTLOCRBase):
             type=vision.enums.Feature.Type.DOCUMENT_TEXT_DETECTION
         )
 
+    @cached_property
+    def bucket(self):
+        # Bucket metadata are not fetched, it would add a network round trip
+        return storage.Client(
+            project=self.credentials.project_id, credentials=self.credentials
+        ).bucket(self.gcs_bucket_name)
+
+    @cached_property
+    def client(self):
+        return vision_v1.ImageAnnotatorClient(credentials=self.credentials)
+
+    def check_health(self):
+        # Clients are created lazily, at worker startup if possible
+        self.bucket
+        self.client
+
+    @cached_property
+    def operations_client(self):
+        return operations_v1.OperationsClient(self.client.transport.channel)
+
     def _extract_text(self, ftl_doc_binary):
+        operation = self._start_operation(ftl_doc_binary)
+
+        # Wait for the OCR to finish
+        operation.result(timeout=None)
+
+        return self._get_output_text(ftl_doc_binary)
+
+    def _submit_job(self, ftl_doc_binary, callback_url=None):
+        return self._start_operation(ftl_doc_binary).operation.name
+
+    def _get_job_result(self, job_id, ftl_doc_binary):
+        operation = self.operations_client.get_operation(job_id)
+        if not operation.done:
+            return None
+
+        if operation.HasField("error"):
+            raise Exception(
+                f"{self.log_prefix} Text extraction failed (Google side): {operation.error.message}"
+            )
+
+        return self._get_output_text(ftl_doc_binary)
+
+    def _start_operation(self, ftl_doc_binary):
         storage_uri = f"gs://{self.gcs_bucket_name}/{ftl_doc_binary.name}"
         # This will used by Google to generate a filename like this:
         # 1ac7b8e9-ecc6-4522-9948-1775f188feaa.pdf.ocr.output-1-to-1.json
@@ -70,11 +112,9 @@ class FTLOCRGoogleVisionAsync(FTLOCRBase):
             output_config=output_config,
         )
 
-        operation = self.client.async_batch_annotate_files(requests=[async_request])
-
-        # Wait for the OCR to finish
-        operation.result(timeout=None)
+        return self.client.async_batch_annotate_files(requests=[async_request])
 
+    def _get_output_text(self, ftl_doc_binary):
         # Once the request has completed and the output has been
         # written to GCS, we can list all the output files.
         # Example output file: 1ac7b8e9-ecc6-4522-9948-1775f188feaa.pdf.ocr.output-1-to-1.json
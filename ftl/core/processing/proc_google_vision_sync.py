@@ -4,6 +4,7 @@
 import logging
 
 from django.conf import settings
+from django.utils.functional import cached_property
 from google.cloud import vision_v1
 from google.cloud.vision_v1 import enums
 
@@ -28,9 +29,17 @@ class FTLOCRGoogleVisionSync(FTLOCRBase):
         super().__init__()
         if settings.DEFAULT_FILE_STORAGE == FTLStorages.GCS:
             self.gcs_bucket_name = settings.GS_BUCKET_NAME
-        self.client = vision_v1.ImageAnnotatorClient(credentials=credentials)
+        self.credentials = credentials
         self.supported_storages = [FTLStorages.FILE_SYSTEM, FTLStorages.GCS]
 
+    @cached_property
+    def client(self):
+        return vision_v1.ImageAnnotatorClient(credentials=self.credentials)
+
+    def check_health(self):
+        # Client is created lazily, at worker startup if possible
+        self.client
+
     def _extract_text(self, ftl_doc):
         if settings.DEFAULT_FILE_STORAGE == FTLStorages.GCS:
             storage_uri = f"gs://{self.gcs_bucket_name}/{ftl_doc.name}"
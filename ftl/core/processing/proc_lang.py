@@ -6,6 +6,7 @@ import logging
 from langid.langid import LanguageIdentifier, model
 
 from core.processing.ftl_processing import FTLDocProcessingBase, atomic_ftl_doc_update
+from ftl.enums import FTLProcessingStages
 
 logger = logging.getLogger(__name__)
 
@@ -36,6 +37,9 @@ language_identifier = LanguageIdentifier.from_modelstring(model, norm_probs=True
 
 class FTLLangDetectorLangId(FTLDocProcessingBase):
     supported_documents_types = ["*"]
+    requires = ["content_text"]
+    provides = ["language"]
+    processing_stage = FTLProcessingStages.INDEX
 
     def __init__(self):
         self.log_prefix = f"[{self.__class__.__name__}]"
@@ -27,9 +27,26 @@ class FTLOCRmyPDF(FTLOCRBase):
             FTLStorages.AWS_S3,
         ]
         self.timeout = timedelta(minutes=5)
+        self.lang = ["eng", "fra"]
+
+    def get_config(self):
+        return ",".join(self.lang)
 
     def _extract_text(self, ftl_doc_binary):
-        params = {"lang": ["eng", "fra"]}
+        job_id = self._submit_job(ftl_doc_binary)
+
+        expire = datetime.now() + self.timeout
+        text = self._get_job_result(job_id, ftl_doc_binary)
+        while text is None and datetime.now() < expire:
+            time.sleep(5)
+            text = self._get_job_result(job_id, ftl_doc_binary)
+
+        return text
+
+    def _submit_job(self, ftl_doc_binary, callback_url=None):
+        params = {"lang": self.lang}
+        if callback_url:
+            params["callback_url"] = callback_url
         files = {"file": ftl_doc_binary}
 
         rp = requests.post(
@@ -40,26 +57,19 @@ class FTLOCRmyPDF(FTLOCRBase):
         )
 
         rp.raise_for_status()
-        pid = rp.json()["pid"]
+        return rp.json()["pid"]
 
+    def _get_job_result(self, job_id, ftl_doc_binary):
         rg = requests.get(
-            f"{self.api_url}/ocr/{pid}", headers={"X-API-KEY": self.api_key}
+            f"{self.api_url}/ocr/{job_id}", headers={"X-API-KEY": self.api_key}
         )
         rg.raise_for_status()
 
-        expire = datetime.now() + self.timeout
-        while rg.json()["status"] != "done" and datetime.now() < expire:
-            time.sleep(5)
-            rg = requests.get(
-                f"{self.api_url}/ocr/{pid}", headers={"X-API-KEY": self.api_key}
-            )
-            rg.raise_for_status()
+        if rg.json()["status"] != "done":
+            return None
 
-        if rg.json()["status"] == "done":
-            rt = requests.get(
-                f"{self.api_url}/ocr/{pid}/txt", headers={"X-API-KEY": self.api_key}
-            )
-            rt.raise_for_status()
-            return rt.content
-
-        return None
+        rt = requests.get(
+            f"{self.api_url}/ocr/{job_id}/txt", headers={"X-API-KEY": self.api_key}
+        )
+        rt.raise_for_status()
+        return rt.content
@@ -7,6 +7,7 @@ from django.contrib.postgres.search import SearchVector
 from django.db.models import F
 
 from core.processing.ftl_processing import FTLDocProcessingBase, atomic_ftl_doc_update
+from ftl.enums import FTLProcessingStages
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +20,9 @@ SEARCH_VECTOR = (
 
 class FTLSearchEnginePgSQLTSVector(FTLDocProcessingBase):
     supported_documents_types = ["*"]
+    requires = ["content_text", "language"]
+    provides = ["tsvector"]
+    processing_stage = FTLProcessingStages.INDEX
 
     def __init__(self):
         self.log_prefix = f"[{self.__class__.__name__}]"
@@ -1,25 +1,36 @@
 #  Copyright (c) 2020 Exotic Matter SAS. All rights reserved.
 #  Licensed under the Business Source License. See LICENSE at project root for more information.
 import logging
+from datetime import timedelta
 from tempfile import TemporaryFile
 
 import requests
 from django.conf import settings
 from django.core.files import File
+from django.core.files.base import ContentFile
 from jose import jwt
 
 from core.mimes import mimetype_to_ext
 from core.processing import ftl_processing
 from core.processing.ftl_processing import FTLDocProcessingBase
 from core.serializers import FTLDocumentDetailsOnlyOfficeSerializer
+from ftl import celery
+from ftl.enums import FTLProcessingStages
 
 logger = logging.getLogger(__name__)
 
+# Async conversions are checked every CONVERSION_POLL_INTERVAL seconds until CONVERSION_TIMEOUT
+CONVERSION_POLL_INTERVAL = 5
+CONVERSION_TIMEOUT = timedelta(minutes=10)
+
 
 class FTLThumbnailGenerationOnlyOffice(FTLDocProcessingBase):
     supported_documents_types = getattr(
         settings, "FTL_ONLY_OFFICE_SUPPORTED_DOCUMENTS_TYPES", []
     )
+    requires = []
+    provides = ["thumbnail_binary"]
+    processing_stage = FTLProcessingStages.THUMB
 
     def __init__(self):
         self.log_prefix = f"[{self.__class__.__name__}]"
@@ -28,54 +39,98 @@ class FTLThumbnailGenerationOnlyOffice(FTLDocProcessingBase):
     def process(self, ftl_doc, force):
         if self.enabled:
             if force or not ftl_doc.thumbnail_binary:
-                doc_serial = FTLDocumentDetailsOnlyOfficeSerializer(ftl_doc)
-
-                only_office_config = {
-                    "async": False,
-                    "filetype": mimetype_to_ext(ftl_doc.type)[1:],
-                    "key": str(ftl_doc.pid),
-                    "outputtype": "png",
-                    "title": "thumbnail",
-                    "thumbnail": {"first": True, "aspect": 2},
-                    "url": doc_serial.get_download_url_temp(ftl_doc),
-                }
-
-                sign = jwt.encode(
-                    only_office_config,
-                    getattr(settings, "FTL_ONLY_OFFICE_SECRET_KEY"),
-                    algorithm="HS256",
+                # In async mode, the conversion is checked by sending the same request again (see `poll_conversion`)
+                async_conversion = getattr(
+                    settings, "FTL_ONLY_OFFICE_ASYNC_CONVERSION", False
                 )
+                response_json = self._convert(ftl_doc, async_conversion)
 
-                r = requests.post(
-                    f"{getattr(settings, 'FTL_ONLY_OFFICE_API_SERVER_URL')}/ConvertService.ashx",
-                    json=only_office_config,
-                    headers={
-                        "Authorization": f"Bearer {sign}",
-                        "Accept": "application/json",
-                    },
-                )
+                if response_json is None:
+                    return
+
+                if "fileUrl" in response_json:
+                    thumb_url = response_json["fileUrl"]
+
+                    with requests.get(thumb_url, stream=True) as r:
+                        r.raise_for_status()
+
+                        with TemporaryFile() as f:
+                            for chunk in r.iter_content(chunk_size=1024):
+                                f.write(chunk)
 
-                if r.status_code == 200:
-                    response_json = r.json()
-                    if "fileUrl" in response_json:
-                        thumb_url = response_json["fileUrl"]
-
-                        with requests.get(thumb_url, stream=True) as r:
-                            r.raise_for_status()
-
-                            with TemporaryFile() as f:
-                                for chunk in r.iter_content(chunk_size=1024):
-                                    f.write(chunk)
-
-                                ftl_processing.atomic_ftl_doc_update(
-                                    ftl_doc.pid,
-                                    {"thumbnail_binary": File(f, "thumb.png")},
-                                )
-                    else:
-                        logger.error(
-                            f"{self.log_prefix} An error occurred with OnlyOffice conversion server {response_json}"
-                        )
+                            ftl_processing.atomic_ftl_doc_update(
+                                ftl_doc.pid, {"thumbnail_binary": File(f, "thumb.png")},
+                            )
+                elif async_conversion and not response_json.get("endConvert"):
+                    # Nothing depends on the thumbnail, the processing goes on while the conversion is running.
+                    # We send the task manually because of mutual import with `core.tasks`
+                    celery.app.send_task(
+                        "core.tasks.poll_thumbnail_conversion",
+                        args=[str(ftl_doc.pid)],
+                        countdown=CONVERSION_POLL_INTERVAL,
+                    )
+                else:
+                    logger.error(
+                        f"{self.log_prefix} An error occurred with OnlyOffice conversion server {response_json}"
+                    )
         else:
             logger.warning(
                 f"{self.log_prefix} OnlyOffice processing plugin enabled but FTL_ENABLE_ONLY_OFFICE is disabled"
             )
+
+    def poll_conversion(self, ftl_doc):
+        """
+        Return the thumbnail of an async conversion started by `process`, None while the conversion is running
+        """
+        response_json = self._convert(ftl_doc, True)
+
+        if response_json is None or "error" in response_json:
+            raise Exception(
+                f"{self.log_prefix} An error occurred with OnlyOffice conversion server {response_json}"
+            )
+
+        if "fileUrl" not in response_json:
+            return None
+
+        # Thumbnails are small, they are kept in memory until saved
+        r = requests.get(response_json["fileUrl"])
+        r.raise_for_status()
+        return ContentFile(r.content, "thumb.png")
+
+    def _convert(self, ftl_doc, async_conversion):
+        """
+        Send the conversion request to OnlyOffice, return the response or None if the request failed
+        """
+        doc_serial = FTLDocumentDetailsOnlyOfficeSerializer(ftl_doc)
+
+        only_office_config = {
+            "async": async_conversion,
+            "filetype": mimetype_to_ext(ftl_doc.type)[1:],
+            "key": self._get_key(ftl_doc),
+            "outputtype": "png",
+            "title": "thumbnail",
+            "thumbnail": {"first": True, "aspect": 2},
+            "url": doc_serial.get_download_url_temp(ftl_doc),
+        }
+
+        sign = jwt.encode(
+            only_office_config,
+            getattr(settings, "FTL_ONLY_OFFICE_SECRET_KEY"),
+            algorithm="HS256",
+        )
+
+        r = requests.post(
+            f"{getattr(settings, 'FTL_ONLY_OFFICE_API_SERVER_URL')}/ConvertService.ashx",
+            json=only_office_config,
+            headers={"Authorization": f"Bearer {sign}", "Accept": "application/json",},
+        )
+
+        if r.status_code != 200:
+            return None
+
+        return r.json()
+
+    @staticmethod
+    def _get_key(ftl_doc):
+        # Same key for all the requests of a conversion
+        return str(ftl_doc.pid)
@@ -3,14 +3,22 @@
 
 import logging
 
+from django.utils.dateparse import parse_datetime
 from tika import parser
 
-from core.processing.ftl_processing import FTLDocProcessingBase, atomic_ftl_doc_update
+from core.processing.ftl_processing import (
+    FTLDocProcessingBase,
+    atomic_ftl_doc_update,
+    get_processing_result,
+)
+from core.processing.tika_client import get_tika_client
 
 logger = logging.getLogger(__name__)
 
 
 class FTLTextExtractionTika(FTLDocProcessingBase):
+    requires = []
+    provides = ["content_text", "count_pages"]
     supported_documents_types = [
         "application/pdf",
         "text/plain",
@@ -30,37 +38,86 @@ class FTLTextExtractionTika(FTLDocProcessingBase):
         self.log_prefix = f"[{self.__class__.__name__}]"
 
     def process(self, ftl_doc, force):
-        parsed_txt = None
+        extract_count_pages = force or not ftl_doc.count_pages
+        extract_text = force or not ftl_doc.content_text
 
-        if force or not ftl_doc.count_pages:
-            with ftl_doc.binary.open("rb") as ff:
-                parsed_txt = parser.from_buffer(ff.read())
+        if not extract_count_pages and not extract_text:
+            logger.debug(
+                f"{self.log_prefix} Skipping Tika extract (page count and text) for document {ftl_doc.pid}"
+            )
+            return
 
-            if "metadata" in parsed_txt and "xmpTPg:NPages" in parsed_txt["metadata"]:
-                atomic_ftl_doc_update(
-                    ftl_doc.pid,
-                    {"count_pages": int(parsed_txt["metadata"]["xmpTPg:NPages"])},
-                )
+        # A single parsing for both page count and text
+        parsed_txt = get_tika_parse_result(ftl_doc)
+        values = dict()
+
+        if extract_count_pages:
+            count_pages = get_tika_metadata(ftl_doc)["count_pages"]
+            if count_pages is not None:
+                values["count_pages"] = count_pages
             else:
                 logger.warning(
                     f"{self.log_prefix} Pages number can't be retrieved for document {ftl_doc.pid}"
                 )
 
-        else:
-            logger.debug(
-                f"{self.log_prefix} Skipping Tika extract (page count) for document {ftl_doc.pid}"
-            )
+        if extract_text:
+            if "content" in parsed_txt and parsed_txt["content"]:
+                values["content_text"] = parsed_txt["content"].strip()
 
-        if force or not ftl_doc.content_text:
-            if not parsed_txt:
-                with ftl_doc.binary.open("rb") as ff:
-                    parsed_txt = parser.from_buffer(ff.read())
+        if values:
+            atomic_ftl_doc_update(ftl_doc.pid, values)
 
-            if "content" in parsed_txt and parsed_txt["content"]:
-                atomic_ftl_doc_update(
-                    ftl_doc.pid, {"content_text": parsed_txt["content"].strip()}
-                )
-        else:
-            logger.debug(
-                f"{self.log_prefix} Skipping Tika extract (text) for document {ftl_doc.pid}"
-            )
+
+def get_tika_parse_result(ftl_doc):
+    """
+    Parse the document with Tika (text and metadata), only once per processing, the result is shared with the
+    other plugins
+    """
+    return get_processing_result(ftl_doc, "tika", lambda: _tika_parse(ftl_doc))
+
+
+def get_tika_metadata(ftl_doc):
+    """
+    Return the main metadata of the document extracted by Tika: `count_pages`, `author`, `created` and `modified`
+    (None if missing)
+    """
+    metadata = get_tika_parse_result(ftl_doc).get("metadata") or {}
+
+    count_pages = _get_metadata_value(metadata, "xmpTPg:NPages")
+    created = _get_metadata_value(metadata, "dcterms:created", "Creation-Date")
+    modified = _get_metadata_value(metadata, "dcterms:modified", "Last-Modified")
+
+    return {
+        "count_pages": int(count_pages) if count_pages is not None else None,
+        "author": _get_metadata_value(metadata, "dc:creator", "meta:author", "Author"),
+        "created": _parse_metadata_date(created),
+        "modified": _parse_metadata_date(modified),
+    }
+
+
+def _tika_parse(ftl_doc):
+    tika_client = get_tika_client()
+
+    # The binary file is given to the Tika client which streams it to Tika server, it's never loaded in memory
+    with ftl_doc.binary.open("rb") as ff:
+        if tika_client:
+            return tika_client.parse(ff)
+        return parser.from_buffer(ff)
+
+
+def _get_metadata_value(metadata, *keys):
+    for key in keys:
+        value = metadata.get(key)
+        # Multi-valued metadata are returned as a list
+        if isinstance(value, list):
+            value = value[0] if value else None
+        if value is not None:
+            return value
+    return None
+
+
+def _parse_metadata_date(value):
+    try:
+        return parse_datetime(value) if value else None
+    except ValueError:
+        return None
@@ -0,0 +1,133 @@
+#  Copyright (c) 2021 Exotic Matter SAS. All rights reserved.
+#  Licensed under the Business Source License. See LICENSE at project root for more information.
+import logging
+import random
+import threading
+import time
+from functools import lru_cache
+from itertools import count
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from core.errors import TikaServersBusy
+
+logger = logging.getLogger(__name__)
+
+
+class FTLTikaEndpoint:
+    def __init__(self, url, max_concurrency):
+        self.url = url.rstrip("/")
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        # Connections are kept open and reused, up to one per parallel request
+        self.session = requests.Session()
+        self.session.mount(
+            self.url, HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        )
+
+
+class FTLTikaClient:
+    """
+    Client for a pool of Tika servers, requests are distributed by round-robin on the servers through persistent
+    HTTP sessions.
+
+    The number of parallel requests to each server is limited to `max_concurrency` by process: the limit isn't shared
+    between worker processes, a server receives up to `max_concurrency` requests from each of them. When all the
+    servers are busy, the client waits up to `timeout` seconds for one to be available.
+    """
+
+    def __init__(self, endpoints, max_concurrency=2, timeout=60):
+        self.endpoints = [FTLTikaEndpoint(url, max_concurrency) for url in endpoints]
+        self.timeout = timeout
+        # Random start, so worker processes don't all begin with the first server
+        self._round_robin = count(random.randrange(len(self.endpoints)))
+        # Notified when a server is released, threads waiting for a server don't poll
+        self._endpoint_released = threading.Condition()
+
+    def parse(self, file):
+        """
+        Extract text and metadata of `file` (streamed to the server), the result has the same format as
+        `tika.parser.from_buffer`
+        """
+        endpoint = self._acquire_endpoint()
+
+        try:
+            response = endpoint.session.put(
+                f"{endpoint.url}/rmeta/text",
+                data=file,
+                headers={"Accept": "application/json"},
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+            return _parse_rmeta(response.status_code, response.json())
+        finally:
+            self._release_endpoint(endpoint)
+
+    def _acquire_endpoint(self):
+        deadline = time.monotonic() + self.timeout
+
+        with self._endpoint_released:
+            while True:
+                start = next(self._round_robin)
+                for i in range(len(self.endpoints)):
+                    endpoint = self.endpoints[(start + i) % len(self.endpoints)]
+                    if endpoint.semaphore.acquire(blocking=False):
+                        return endpoint
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TikaServersBusy(
+                        f"No Tika server available after {self.timeout} seconds"
+                    )
+
+                self._endpoint_released.wait(remaining)
+
+    def _release_endpoint(self, endpoint):
+        with self._endpoint_released:
+            endpoint.semaphore.release()
+            self._endpoint_released.notify()
+
+
+def _parse_rmeta(status, rmeta):
+    """
+    Merge the `/rmeta` response (one item per embedded document) as `tika.parser.from_buffer` does: contents are
+    concatenated, metadata found in several items become lists
+    """
+    parsed = {"status": status, "content": "", "metadata": {}}
+
+    for item in rmeta:
+        parsed["content"] += item.get("X-TIKA:content") or ""
+
+        for key, value in item.items():
+            if key == "X-TIKA:content":
+                continue
+
+            if key in parsed["metadata"]:
+                if not isinstance(parsed["metadata"][key], list):
+                    parsed["metadata"][key] = [parsed["metadata"][key]]
+                parsed["metadata"][key].append(value)
+            else:
+                parsed["metadata"][key] = value
+
+    if not parsed["content"]:
+        parsed["content"] = None
+
+    return parsed
+
+
+@lru_cache(maxsize=None)
+def get_tika_client():
+    """
+    Return the Tika client shared by the process, None if no Tika server is configured (a local Tika server is then
+    started by the tika module)
+    """
+    endpoints = getattr(settings, "FTL_TIKA_SERVER_ENDPOINTS", [])
+    if not endpoints:
+        return None
+
+    return FTLTikaClient(
+        endpoints,
+        max_concurrency=getattr(settings, "FTL_TIKA_MAX_CONCURRENCY", 2),
+        timeout=getattr(settings, "FTL_TIKA_TIMEOUT", 60),
+    )
@@ -0,0 +1,136 @@
+#  Copyright (c) 2021 Exotic Matter SAS. All rights reserved.
+#  Licensed under the Business Source License. See LICENSE at project root for more information.
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, StreamingHttpResponse, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag, parse_http_date_safe
+
+from ftl.enums import FTLStorages, FTLFileOffloads
+
+# Size of the chunks read from the storage backend and sent to the client
+FILE_RESPONSE_CHUNK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def file_response(request, field_file, content_type, etag=None, last_modified=None):
+    """
+    Stream a stored file (FieldFile) by chunks instead of loading it in memory.
+    Support conditional requests (ETag / Last-Modified) and a single bytes range (HTTP 206), which is used by PDF.js
+    to lazily load big documents.
+
+    When `FTL_FILE_OFFLOAD` is set, the transfer (including ranges) is delegated to the front server instead.
+
+    `etag` is an unquoted value (eg. the document md5) and `last_modified` a datetime.
+    """
+    etag = quote_etag(etag) if etag else None
+    last_modified_timestamp = int(last_modified.timestamp()) if last_modified else None
+
+    # 304 Not Modified or 412 Precondition Failed
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified_timestamp
+    )
+
+    if response is None and _offload_enabled():
+        response = HttpResponse(content_type=content_type)
+        response[settings.FTL_FILE_OFFLOAD] = _get_offload_path(field_file)
+    elif response is None:
+        size = field_file.size
+        byte_range = _get_byte_range(
+            request, size, etag=etag, last_modified=last_modified_timestamp
+        )
+
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+        elif byte_range:
+            start, end = byte_range
+            response = StreamingHttpResponse(
+                _read_range(field_file, start, end),
+                status=206,
+                content_type=content_type,
+            )
+            response["Content-Range"] = f"bytes {start}-{end}/{size}"
+            response["Content-Length"] = end - start + 1
+        else:
+            response = FileResponse(field_file.open("rb"), content_type=content_type)
+            response.block_size = FILE_RESPONSE_CHUNK_SIZE
+            response["Content-Length"] = size
+
+        response["Accept-Ranges"] = "bytes"
+
+    if etag:
+        response["ETag"] = etag
+    if last_modified_timestamp:
+        response["Last-Modified"] = http_date(last_modified_timestamp)
+
+    return response
+
+
+def _offload_enabled():
+    return bool(
+        getattr(settings, "FTL_FILE_OFFLOAD", None)
+        and settings.DEFAULT_FILE_STORAGE == FTLStorages.FILE_SYSTEM
+    )
+
+
+def _get_offload_path(field_file):
+    if settings.FTL_FILE_OFFLOAD == FTLFileOffloads.X_ACCEL_REDIRECT:
+        prefix = settings.FTL_FILE_OFFLOAD_X_ACCEL_PREFIX.rstrip("/")
+        return quote(f"{prefix}/{field_file.name}")
+    else:
+        return field_file.path
+
+
+def _get_byte_range(request, size, etag=None, last_modified=None):
+    """
+    Return a (start, end) tuple for a satisfiable single range, False for an unsatisfiable range and None when the
+    whole file should be sent (no range, unsupported range or outdated If-Range).
+    """
+    range_header = request.META.get("HTTP_RANGE", "").strip()
+    if not range_header:
+        return None
+
+    if_range = request.META.get("HTTP_IF_RANGE", "").strip()
+    if if_range and if_range != etag:
+        if_range_date = parse_http_date_safe(if_range)
+        if if_range_date is None or if_range_date != last_modified:
+            return None
+
+    # Multiple ranges are not supported, the whole file is sent as allowed by the RFC 7233
+    match = RANGE_RE.match(range_header)
+    if not match:
+        return None
+
+    first, last = match.groups()
+    if not first and not last:
+        return None
+
+    if not first:
+        # Suffix range, eg. `bytes=-500` for the last 500 bytes
+        start = max(size - int(last), 0)
+        end = size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+
+    if start >= size or start > end:
+        return False
+
+    return start, end
+
+
+def _read_range(field_file, start, end):
+    with field_file.open("rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+
+        while remaining > 0:
+            chunk = f.read(min(FILE_RESPONSE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
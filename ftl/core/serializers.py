@@ -7,13 +7,20 @@ from base64 import b64decode
 from django.conf import settings
 from django.core.files.base import ContentFile
 from django.core.signing import TimestampSigner
+from django.db import models
 from django.urls import reverse
 from django.utils.translation import get_language_from_request
 from jose import jwt
 from rest_framework import serializers
 
 from core.mimes import mimetype_to_ext
-from core.models import FTLDocument, FTLFolder, FTLDocumentSharing, FTLDocumentReminder
+from core.models import (
+    FTLDocument,
+    FTLFolder,
+    FTLDocumentSharing,
+    FTLDocumentReminder,
+    get_folders_paths,
+)
 from ftl.enums import FTLStorages
 
 
@@ -28,6 +35,19 @@ class ThumbnailField(serializers.FileField):
         return ContentFile(binary, "thumb.png")
 
 
+class FTLDocumentListSerializer(serializers.ListSerializer):
+    """
+    Resolve the folder path of all the documents of the list at once (see `FTLDocumentSerializer.get_path`)
+    """
+
+    def to_representation(self, data):
+        documents = data.all() if isinstance(data, models.Manager) else data
+        self.context["folders_paths"] = get_folders_paths(
+            document.ftl_folder for document in documents
+        )
+        return super().to_representation(documents)
+
+
 class FTLDocumentSerializer(serializers.ModelSerializer):
     thumbnail_binary = ThumbnailField(write_only=True)
     thumbnail_available = serializers.SerializerMethodField()
@@ -37,7 +57,6 @@ class FTLDocumentSerializer(serializers.ModelSerializer):
     ext = serializers.SerializerMethodField()
     download_url = serializers.SerializerMethodField()
     is_shared = serializers.SerializerMethodField()
-    reminders_count = serializers.SerializerMethodField()
 
     def get_thumbnail_available(self, obj):
         return bool(obj.thumbnail_binary)
@@ -47,7 +66,9 @@ class FTLDocumentSerializer(serializers.ModelSerializer):
             if settings.DEFAULT_FILE_STORAGE in [FTLStorages.GCS, FTLStorages.AWS_S3]:
                 return obj.thumbnail_binary.url
             else:
-                return reverse("api_thumbnail_url", kwargs={"pid": obj.pid})
+                # Versioned url, so the thumbnail can be cached forever by the browser
+                thumbnail_url = reverse("api_thumbnail_url", kwargs={"pid": obj.pid})
+                return f"{thumbnail_url}?v={obj.thumbnail_version}"
         else:
             return None
 
@@ -56,10 +77,13 @@ class FTLDocumentSerializer(serializers.ModelSerializer):
 
     def get_path(self, obj):
         if obj.ftl_folder:
-            return map(
-                lambda e: {"id": e.id, "name": e.name},
-                obj.ftl_folder.get_ancestors(include_self=True),
-            )
+            folders_paths = self.context.get("folders_paths", {})
+            if obj.ftl_folder_id in folders_paths:
+                ancestors = folders_paths[obj.ftl_folder_id]
+            else:
+                ancestors = obj.ftl_folder.get_ancestors(include_self=True)
+
+            return map(lambda e: {"id": e.id, "name": e.name}, ancestors)
         else:
             return []
 
@@ -70,17 +94,12 @@ class FTLDocumentSerializer(serializers.ModelSerializer):
         return reverse("api_download_url", kwargs={"pid": obj.pid})
 
     def get_is_shared(self, obj):
-        # For optimization purpose, we use annotation in the queryset to calculate this value to avoid (N+1 problem).
-        # But when creating a new FTLDocument, there is no annotation and so this field does not appear
-        # in the result so we need a check
-        return getattr(obj, "shares_count", 0) > 0
-
-    def get_reminders_count(self, obj):
-        # See comment for `get_is_shared`
-        return getattr(obj, "reminders_count", 0)
+        # For optimization purpose, `shares_count` is a denormalized counter to avoid (N+1 problem).
+        return obj.shares_count > 0
 
     class Meta:
         model = FTLDocument
+        list_serializer_class = FTLDocumentListSerializer
         fields = [
             "pid",
             "title",
@@ -203,20 +222,42 @@ class FTLDocumentDetailsOnlyOfficeSerializer(FTLDocumentSerializer):
         ]
 
 
+class FTLFolderListSerializer(serializers.ListSerializer):
+    """
+    Resolve the paths of all the folders of the list at once (see `FTLFolderSerializer.get_paths`). Folders are
+    usually listed by level, so only the ancestors of their parents have to be loaded.
+    """
+
+    def to_representation(self, data):
+        folders = list(data.all() if isinstance(data, models.Manager) else data)
+        parents_paths = get_folders_paths(folder.parent for folder in folders)
+        self.context["folders_paths"] = {
+            folder.id: parents_paths.get(folder.parent_id, []) + [folder]
+            for folder in folders
+        }
+        return super().to_representation(folders)
+
+
 class FTLFolderSerializer(serializers.ModelSerializer):
     paths = serializers.SerializerMethodField()
     has_descendant = serializers.SerializerMethodField()
 
     def get_paths(self, obj):
-        return map(
-            lambda e: {"id": e.id, "name": e.name}, obj.get_ancestors(include_self=True)
-        )
+        folders_paths = self.context.get("folders_paths", {})
+        if obj.id in folders_paths:
+            ancestors = folders_paths[obj.id]
+        else:
+            ancestors = obj.get_ancestors(include_self=True)
+
+        return map(lambda e: {"id": e.id, "name": e.name}, ancestors)
 
     def get_has_descendant(self, obj):
-        return obj.get_descendant_count() > 0
+        # MPTT nested set: a folder without descendant has `rght == lft + 1` (no query needed)
+        return obj.rght - obj.lft > 1
 
     class Meta:
         model = FTLFolder
+        list_serializer_class = FTLFolderListSerializer
         fields = ("id", "name", "created", "parent", "paths", "has_descendant")
         read_only_fields = ("created", "has_descendant")
 
@@ -1,27 +1,339 @@
 #  Copyright (c) 2021 Exotic Matter SAS. All rights reserved.
 #  Licensed under the Business Source License. See LICENSE at project root for more information.
 import logging
+from datetime import timedelta
+from functools import lru_cache
 
-from celery import shared_task
+from celery import shared_task, chain
+from celery.exceptions import Ignore
+from celery.signals import worker_process_init
 from django.conf import settings
 from django.core import management
+from django.core.files.storage import default_storage
 from django.core.mail import send_mail
+from django.db import transaction
+from django.db.models import Sum
 from django.template.loader import render_to_string
 from django.utils import timezone, translation
 
-from core.models import FTLOrg, FTLDocument, FTLFolder, FTLDocumentReminder
-from core.processing.ftl_processing import FTLDocumentProcessing
+from core.chunked_upload import assemble_chunks
+from core.direct_upload import DIRECT_UPLOAD_MAX_AGE
+from core.mimes import mimetype_to_ext
+from core.models import (
+    FTLOrg,
+    FTLDocument,
+    FTLFolder,
+    FTLDocumentReminder,
+    FTLDocumentUpload,
+    FTLDirectUpload,
+    FTLOCRJob,
+    FTLOCRResult,
+)
+from core.processing.ftl_processing import (
+    FTLDocumentProcessing,
+    FTLOCRBase,
+    atomic_ftl_doc_update,
+    record_ocr_failure,
+    record_ocr_success,
+)
+from core.processing.proc_thumb_only_office import (
+    CONVERSION_POLL_INTERVAL,
+    CONVERSION_TIMEOUT,
+)
+from ftl.enums import FTLPlugins
 
 logger = logging.getLogger(__name__)
 
 
+# Number of documents processed by a single `apply_ftl_processing_batch` task
+PROCESSING_BATCH_SIZE = 10
+
+
+@lru_cache(maxsize=None)
+def get_ftl_document_processing():
+    """
+    Processing pipeline cached for the worker process lifetime, plugins (and their clients) are only instantiated once
+    """
+    return FTLDocumentProcessing()
+
+
+def init_ftl_document_processing(**kwargs):
+    """
+    Warm up the processing pipeline when a worker process starts, so the first task doesn't pay for it
+    """
+    failing_plugins = get_ftl_document_processing().check_health()
+    if failing_plugins:
+        logger.error(
+            f"Worker started with failing processing plugins: {', '.join(failing_plugins)}"
+        )
+
+
+worker_process_init.connect(
+    init_ftl_document_processing, dispatch_uid="init_ftl_document_processing"
+)
+
+
+def get_ftl_processing_stages_chain(
+    ftl_doc_pid, org_id, user_id, force, only_plugins_paths=None
+):
+    """
+    Return the chain of tasks processing a document stage by stage, each stage task is routed to the stage queue (see
+    FTL_DOC_PROCESSING_STAGED). `only_plugins_paths` restricts the chain to some plugins (eg. resumed plugins).
+    """
+    stages = list()
+    for stage, plugins_paths in get_ftl_document_processing().get_stages():
+        if only_plugins_paths is not None:
+            plugins_paths = [p for p in plugins_paths if p in only_plugins_paths]
+        if plugins_paths:
+            stages.append((stage, plugins_paths))
+
+    return chain(
+        [
+            apply_ftl_processing_stage.si(
+                ftl_doc_pid, org_id, user_id, force, plugins_paths
+            ).set(queue=stage)
+            for stage, plugins_paths in stages
+        ]
+    )
+
+
 @shared_task
 def apply_ftl_processing(ftl_doc_pid, org_id, user_id, force):
+    if getattr(settings, "FTL_DOC_PROCESSING_STAGED", False):
+        get_ftl_processing_stages_chain(
+            ftl_doc_pid, org_id, user_id, force
+        ).apply_async()
+        return
+
     doc = FTLDocument.objects.get(pid=ftl_doc_pid, org_id=org_id, ftl_user_id=user_id)
-    ftl_document_processing = FTLDocumentProcessing()
+    ftl_document_processing = get_ftl_document_processing()
     ftl_document_processing.apply_processing(doc, force)
 
 
+@shared_task
+def apply_ftl_processing_stage(ftl_doc_pid, org_id, user_id, force, plugins_paths):
+    doc = FTLDocument.objects.get(pid=ftl_doc_pid, org_id=org_id, ftl_user_id=user_id)
+    ftl_document_processing = get_ftl_document_processing()
+    ocr_jobs = ftl_document_processing.apply_processing_stage(doc, force, plugins_paths)
+
+    if ocr_jobs:
+        # Next stages of the chain are resumed by `poll_ocr_job`
+        raise Ignore()
+
+
+@shared_task
+def apply_ftl_processing_batch(ftl_docs_pids, force):
+    """
+    Process several documents in a single task (mass reindexing or import), documents are fetched with a single query.
+    A failing document doesn't stop the batch, and the remaining documents are sent to a new task once
+    FTL_PROCESSING_BATCH_TIME_BUDGET is over.
+    """
+    docs = FTLDocument.objects.filter(pid__in=ftl_docs_pids)
+    ftl_document_processing = get_ftl_document_processing()
+    staged = getattr(settings, "FTL_DOC_PROCESSING_STAGED", False)
+    expire = timezone.now() + getattr(
+        settings, "FTL_PROCESSING_BATCH_TIME_BUDGET", timedelta(minutes=5)
+    )
+
+    remaining_docs = list(docs)
+    missing_pids = {str(pid) for pid in ftl_docs_pids} - {
+        str(doc.pid) for doc in remaining_docs
+    }
+    if missing_pids:
+        logger.warning(
+            f"Skipped processing of {len(missing_pids)} missing documents: {', '.join(missing_pids)}"
+        )
+
+    while remaining_docs:
+        if timezone.now() >= expire:
+            logger.info(
+                f"Processing batch time budget over, {len(remaining_docs)} documents sent to a new task"
+            )
+            apply_ftl_processing_batch.delay(
+                [str(doc.pid) for doc in remaining_docs], force=force
+            )
+            return
+
+        doc = remaining_docs.pop(0)
+        try:
+            if staged:
+                get_ftl_processing_stages_chain(
+                    doc.pid, doc.org_id, doc.ftl_user_id, force
+                ).apply_async()
+            else:
+                ftl_document_processing.apply_processing(doc, force)
+        except Exception:
+            logger.exception(f"Error while processing {doc.pid} in a batch")
+
+
+@shared_task
+def poll_ocr_job(ocr_job_pid):
+    """
+    Check an OCR job submitted by a suspended processing (see `FTLOCRJob`), the task is enqueued again until the job is
+    done or FTL_OCR_JOB_TIMEOUT is reached, then the processing is resumed
+    """
+    try:
+        ocr_job = FTLOCRJob.objects.select_related("ftl_doc").get(
+            pid=ocr_job_pid, status=FTLOCRJob.PENDING
+        )
+    except FTLOCRJob.DoesNotExist:
+        # Document deleted or job already handled
+        return
+
+    plugin = get_ftl_document_processing().get_plugin(ocr_job.plugin)
+    values = None
+
+    if plugin is None:
+        status = FTLOCRJob.FAILED
+        logger.error(f"OCR job {ocr_job.pid} plugin {ocr_job.plugin} isn't configured")
+    else:
+        try:
+            values = plugin.poll_job(ocr_job.job_id, ocr_job.ftl_doc)
+        except Exception:
+            status = FTLOCRJob.FAILED
+            logger.exception(f"Error while polling OCR job {ocr_job.pid}")
+        else:
+            if values is not None:
+                status = FTLOCRJob.DONE
+            elif timezone.now() - ocr_job.created > getattr(
+                settings, "FTL_OCR_JOB_TIMEOUT", timedelta(hours=1)
+            ):
+                status = FTLOCRJob.FAILED
+                logger.error(f"OCR job {ocr_job.pid} timed out")
+            else:
+                poll_ocr_job.apply_async(
+                    (ocr_job_pid,),
+                    countdown=getattr(settings, "FTL_OCR_JOB_POLL_INTERVAL", 10),
+                )
+                return
+
+    complete_ocr_job(ocr_job, status, values)
+
+
+@shared_task
+def poll_thumbnail_conversion(ftl_doc_pid, attempt=1):
+    """
+    Check an async OnlyOffice thumbnail conversion (see FTL_ONLY_OFFICE_ASYNC_CONVERSION), the task is enqueued again
+    until the thumbnail is saved or the conversion times out
+    """
+    ftl_doc = FTLDocument.objects.filter(pid=ftl_doc_pid, deleted=False).first()
+    plugin = get_ftl_document_processing().get_plugin(FTLPlugins.THUMBNAIL_ONLY_OFFICE)
+    if ftl_doc is None or plugin is None:
+        return
+
+    try:
+        thumbnail_binary = plugin.poll_conversion(ftl_doc)
+    except Exception:
+        logger.exception(f"Error while polling thumbnail conversion of {ftl_doc_pid}")
+        return
+
+    if thumbnail_binary is not None:
+        atomic_ftl_doc_update(ftl_doc.pid, {"thumbnail_binary": thumbnail_binary})
+    elif attempt * CONVERSION_POLL_INTERVAL < CONVERSION_TIMEOUT.total_seconds():
+        poll_thumbnail_conversion.apply_async(
+            (ftl_doc_pid, attempt + 1), countdown=CONVERSION_POLL_INTERVAL
+        )
+    else:
+        logger.error(f"Thumbnail conversion of {ftl_doc_pid} timed out")
+
+
+@shared_task(ignore_result=False)
+def apply_ocr_pages_chunk(ocr_job_pid, chunk_name):
+    """
+    OCR a chunk of pages of a large document (see FTL_OCR_PAGES_PER_CHUNK), return its text or None if it failed.
+    The result is stored for `merge_ocr_pages_chunks`.
+    """
+    ocr_job = FTLOCRJob.objects.filter(pid=ocr_job_pid).first()
+    plugin = (
+        get_ftl_document_processing().get_plugin(ocr_job.plugin) if ocr_job else None
+    )
+    if plugin is None:
+        return None
+
+    try:
+        with default_storage.open(chunk_name, "rb") as f:
+            return plugin.extract_text(f)
+    except Exception:
+        # A failing chunk doesn't prevent the merge (which would never happen)
+        logger.exception(f"Error while OCRizing {chunk_name} of job {ocr_job_pid}")
+        return None
+
+
+@shared_task
+def merge_ocr_pages_chunks(chunks_texts, ocr_job_pid, chunks_names):
+    """
+    Chord callback of `apply_ocr_pages_chunk`, `chunks_texts` are in pages order
+    """
+    for chunk_name in chunks_names:
+        try:
+            default_storage.delete(chunk_name)
+        except Exception as e:
+            # except is very broad but it can be anything depending of the storage backend
+            logger.warning(f"Could not delete OCR chunk {chunk_name}: {e}")
+
+    try:
+        ocr_job = FTLOCRJob.objects.select_related("ftl_doc").get(
+            pid=ocr_job_pid, status=FTLOCRJob.PENDING
+        )
+    except FTLOCRJob.DoesNotExist:
+        return
+
+    if None in chunks_texts:
+        logger.error(f"OCR job {ocr_job.pid} failed for some pages chunks")
+        complete_ocr_job(ocr_job, FTLOCRJob.FAILED)
+    else:
+        extracted_text = "\n".join(chunks_texts)
+
+        plugin = get_ftl_document_processing().get_plugin(ocr_job.plugin)
+        if plugin is not None:
+            plugin.cache_text(ocr_job.ftl_doc, extracted_text)
+
+        complete_ocr_job(
+            ocr_job, FTLOCRJob.DONE, {"content_text": extracted_text, "ocrized": True},
+        )
+
+
+def complete_ocr_job(ocr_job, status, values=None):
+    """
+    Save the result of the OCR job and resume the processing
+    """
+    with transaction.atomic():
+        # Only one task handles the job result, even if the poll has been enqueued twice
+        if not FTLOCRJob.objects.filter(pk=ocr_job.pk, status=FTLOCRJob.PENDING).update(
+            status=status
+        ):
+            return
+
+        if status == FTLOCRJob.DONE:
+            atomic_ftl_doc_update(ocr_job.ftl_doc.pid, values)
+
+        # Pages chunks jobs are not OCR plugins jobs
+        plugin = get_ftl_document_processing().get_plugin(ocr_job.plugin)
+        if isinstance(plugin, FTLOCRBase):
+            if status == FTLOCRJob.DONE:
+                record_ocr_success(ocr_job.ftl_doc)
+            else:
+                record_ocr_failure(ocr_job.ftl_doc, ocr_job.plugin)
+
+    # Next plugins run even if the OCR failed, as without an OCR plugin
+    resume_ftl_processing(ocr_job)
+
+
+def resume_ftl_processing(ocr_job):
+    if not ocr_job.resume_plugins:
+        return
+
+    doc = ocr_job.ftl_doc
+    if getattr(settings, "FTL_DOC_PROCESSING_STAGED", False):
+        get_ftl_processing_stages_chain(
+            doc.pid, doc.org_id, doc.ftl_user_id, ocr_job.force, ocr_job.resume_plugins
+        ).apply_async()
+    else:
+        apply_ftl_processing_stage.delay(
+            doc.pid, doc.org_id, doc.ftl_user_id, ocr_job.force, ocr_job.resume_plugins
+        )
+
+
 @shared_task
 def delete_document(ftl_doc_pid, org_id, user_id):
     try:
@@ -67,6 +379,141 @@ def batch_delete_doc():
         doc.delete()
 
 
+@shared_task
+def assemble_chunked_upload(upload_pid):
+    """
+    Store the document of a complete resumable upload from its chunks, out of the finalize request (see
+    `core.views.ChunkedUploadFinalize`). The document is created when the client finalizes the assembled upload.
+    """
+    upload = FTLDocumentUpload.objects.filter(
+        pid=upload_pid, status=FTLDocumentUpload.ASSEMBLING
+    ).first()
+    if upload is None:
+        # Upload aborted
+        return
+
+    try:
+        name, md5, mime = assemble_chunks(upload)
+    except Exception:
+        logger.exception(f"Error while assembling upload {upload_pid}")
+        # The client can finalize the upload again
+        FTLDocumentUpload.objects.filter(
+            pid=upload_pid, status=FTLDocumentUpload.ASSEMBLING
+        ).update(status=FTLDocumentUpload.UPLOADING)
+        return
+
+    error = None
+    if upload.md5 and upload.md5 != md5:
+        error = "ftl_document_md5_mismatch"
+    elif mimetype_to_ext(mime) != mimetype_to_ext(upload.type):
+        # The content has to match the type declared when the upload was created
+        error = "ftl_document_type_unsupported"
+
+    updated = FTLDocumentUpload.objects.filter(
+        pid=upload_pid, status=FTLDocumentUpload.ASSEMBLING
+    ).update(
+        status=FTLDocumentUpload.FAILED if error else FTLDocumentUpload.ASSEMBLED,
+        binary=None if error else name,
+        md5=md5,
+        type=mime if mime else upload.type,
+        error=error,
+        chunks=[],
+    )
+
+    if error or not updated:
+        default_storage.delete(name)
+    if updated:
+        for offset in upload.chunks:
+            try:
+                default_storage.delete(upload.get_chunk_name(offset))
+            except Exception as e:
+                # except is very broad but it can be anything depending of the storage backend
+                logger.warning(f"Could not delete upload chunk {offset}: {e}")
+
+
+@shared_task
+def batch_delete_expired_uploads():
+    # Resumable uploads not finalized after a day are considered abandoned
+    uploads_to_delete = FTLDocumentUpload.objects.filter(
+        created__lte=timezone.now() - timedelta(days=1)
+    )
+
+    for upload in uploads_to_delete:
+        logger.info(f"Deleting upload {upload.pid} ...")
+        upload.delete()
+
+    # Tokens of finalized direct uploads are expired, they can't be used again anyway
+    FTLDirectUpload.objects.filter(
+        created__lte=timezone.now() - DIRECT_UPLOAD_MAX_AGE
+    ).delete()
+
+
+@shared_task
+def batch_evict_ocr_results():
+    """
+    Delete the least recently used OCR results once the cache exceeds FTL_OCR_CACHE_MAX_SIZE (see `FTLOCRResult`)
+    """
+    max_size = getattr(settings, "FTL_OCR_CACHE_MAX_SIZE", 1024 ** 3)
+    cache_size = FTLOCRResult.objects.aggregate(size=Sum("text_size"))["size"] or 0
+    if cache_size <= max_size:
+        return
+
+    evicted_pks = list()
+    evicted_size = 0
+    for pk, text_size in (
+        FTLOCRResult.objects.order_by("last_used")
+        .values_list("pk", "text_size")
+        .iterator()
+    ):
+        if cache_size - evicted_size <= max_size:
+            break
+        evicted_pks.append(pk)
+        evicted_size += text_size
+
+    for i in range(0, len(evicted_pks), 1000):
+        FTLOCRResult.objects.filter(pk__in=evicted_pks[i : i + 1000]).delete()
+
+    logger.info(f"Evicted {len(evicted_pks)} OCR results ({evicted_size} chars)")
+
+
+@shared_task
+def batch_retry_ocr():
+    """
+    Process again the documents whose OCR failed once their retry delay is over (see `record_ocr_failure`), the failed
+    plugins and the plugins using their results are forced
+    """
+    retry_batch_size = getattr(settings, "FTL_OCR_RETRY_BATCH_SIZE", 500)
+    docs = list(
+        FTLDocument.objects.filter(
+            deleted=False, ocr_retry_at__lte=timezone.now()
+        ).values_list("pid", "ocr_retry_plugins")[:retry_batch_size]
+    )
+    if not docs:
+        return
+
+    # Documents aren't retried again while being processed, unless the worker crashes
+    FTLDocument.objects.filter(pid__in=[pid for pid, _ in docs]).update(
+        ocr_retry_at=timezone.now()
+        + getattr(settings, "FTL_OCR_RETRY_MAX_DELAY", timedelta(days=1))
+    )
+
+    ftl_document_processing = get_ftl_document_processing()
+    docs_by_force = dict()
+    for pid, ocr_retry_plugins in docs:
+        force = ocr_retry_plugins + ftl_document_processing.get_plugins_reading(
+            ocr_retry_plugins
+        )
+        docs_by_force.setdefault(tuple(force), list()).append(pid)
+
+    for force, pids in docs_by_force.items():
+        for i in range(0, len(pids), PROCESSING_BATCH_SIZE):
+            apply_ftl_processing_batch.delay(
+                pids[i : i + PROCESSING_BATCH_SIZE], force=list(force)
+            )
+
+    logger.info(f"Retrying OCR of {len(docs)} documents")
+
+
 @shared_task
 def batch_delete_oauth_tokens():
     management.call_command("cleartokens")
@@ -1,27 +1,46 @@
 #  Copyright (c) 2021 Exotic Matter SAS. All rights reserved.
 #  Licensed under the Business Source License. See LICENSE at project root for more information.
 
+import hashlib
 import json
 import os
+from base64 import urlsafe_b64encode
 from contextlib import contextmanager
 from datetime import timedelta
+from io import BytesIO
 from unittest import mock
-from unittest.mock import patch
+from unittest.mock import patch, Mock
+from urllib.parse import urlparse
 from uuid import UUID
 
 from dateutil.tz import gettz
 from django.conf import settings
 from django.contrib import messages
-from django.db import DEFAULT_DB_ALIAS, transaction
+from django.core.files.storage import default_storage
+from django.db import DEFAULT_DB_ALIAS, transaction, connection
 from django.http import HttpRequest
 from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APITestCase
 
 import core
-from core.models import FTLDocument, FTLFolder, FTLDocumentSharing, FTLDocumentReminder
-from core.tasks import apply_ftl_processing
+from core.models import (
+    FTLDocument,
+    FTLFolder,
+    FTLDocumentSharing,
+    FTLDocumentReminder,
+    FTLDocumentUpload,
+    FTLOCRJob,
+)
+from core.direct_upload import FTLDirectUploadS3
+from core.mimes import MIME_SAMPLE_SIZE
+from core.pagination import FTLDocumentPagination
+from core.processing.ftl_processing import get_job_callback_url
+from core.processing.proc_ocrmypdf import FTLOCRmyPDF
+from core.tasks import apply_ftl_processing, poll_ocr_job, assemble_chunked_upload
 from ftests.tools import test_values as tv
 from ftests.tools.setup_helpers import (
     setup_org,
@@ -219,6 +238,70 @@ class DocumentsTests(APITestCase):
         self.assertEqual(client_doc_3["pid"], str(ftl_document_third.pid))
         self.assertEqual(client_doc_3["title"], ftl_document_third.title)
 
+    @patch.object(FTLDocumentPagination, "page_size", 2)
+    def test_list_documents_cursor_pagination(self):
+        doc_ter = setup_document(self.org, self.user, title="Third document")
+
+        client_get = self.client.get(
+            "/app/api/v1/documents?pagination=cursor", format="json"
+        )
+        self.assertEqual(client_get.status_code, status.HTTP_200_OK)
+        self.assertNotIn("count", client_get.data)
+        self.assertEqual(
+            [doc["pid"] for doc in client_get.data["results"]],
+            [str(doc_ter.pid), str(self.doc_bis.pid)],
+        )
+        self.assertIsNotNone(client_get.data["next"])
+
+        client_get = self.client.get(client_get.data["next"], format="json")
+        self.assertEqual(client_get.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [doc["pid"] for doc in client_get.data["results"]], [str(self.doc.pid)],
+        )
+        self.assertIsNone(client_get.data["next"])
+
+    @patch.object(FTLDocumentPagination, "page_size", 1)
+    def test_list_documents_cursor_pagination_same_title(self):
+        FTLDocument.objects.all().delete()
+
+        doc_1 = setup_document(self.org, self.user, title="ABC")
+        doc_2 = setup_document(self.org, self.user, title="ABC")
+        doc_3 = setup_document(self.org, self.user, title="BCD")
+
+        pids = []
+        url = "/app/api/v1/documents?pagination=cursor&ordering=title"
+        while url:
+            client_get = self.client.get(url, format="json")
+            self.assertEqual(client_get.status_code, status.HTTP_200_OK)
+            pids += [doc["pid"] for doc in client_get.data["results"]]
+            url = client_get.data["next"]
+
+        self.assertEqual(pids, [str(doc_1.pid), str(doc_2.pid), str(doc_3.pid)])
+
+    def test_list_documents_cursor_pagination_invalid_cursor(self):
+        client_get = self.client.get(
+            "/app/api/v1/documents?pagination=cursor&cursor=notacursor", format="json"
+        )
+        self.assertEqual(client_get.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(client_get.data["code"], "ftl_invalid_cursor")
+
+        # Well formed cursors with invalid values
+        for ordering, payload in [
+            ("title", {"v": ["a", "b"], "id": 1}),
+            ("title", {"v": {"a": 1}, "id": 1}),
+            ("title", {"v": "title", "id": "1"}),
+            ("created", {"v": 1, "id": 1}),
+            ("created", {"v": "not a date", "id": 1}),
+            ("created", {"v": "2021-01-01T00:00:00+00:00", "id": [1]}),
+        ]:
+            cursor = urlsafe_b64encode(json.dumps(payload).encode()).decode()
+            client_get = self.client.get(
+                f"/app/api/v1/documents?pagination=cursor&ordering={ordering}&cursor={cursor}",
+                format="json",
+            )
+            self.assertEqual(client_get.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(client_get.data["code"], "ftl_invalid_cursor")
+
     @patch.object(messages, "success")
     def test_list_documents_added_by_another_user_of_same_org(self, messages_mocked):
         # First user logout and a second user of the same org login
@@ -517,6 +600,57 @@ class DocumentsTests(APITestCase):
         self.assertTrue(isinstance(args[2], int))
         self.assertTrue(isinstance(kwarg["force"], list))
 
+    @patch.object(apply_ftl_processing, "delay")
+    def test_upload_duplicate_document(self, mock_apply_processing):
+        test_pdf = os.path.join(
+            settings.BASE_DIR, "ftests", "tools", "test_documents", "test.pdf"
+        )
+
+        with open(test_pdf, "rb") as f, execute_on_commit():
+            client_post = self.client.post(
+                "/app/api/v1/documents/upload", {"json": "{}", "file": f}
+            )
+        self.assertEqual(client_post.status_code, status.HTTP_201_CREATED)
+        mock_apply_processing.assert_called_once()
+        mock_apply_processing.reset_mock()
+
+        # Simulate the end of the processing
+        original_doc = FTLDocument.objects.get(pid=client_post.data["pid"])
+        original_doc.content_text = "Processed content"
+        original_doc.language = "english"
+        original_doc.save()
+        FTLDocument.objects.filter(pk=original_doc.pk).update(tsvector="processed")
+
+        with open(test_pdf, "rb") as f, execute_on_commit():
+            client_post = self.client.post(
+                "/app/api/v1/documents/upload",
+                {"json": json.dumps({"title": "duplicate"}), "file": f},
+            )
+        self.assertEqual(client_post.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(client_post.data["is_processed"])
+
+        # Binary and processing results are reused
+        mock_apply_processing.assert_not_called()
+        duplicate_doc = FTLDocument.objects.get(pid=client_post.data["pid"])
+        self.assertEqual(duplicate_doc.binary.name, original_doc.binary.name)
+        self.assertEqual(duplicate_doc.content_text, "Processed content")
+        self.assertEqual(duplicate_doc.language, "english")
+        self.assertEqual(duplicate_doc.blob.refs, 2)
+
+        # Documents of other orgs don't share binaries
+        org_2 = setup_org(name=tv.ORG_NAME_2, slug=tv.ORG_SLUG_2)
+        setup_user(org_2, email=tv.USER2_EMAIL, password=tv.USER2_PASS)
+        self.client.login(
+            request=HttpRequest(), email=tv.USER2_EMAIL, password=tv.USER2_PASS
+        )
+        with open(test_pdf, "rb") as f, execute_on_commit():
+            client_post = self.client.post(
+                "/app/api/v1/documents/upload", {"json": "{}", "file": f}
+            )
+        mock_apply_processing.assert_called_once()
+        other_org_doc = FTLDocument.objects.get(pid=client_post.data["pid"])
+        self.assertNotEqual(other_org_doc.binary.name, original_doc.binary.name)
+
     def test_document_in_folder(self):
         client_get = self.client.get(
             f"/app/api/v1/documents?level={self.first_level_folder.id}", format="json"
@@ -531,6 +665,44 @@ class DocumentsTests(APITestCase):
         self.assertEqual(client_doc["note"], self.doc_in_folder.note)
         self.assertEqual(client_doc["ftl_folder"], self.first_level_folder.id)
 
+    def test_list_documents_path_queries_count(self):
+        second_level_folder = setup_folder(
+            self.org, name="Second level folder", parent=self.first_level_folder
+        )
+        other_folder = setup_folder(self.org, name="Other folder")
+
+        with CaptureQueriesContext(connection) as one_folder_queries:
+            self.client.get("/app/api/v1/documents?flat=true", format="json")
+
+        doc_in_second_level_folder = setup_document(
+            self.org, self.user, ftl_folder=second_level_folder
+        )
+        setup_document(self.org, self.user, ftl_folder=other_folder)
+
+        with CaptureQueriesContext(connection) as many_folders_queries:
+            client_get = self.client.get(
+                "/app/api/v1/documents?flat=true", format="json"
+            )
+
+        # Folders paths are resolved all at once, the number of queries doesn't depend on the number of folders
+        self.assertEqual(
+            len(one_folder_queries.captured_queries),
+            len(many_folders_queries.captured_queries),
+        )
+
+        client_doc = next(
+            doc
+            for doc in json.loads(client_get.content)["results"]
+            if doc["pid"] == str(doc_in_second_level_folder.pid)
+        )
+        self.assertEqual(
+            client_doc["path"],
+            [
+                {"id": self.first_level_folder.id, "name": "First level folder"},
+                {"id": second_level_folder.id, "name": "Second level folder"},
+            ],
+        )
+
     @patch.object(apply_ftl_processing, "delay")
     def test_upload_document_in_folder(self, mock_apply_processing):
         post_body = {"ftl_folder": self.first_level_folder.id}
@@ -571,6 +743,437 @@ class DocumentsTests(APITestCase):
         self.assertEqual(client_doc_level["note"], client_doc["note"])
         self.assertEqual(client_doc_level["ftl_folder"], client_doc["ftl_folder"])
 
+    def _direct_upload(self, content, name="test.pdf", md5=None):
+        client_post = self.client.post(
+            "/app/api/v1/documents/upload/direct",
+            {"name": name, "md5": md5 or hashlib.md5(content).hexdigest()},
+            format="json",
+        )
+        self.assertEqual(client_post.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(client_post.data["upload_method"], "PUT")
+
+        client_put = self.client.put(
+            client_post.data["upload_url"],
+            content,
+            content_type=client_post.data["upload_headers"]["Content-Type"],
+        )
+        self.assertEqual(client_put.status_code, status.HTTP_204_NO_CONTENT)
+
+        return client_post.data["token"]
+
+    @override_settings(DEFAULT_FILE_STORAGE=FTLStorages.FILE_SYSTEM)
+    @patch.object(apply_ftl_processing, "delay")
+    def test_direct_upload_document(self, mock_apply_processing):
+        with open(
+            os.path.join(
+                settings.BASE_DIR, "ftests", "tools", "test_documents", "test.pdf"
+            ),
+            mode="rb",
+        ) as fp:
+            content = fp.read()
+
+        token = self._direct_upload(content)
+
+        client_post = self.client.post(
+            "/app/api/v1/documents/upload/finalize",
+            {"token": token, "ftl_folder": self.first_level_folder.id},
+            format="json",
+        )
+        self.assertEqual(client_post.status_code, status.HTTP_201_CREATED)
+
+        ftl_doc = FTLDocument.objects.get(pid=client_post.data["pid"])
+        self.assertEqual(ftl_doc.title, "test")
+        self.assertEqual(ftl_doc.size, 20247)
+        self.assertEqual(ftl_doc.md5, hashlib.md5(content).hexdigest())
+        self.assertEqual(ftl_doc.type, "application/pdf")
+        self.assertEqual(ftl_doc.ftl_folder, self.first_level_folder)
+        with ftl_doc.binary.open("rb") as f:
+            self.assertEqual(f.read(), content)
+
+        # A token can only be used once
+        client_post = self.client.post(
+            "/app/api/v1/documents/upload/finalize", {"token": token}, format="json",
+        )
+        self.assertEqual(client_post.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            client_post.data["code"], "ftl_direct_upload_invalid_token",
+        )
+
+    @override_settings(DEFAULT_FILE_STORAGE=FTLStorages.FILE_SYSTEM)
+    @patch.object(apply_ftl_processing, "delay")
+    def test_direct_upload_duplicate_document_token_reuse(self, mock_apply_processing):
+        content = self._read_test_pdf()
+        first_token = self._direct_upload(content)
+        client_post = self.client.post(
+            "/app/api/v1/documents/upload/finalize",
+            {"token": first_token},
+            format="json",
+        )
+        self.assertEqual(client_post.status_code, status.HTTP_201_CREATED)
+
+        # Identical document, its uploaded binary is replaced by the existing one
+        token = self._direct_upload(content)
+        client_post = self.client.post(
+            "/app/api/v1/documents/upload/finalize", {"token": token}, format="json",
+        )
+        self.assertEqual(client_post.status_code, status.HTTP_201_CREATED)
+        documents_count = FTLDocument.objects.count()
+
+        # The token can't be used to upload and finalize again
+        client_put = self.client.put(
+            reverse("api_direct_upload_local", kwargs={"token": token}),
+            content,
+            content_type="application/pdf",
+        )
+        self.assertEqual(client_put.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(client_put.data["code"], "ftl_direct_upload_invalid_token")
+
+        client_post = self.client.post(
+            "/app/api/v1/documents/upload/finalize", {"token": token}, format="json",
+        )
+        self.assertEqual(client_post.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(client_post.data["code"], "ftl_direct_upload_invalid_token")
+        self.assertEqual(FTLDocument.objects.count(), documents_count)
+
+    @override_settings(
+        DEFAULT_FILE_STORAGE=FTLStorages.FILE_SYSTEM, FTL_MAX_DIRECT_UPLOAD_SIZE=10
+    )
+    def test_direct_upload_document_too_large(self):
+        content = self._read_test_pdf()
+        client_post = self.client.post(
+            "/app/api/v1/documents/upload/direct",
+            {"name": "test.pdf", "md5": hashlib.md5(content).hexdigest()},
+            format="json",
+        )
+
+        client_put = self.client.put(
+            client_post.data["upload_url"], content, content_type="application/pdf",
+        )
+        self.assertEqual(client_put.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(client_put.data["code"], "ftl_file_too_large")
+
+        # Nothing has been stored
+        client_post = self.client.post(
+            "/app/api/v1/documents/upload/finalize",
+            {"token": client_post.data["token"]},
+            format="json",
+        )
+        self.assertEqual(client_post.data["code"], "ftl_direct_upload_not_found")
+
+    @override_settings(DEFAULT_FILE_STORAGE=FTLStorages.FILE_SYSTEM)
+    def test_direct_upload_document_errors(self):
+        client_post = self.client.post(
+            "/app/api/v1/documents/upload/direct",
+            {"name": "test.exe", "md5": "d85fce92a5789f66f58096402da6b98f"},
+            format="json",
+        )
+        self.assertEqual(
+            client_post.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+        )
+
+        client_post = self.client.post(
+            "/app/api/v1/documents/upload/direct",
+            {"name": "test.pdf", "md5": "not-a-md5"},
+            format="json",
+        )
+        self.assertEqual(client_post.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(client_post.data["code"], "ftl_missing_name_or_md5_in_body")
+
+        client_post = self.client.post(
+            "/app/api/v1/documents/upload/finalize",
+            {"token": "invalid"},
+            format="json",
+        )
+        self.assertEqual(client_post.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(client_post.data["code"], "ftl_direct_upload_invalid_token")
+
+    @override_settings(DEFAULT_FILE_STORAGE=FTLStorages.FILE_SYSTEM)
+    def test_direct_upload_document_incorrect_md5(self):
+        with open(
+            os.path.join(
+                settings.BASE_DIR, "ftests", "tools", "test_documents", "test.pdf"
+            ),
+            mode="rb",
+        ) as fp:
+            content = fp.read()
+
+        token = self._direct_upload(content, md5="d85fce92a5789f66f58096402da6b98f")
+
+        client_post = self.client.post(
+            "/app/api/v1/documents/upload/finalize", {"token": token}, format="json",
+        )
+        self.assertEqual(client_post.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(client_post.data["code"], "ftl_document_md5_mismatch")
+
+        # Corrupted binary has been removed from storage
+        client_post = self.client.post(
+            "/app/api/v1/documents/upload/finalize", {"token": token}, format="json",
+        )
+        self.assertEqual(client_post.data["code"], "ftl_direct_upload_not_found")
+
+    @override_settings(DEFAULT_FILE_STORAGE=FTLStorages.FILE_SYSTEM)
+    def test_direct_upload_document_type_mismatch(self):
+        with open(
+            os.path.join(
+                settings.BASE_DIR, "ftests", "tools", "test_documents", "word.docx"
+            ),
+            mode="rb",
+        ) as fp:
+            content = fp.read()
+
+        # Uploaded content isn't of the declared type
+        token = self._direct_upload(content, name="test.pdf")
+
+        client_post = self.client.post(
+            "/app/api/v1/documents/upload/finalize", {"token": token}, format="json",
+        )
+        self.assertEqual(
+            client_post.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+        )
+        self.assertFalse(
+            FTLDocument.objects.filter(md5=hashlib.md5(content).hexdigest()).exists()
+        )
+
+    @patch.object(FTLDirectUploadS3, "_get_key", return_value="uploads/doc.pdf")
+    @patch("core.direct_upload.default_storage")
+    def test_direct_upload_s3_metadata(self, mocked_storage, mocked_get_key):
+        content = self._read_test_pdf()
+        s3_client = mocked_storage.bucket.meta.client
+        s3_client.head_object.return_value = {
+            "ContentLength": len(content),
+            "ETag": '"d85fce92a5789f66f58096402da6b98f"',
+            # Declared by the client
+            "ContentType": "application/pdf",
+        }
+
+        def get_object(Bucket, Key, Range):
+            start, end = Range[len("bytes=") :].split("-")
+            return {"Body": BytesIO(content[int(start) : int(end) + 1])}
+
+        s3_client.get_object.side_effect = get_object
+
+        size, md5, mime = FTLDirectUploadS3().get_metadata("uploads/doc.pdf")
+
+        self.assertEqual(size, len(content))
+        self.assertEqual(md5, "d85fce92a5789f66f58096402da6b98f")
+        self.assertEqual(mime, "application/pdf")
+        # Only the first and last bytes are downloaded for guessing the type
+        self.assertEqual(
+            [c[1]["Range"] for c in s3_client.get_object.call_args_list],
+            [
+                f"bytes=0-{MIME_SAMPLE_SIZE - 1}",
+                f"bytes={len(content) - MIME_SAMPLE_SIZE}-{len(content) - 1}",
+            ],
+        )
+
+    def _read_test_pdf(self):
+        with open(
+            os.path.join(
+                settings.BASE_DIR, "ftests", "tools", "test_documents", "test.pdf"
+            ),
+            mode="rb",
+        ) as fp:
+            return fp.read()
+
+    def _upload_chunk(self, pid, offset, chunk):
+        return self.client.patch(
+            f"/app/api/v1/documents/uploads/{pid}",
+            chunk,
+            content_type="application/offset+octet-stream",
+            HTTP_UPLOAD_OFFSET=str(offset),
+        )
+
+    @override_settings(DEFAULT_FILE_STORAGE=FTLStorages.FILE_SYSTEM)
+    @patch.object(apply_ftl_processing, "delay")
+    def test_chunked_upload_document(self, mock_apply_processing):
+        content = self._read_test_pdf()
+
+        client_post = self.client.post(
+            "/app/api/v1/documents/uploads",
+            {
+                "name": "test.pdf",
+                "size": len(content),
+                "md5": hashlib.md5(content).hexdigest(),
+            },
+            format="json",
+        )
+        self.assertEqual(client_post.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(client_post.data["offset"], 0)
+        pid = client_post.data["pid"]
+
+        client_patch = self._upload_chunk(pid, 0, content[:10000])
+        self.assertEqual(client_patch.status_code, status.HTTP_200_OK)
+        self.assertEqual(client_patch["Upload-Offset"], "10000")
+
+        # Incomplete upload can't be finalized
+        client_post = self.client.post(
+            f"/app/api/v1/documents/uploads/{pid}/finalize", {}, format="json"
+        )
+        self.assertEqual(client_post.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(client_post.data["code"], "ftl_upload_incomplete")
+
+        # Chunk sent again after a connection loss
+        client_patch = self._upload_chunk(pid, 0, content[:10000])
+        self.assertEqual(client_patch.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(client_patch.data["code"], "ftl_upload_offset_mismatch")
+
+        # Resume from the current offset
+        client_get = self.client.get(f"/app/api/v1/documents/uploads/{pid}")
+        self.assertEqual(client_get.data["offset"], 10000)
+
+        client_patch = self._upload_chunk(pid, 10000, content[10000:])
+        self.assertEqual(client_patch.data["offset"], len(content))
+
+        # The chunks are assembled by a task
+        with patch.object(assemble_chunked_upload, "delay") as mocked_assemble:
+            with execute_on_commit():
+                client_post = self.client.post(
+                    f"/app/api/v1/documents/uploads/{pid}/finalize", {}, format="json"
+                )
+            self.assertEqual(client_post.status_code, status.HTTP_202_ACCEPTED)
+            self.assertEqual(client_post.data["status"], "assembling")
+            self.assertIn("Retry-After", client_post)
+            mocked_assemble.assert_called_once_with(str(pid))
+
+            # Finalized again while being assembled
+            client_post = self.client.post(
+                f"/app/api/v1/documents/uploads/{pid}/finalize", {}, format="json"
+            )
+            self.assertEqual(client_post.status_code, status.HTTP_202_ACCEPTED)
+            mocked_assemble.assert_called_once()
+
+        assemble_chunked_upload(pid)
+
+        upload = FTLDocumentUpload.objects.get(pid=pid)
+        self.assertEqual(upload.status, "assembled")
+        self.assertEqual(upload.md5, hashlib.md5(content).hexdigest())
+        # Chunks are deleted once assembled
+        self.assertEqual(upload.chunks, [])
+        self.assertFalse(default_storage.exists(upload.get_chunk_name(0)))
+
+        client_post = self.client.post(
+            f"/app/api/v1/documents/uploads/{pid}/finalize",
+            {"title": "chunked", "ftl_folder": self.first_level_folder.id},
+            format="json",
+        )
+        self.assertEqual(client_post.status_code, status.HTTP_201_CREATED)
+
+        ftl_doc = FTLDocument.objects.get(pid=client_post.data["pid"])
+        self.assertEqual(ftl_doc.title, "chunked")
+        self.assertEqual(ftl_doc.size, len(content))
+        self.assertEqual(ftl_doc.md5, hashlib.md5(content).hexdigest())
+        self.assertEqual(ftl_doc.type, "application/pdf")
+        self.assertEqual(ftl_doc.ftl_folder, self.first_level_folder)
+        with ftl_doc.binary.open("rb") as f:
+            self.assertEqual(f.read(), content)
+
+        # The upload is removed once finalized
+        self.assertFalse(FTLDocumentUpload.objects.filter(pid=pid).exists())
+
+    @override_settings(DEFAULT_FILE_STORAGE=FTLStorages.FILE_SYSTEM)
+    def test_chunked_upload_document_incorrect_md5(self):
+        content = self._read_test_pdf()
+
+        client_post = self.client.post(
+            "/app/api/v1/documents/uploads",
+            {
+                "name": "test.pdf",
+                "size": len(content),
+                "md5": "d85fce92a5789f66f58096402da6b98f",
+            },
+            format="json",
+        )
+        pid = client_post.data["pid"]
+
+        client_patch = self._upload_chunk(pid, 0, content)
+        self.assertEqual(client_patch.status_code, status.HTTP_200_OK)
+
+        client_post = self.client.post(
+            f"/app/api/v1/documents/uploads/{pid}/finalize", {}, format="json"
+        )
+        self.assertEqual(client_post.status_code, status.HTTP_202_ACCEPTED)
+        assemble_chunked_upload(pid)
+
+        client_post = self.client.post(
+            f"/app/api/v1/documents/uploads/{pid}/finalize", {}, format="json"
+        )
+        self.assertEqual(client_post.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(client_post.data["code"], "ftl_document_md5_mismatch")
+
+        # Nothing is left in the storage
+        upload = FTLDocumentUpload.objects.get(pid=pid)
+        self.assertEqual(upload.status, "failed")
+        self.assertIsNone(upload.binary)
+        self.assertFalse(default_storage.exists(upload.get_chunk_name(0)))
+
+    @override_settings(DEFAULT_FILE_STORAGE=FTLStorages.FILE_SYSTEM)
+    def test_chunked_upload_document_type_mismatch(self):
+        with open(
+            os.path.join(
+                settings.BASE_DIR, "ftests", "tools", "test_documents", "word.docx"
+            ),
+            mode="rb",
+        ) as fp:
+            content = fp.read()
+
+        client_post = self.client.post(
+            "/app/api/v1/documents/uploads",
+            {"name": "test.pdf", "size": len(content)},
+            format="json",
+        )
+        pid = client_post.data["pid"]
+        self._upload_chunk(pid, 0, content[:100])
+        self._upload_chunk(pid, 100, content[100:])
+
+        self.client.post(
+            f"/app/api/v1/documents/uploads/{pid}/finalize", {}, format="json"
+        )
+        assemble_chunked_upload(pid)
+
+        client_post = self.client.post(
+            f"/app/api/v1/documents/uploads/{pid}/finalize", {}, format="json"
+        )
+        self.assertEqual(
+            client_post.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+        )
+
+    def test_chunked_upload_document_errors(self):
+        client_post = self.client.post(
+            "/app/api/v1/documents/uploads", {"name": "test.pdf"}, format="json",
+        )
+        self.assertEqual(client_post.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(client_post.data["code"], "ftl_missing_name_or_size_in_body")
+
+        client_post = self.client.post(
+            "/app/api/v1/documents/uploads",
+            {"name": "test.exe", "size": 42},
+            format="json",
+        )
+        self.assertEqual(
+            client_post.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+        )
+
+        client_post = self.client.post(
+            "/app/api/v1/documents/uploads",
+            {"name": "test.pdf", "size": 42},
+            format="json",
+        )
+        pid = client_post.data["pid"]
+
+        # Chunk bigger than the declared size
+        client_patch = self._upload_chunk(pid, 0, b"a" * 43)
+        self.assertEqual(client_patch.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(client_patch.data["code"], "ftl_upload_invalid_chunk")
+
+        # Uploads are private to their user
+        self.client.logout()
+        setup_user(self.org, email=tv.USER2_EMAIL, password=tv.USER2_PASS)
+        self.client.login(
+            request=HttpRequest(), email=tv.USER2_EMAIL, password=tv.USER2_PASS
+        )
+        client_get = self.client.get(f"/app/api/v1/documents/uploads/{pid}")
+        self.assertEqual(client_get.status_code, status.HTTP_404_NOT_FOUND)
+
     @patch.object(apply_ftl_processing, "delay")
     def test_rename_document_reapply_tsvector_proc(self, mock_apply_processing):
         with execute_on_commit():
@@ -932,6 +1535,38 @@ class FoldersTests(APITestCase):
         self.assertEqual(client_data["name"], self.folder_root_subfolder.name)
         self.assertEqual(client_data["parent"], self.folder_root.id)
 
+    def test_folder_tree_queries_count(self):
+        with CaptureQueriesContext(connection) as one_folder_queries:
+            self.client.get(
+                f"/app/api/v1/folders?level={self.folder_root.id}", format="json"
+            )
+
+        for i in range(10):
+            folder = setup_folder(
+                self.org, name=f"Second level folder {i}", parent=self.folder_root
+            )
+            setup_folder(self.org, name=f"Third level folder {i}", parent=folder)
+
+        with CaptureQueriesContext(connection) as many_folders_queries:
+            client_get = self.client.get(
+                f"/app/api/v1/folders?level={self.folder_root.id}", format="json"
+            )
+
+        # Paths and descendants are resolved at once, the number of queries doesn't depend on the number of folders
+        self.assertEqual(
+            len(one_folder_queries.captured_queries),
+            len(many_folders_queries.captured_queries),
+        )
+
+        client_data = json.loads(client_get.content)
+        self.assertEqual(len(client_data), 11)
+        for folder in client_data:
+            self.assertEqual(folder["paths"][0]["id"], self.folder_root.id)
+            self.assertEqual(folder["paths"][1]["id"], folder["id"])
+            self.assertEqual(
+                folder["has_descendant"], folder["name"] != "Second level folder"
+            )
+
     def test_create_folder(self):
         client_post = self.client.post(
             "/app/api/v1/folders", {"name": "Folder created"}, format="json"
@@ -1036,6 +1671,57 @@ class FoldersTests(APITestCase):
         self.assertTrue(doc_folder_a_b2_c.deleted)
 
 
+@override_settings(FTL_PROCESSING_CALLBACK_HOST="http://ftl-app:8000/")
+class ProcessingCallbackTests(APITestCase):
+    def setUp(self):
+        self.org = setup_org()
+        setup_admin(self.org)
+        self.user = setup_user(self.org)
+        self.doc = setup_document(self.org, self.user)
+
+        self.ocr_job = FTLOCRJob.objects.create(
+            ftl_doc=self.doc, plugin=FTLPlugins.OCR_OCR_MY_PDF, job_id="job-1",
+        )
+
+    def test_callback_url(self):
+        url = get_job_callback_url(
+            self.doc, FTLOCRmyPDF("http://ocrmypdf-api.example.org", "key")
+        )
+        self.assertTrue(url.startswith("http://ftl-app:8000/app/api/v1/processing/"))
+
+        with override_settings(FTL_PROCESSING_CALLBACK_HOST=None):
+            self.assertIsNone(get_job_callback_url(self.doc, Mock()))
+
+    @patch.object(poll_ocr_job, "delay")
+    def test_callback(self, mock_poll_ocr_job):
+        url = get_job_callback_url(
+            self.doc, FTLOCRmyPDF("http://ocrmypdf-api.example.org", "key")
+        )
+        url = urlparse(url).path
+
+        client_post = self.client.post(url, format="json")
+        self.assertEqual(client_post.status_code, status.HTTP_204_NO_CONTENT)
+
+        # Job result is fetched right away
+        mock_poll_ocr_job.assert_called_once_with(str(self.ocr_job.pid))
+
+        # Already handled jobs are ignored
+        mock_poll_ocr_job.reset_mock()
+        FTLOCRJob.objects.update(status=FTLOCRJob.DONE)
+        client_post = self.client.post(url, format="json")
+        self.assertEqual(client_post.status_code, status.HTTP_204_NO_CONTENT)
+        mock_poll_ocr_job.assert_not_called()
+
+    def test_callback_invalid_token(self):
+        client_post = self.client.post(
+            "/app/api/v1/processing/callback/invalid", format="json"
+        )
+        self.assertEqual(client_post.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            client_post.data["code"], "ftl_processing_callback_invalid_token"
+        )
+
+
 @contextmanager
 def execute_on_commit(immediately=False, using=None):
     """
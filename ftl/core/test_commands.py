@@ -0,0 +1,284 @@
+#  Copyright (c) 2021 Exotic Matter SAS. All rights reserved.
+#  Licensed under the Business Source License. See LICENSE at project root for more information.
+import hashlib
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest.mock import patch, call
+
+from django.conf import settings
+from django.core import management
+from django.core.files.storage import default_storage
+from django.db import connection, DatabaseError
+from django.test import TestCase
+from django.utils import timezone
+
+from core.management.commands import import_docs
+from core.management.commands.create_search_index import INDEX_NAME
+from core.models import FTLDocument, FTLFolder, create_document_blob
+from core.tasks import apply_ftl_processing_batch
+from ftests.tools import test_values as tv
+from ftl.enums import FTLPlugins
+from ftests.tools.setup_helpers import (
+    setup_org,
+    setup_admin,
+    setup_user,
+    setup_document,
+    setup_document_share,
+    setup_document_reminder,
+)
+
+
+class CreateSearchIndexCommandTests(TestCase):
+    def _index_def(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT indexdef FROM pg_indexes WHERE indexname = %s", [INDEX_NAME]
+            )
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    def test_index_created_by_migration(self):
+        index_def = self._index_def()
+
+        self.assertIsNotNone(index_def)
+        self.assertIn("gin", index_def)
+        self.assertIn("deleted = false", index_def)
+
+    def test_rebuild_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP INDEX {INDEX_NAME}")
+        self.assertIsNone(self._index_def())
+
+        management.call_command("create_search_index")
+        self.assertIsNotNone(self._index_def())
+
+        # Calling it again is a no-op, unless a rebuild is asked
+        management.call_command("create_search_index")
+        management.call_command("create_search_index", rebuild=True)
+        self.assertIsNotNone(self._index_def())
+
+
+class RepairDocumentsCountersCommandTests(TestCase):
+    def test_repair_documents_counters(self):
+        org = setup_org()
+        setup_admin(org)
+        user = setup_user(org)
+        document = setup_document(org, user)
+        setup_document_share(document)
+        setup_document_reminder(document, user, timezone.now() + timedelta(days=1))
+
+        # Counters are out of sync
+        FTLDocument.objects.filter(pk=document.pk).update(
+            shares_count=42, reminders_count=0
+        )
+
+        management.call_command("repair_documents_counters")
+
+        document.refresh_from_db()
+        self.assertEqual(document.shares_count, 1)
+        self.assertEqual(document.reminders_count, 1)
+
+
+class ReindexDocsCommandTests(TestCase):
+    def setUp(self):
+        self.org = setup_org()
+        setup_admin(self.org)
+        self.user = setup_user(self.org)
+        self.docs = [
+            setup_document(self.org, self.user, title=f"doc {i}") for i in range(5)
+        ]
+
+    @patch("core.management.commands.reindex_docs.group")
+    def test_reindex_docs_by_batches(self, mocked_group):
+        management.call_command(
+            "reindex_docs", "*", batch_size=2, rate=0, force=["LANG_DETECTOR_LANGID"]
+        )
+
+        # 5 documents submitted by batches of 2
+        self.assertEqual(mocked_group.call_count, 3)
+        self.assertEqual(
+            mocked_group.return_value.apply_async.call_args_list, [call()] * 3
+        )
+
+        # One processing task per batch, as batches are smaller than PROCESSING_BATCH_SIZE
+        signatures = [
+            signature
+            for group_call in mocked_group.call_args_list
+            for signature in group_call[0][0]
+        ]
+        self.assertEqual(len(signatures), 3)
+        self.assertCountEqual(
+            [pid for signature in signatures for pid in signature.args[0]],
+            [doc.pid for doc in self.docs],
+        )
+        for signature in signatures:
+            self.assertEqual(signature.task, apply_ftl_processing_batch.name)
+            self.assertEqual(
+                signature.kwargs, {"force": [FTLPlugins.LANG_DETECTOR_LANGID]}
+            )
+
+    @patch("core.management.commands.reindex_docs.group")
+    def test_reindex_docs_selected(self, mocked_group):
+        management.call_command("reindex_docs", str(self.docs[0].pid), rate=0)
+
+        self.assertEqual(mocked_group.call_count, 1)
+        signatures = list(mocked_group.call_args[0][0])
+        self.assertEqual(len(signatures), 1)
+        self.assertEqual(signatures[0].args, ([self.docs[0].pid],))
+
+    @patch("core.management.commands.reindex_docs.time.sleep")
+    @patch("core.management.commands.reindex_docs.group")
+    def test_reindex_docs_rate_limited(self, mocked_group, mocked_sleep):
+        management.call_command("reindex_docs", "*", batch_size=5, rate=1)
+
+        # 5 documents at 1 document per second
+        mocked_sleep.assert_called_once()
+        self.assertAlmostEqual(mocked_sleep.call_args[0][0], 5, delta=1)
+
+
+class ImportDocsCommandTests(TestCase):
+    def setUp(self):
+        self.org = setup_org()
+        setup_admin(self.org)
+        self.user = setup_user(self.org)
+
+        test_pdf = os.path.join(
+            settings.BASE_DIR, "ftests", "tools", "test_documents", "test.pdf"
+        )
+        self.import_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.import_dir)
+        os.mkdir(os.path.join(self.import_dir, "folder"))
+        shutil.copy(test_pdf, os.path.join(self.import_dir, "doc.pdf"))
+        shutil.copy(test_pdf, os.path.join(self.import_dir, "folder", "copy.pdf"))
+        with open(os.path.join(self.import_dir, "unsupported.bin"), "wb") as f:
+            f.write(b"\x00\x01\x02")
+
+        # Outside of the imported folder
+        checkpoint_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, checkpoint_dir)
+        self.checkpoint = os.path.join(checkpoint_dir, "import.checkpoint")
+
+    @patch.object(apply_ftl_processing_batch, "delay")
+    def test_import_docs(self, mocked_delay):
+        management.call_command(
+            "import_docs",
+            path=self.import_dir,
+            email=tv.USER1_EMAIL,
+            workers=2,
+            batch_size=1,
+            checkpoint=self.checkpoint,
+        )
+
+        documents = FTLDocument.objects.filter(org=self.org).order_by("title")
+        self.assertEqual(len(documents), 2)
+        # Batches of one document
+        self.assertEqual(mocked_delay.call_count, 2)
+        self.assertCountEqual(
+            [c[0][0] for c in mocked_delay.call_args_list],
+            [[doc.pid] for doc in documents],
+        )
+
+        copy_doc, doc = documents
+        self.assertEqual(copy_doc.ftl_folder, FTLFolder.objects.get(name="folder"))
+        self.assertIsNone(doc.ftl_folder)
+        self.assertEqual(doc.type, "application/pdf")
+        self.assertEqual(doc.size, 20247)
+        self.assertEqual(doc.md5, copy_doc.md5)
+
+        # Identical documents share the same binary
+        self.assertEqual(doc.binary.name, copy_doc.binary.name)
+        self.assertEqual(doc.blob.refs, 2)
+
+        # Checkpoint is deleted once the import is done
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    @patch.object(apply_ftl_processing_batch, "delay")
+    def test_import_docs_resume(self, mocked_delay):
+        # Interrupted import
+        with open(self.checkpoint, "w") as f:
+            f.write(os.path.join(self.import_dir, "doc.pdf") + "\n")
+
+        management.call_command(
+            "import_docs",
+            path=self.import_dir,
+            email=tv.USER1_EMAIL,
+            checkpoint=self.checkpoint,
+        )
+
+        # Already imported documents are skipped
+        documents = FTLDocument.objects.filter(org=self.org)
+        self.assertEqual([doc.title for doc in documents], ["copy.pdf"])
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_import_docs_default_checkpoint(self):
+        other_user = setup_user(self.org, tv.USER2_EMAIL, tv.USER2_PASS)
+        command = import_docs.Command()
+
+        command.user = self.user
+        checkpoint = command._get_default_checkpoint_path(self.import_dir)
+        self.assertEqual(
+            command._get_default_checkpoint_path(self.import_dir + "/"), checkpoint
+        )
+        self.assertNotEqual(
+            command._get_default_checkpoint_path(tempfile.gettempdir()), checkpoint
+        )
+
+        # Imports of the same tree for another user don't share the checkpoint
+        command.user = other_user
+        self.assertNotEqual(
+            command._get_default_checkpoint_path(self.import_dir), checkpoint
+        )
+
+    @patch.object(apply_ftl_processing_batch, "delay")
+    def test_import_docs_processed_duplicates(self, mocked_delay):
+        with open(os.path.join(self.import_dir, "doc.pdf"), "rb") as f:
+            md5 = hashlib.md5(f.read()).hexdigest()
+        processed_doc = setup_document(
+            self.org, self.user, text_content="Processed text", language="english"
+        )
+        FTLDocument.objects.filter(pk=processed_doc.pk).update(md5=md5, size=20247)
+        processed_doc.refresh_from_db()
+        create_document_blob(processed_doc)
+
+        management.call_command(
+            "import_docs",
+            path=self.import_dir,
+            email=tv.USER1_EMAIL,
+            checkpoint=self.checkpoint,
+        )
+
+        # Processing results of the identical document are reused
+        mocked_delay.assert_not_called()
+        documents = FTLDocument.objects.filter(org=self.org).exclude(
+            pk=processed_doc.pk
+        )
+        self.assertEqual(len(documents), 2)
+        for document in documents:
+            self.assertEqual(document.content_text, "Processed text")
+            self.assertEqual(document.language, "english")
+            self.assertTrue(document.tsvector)
+
+    @patch.object(apply_ftl_processing_batch, "delay")
+    def test_import_docs_failed_batch(self, mocked_delay):
+        with patch.object(
+            FTLDocument.objects, "bulk_create", side_effect=DatabaseError()
+        ), patch.object(
+            default_storage, "delete", wraps=default_storage.delete
+        ) as mocked_delete:
+            with self.assertRaises(DatabaseError):
+                management.call_command(
+                    "import_docs",
+                    path=self.import_dir,
+                    email=tv.USER1_EMAIL,
+                    checkpoint=self.checkpoint,
+                )
+
+        # Stored binaries are not left orphaned
+        deleted_names = [c[0][0] for c in mocked_delete.call_args_list]
+        self.assertEqual(len(deleted_names), 2)
+        for name in deleted_names:
+            self.assertFalse(default_storage.exists(name))
+        self.assertFalse(FTLDocument.objects.filter(org=self.org).exists())
+        mocked_delay.assert_not_called()
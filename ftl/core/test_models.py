@@ -23,9 +23,18 @@ from ftests.tools.setup_helpers import (
     setup_folder,
     setup_document,
     setup_temporary_file,
+    setup_document_share,
+    setup_document_reminder,
 )
 from ftl import celery
-from .models import FTLUser, FTLDocument, FTLFolder
+from .models import (
+    FTLUser,
+    FTLDocument,
+    FTLFolder,
+    FTLDocumentBlob,
+    use_document_blob,
+    create_document_blob,
+)
 
 
 class FTLUserModelTest(TestCase):
@@ -184,3 +193,85 @@ class FTLUserModelTest(TestCase):
 
         refresh_token.refresh_from_db()
         self.assertIsNotNone(refresh_token.revoked)
+
+    def test_document_counters(self):
+        org = setup_org()
+        setup_admin(org)
+        user = setup_user(org)
+        document = setup_document(org, user)
+
+        share_1 = setup_document_share(document)
+        setup_document_share(document)
+        reminder = setup_document_reminder(
+            document, user, timezone.now() + timedelta(days=1)
+        )
+
+        document.refresh_from_db()
+        self.assertEqual(document.shares_count, 2)
+        self.assertEqual(document.reminders_count, 1)
+
+        share_1.delete()
+        reminder.delete()
+
+        document.refresh_from_db()
+        self.assertEqual(document.shares_count, 1)
+        self.assertEqual(document.reminders_count, 0)
+
+    def test_document_counters_not_overwritten_by_save(self):
+        org = setup_org()
+        setup_admin(org)
+        user = setup_user(org)
+        document = setup_document(org, user)
+
+        stale_document = FTLDocument.objects.get(pk=document.pk)
+        setup_document_reminder(document, user, timezone.now() + timedelta(days=1))
+
+        # Instance loaded before the reminder creation is saved (eg. title edit)
+        stale_document.title = "New title"
+        stale_document.save()
+
+        document.refresh_from_db()
+        self.assertEqual(document.title, "New title")
+        self.assertEqual(document.reminders_count, 1)
+
+    def test_document_blob_refs(self):
+        org = setup_org()
+        setup_admin(org)
+        user = setup_user(org)
+
+        binary_f = setup_temporary_file().name
+        document_1 = FTLDocument.objects.create(
+            org=org,
+            ftl_user=user,
+            title="Original document",
+            binary=binary_f,
+            md5="d85fce92a5789f66f58096402da6b98f",
+            size=12,
+        )
+        create_document_blob(document_1)
+
+        document_2 = FTLDocument(
+            org=org,
+            ftl_user=user,
+            title="Duplicate document",
+            md5="d85fce92a5789f66f58096402da6b98f",
+            size=12,
+        )
+        duplicate_doc = use_document_blob(document_2)
+        document_2.save()
+
+        self.assertEqual(duplicate_doc, document_1)
+        self.assertEqual(document_2.binary.name, document_1.binary.name)
+        blob = FTLDocumentBlob.objects.get(org=org)
+        self.assertEqual(blob.refs, 2)
+
+        # Binary is still used by the duplicate document
+        document_1.delete()
+        self.assertTrue(os.path.exists(binary_f))
+        blob.refresh_from_db()
+        self.assertEqual(blob.refs, 1)
+
+        # Last document using the binary
+        document_2.delete()
+        self.assertFalse(os.path.exists(binary_f))
+        self.assertFalse(FTLDocumentBlob.objects.filter(org=org).exists())
@@ -1,24 +1,38 @@
 #  Copyright (c) 2020 Exotic Matter SAS. All rights reserved.
 #  Licensed under the Business Source License. See LICENSE at project root for more information.
+import threading
 import uuid
+from datetime import datetime, timezone, timedelta
 from unittest import mock
-from unittest.mock import Mock, patch, call, MagicMock
+from unittest.mock import Mock, patch, call, MagicMock, ANY
 
 import requests
 from django.conf import settings
 from django.core.files import File
+from django.db import connection, IntegrityError
 from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone as django_timezone
 from jose import jwt
 from tika import parser
 
-from core.errors import PluginUnsupportedStorage
-from core.models import FTLDocument
+from core.errors import (
+    PluginUnsupportedStorage,
+    TikaServersBusy,
+    ProcessingSuspended,
+    OCRFailed,
+)
+from core.models import FTLDocument, FTLOCRJob, FTLOCRResult
 from core.processing import ftl_processing
 from core.processing.ftl_processing import (
     FTLDocumentProcessing,
     FTLDocProcessingBase,
     FTLOCRBase,
+    FTLProcessingContext,
     atomic_ftl_doc_update,
+    get_plugins_dependencies,
+    record_ocr_failure,
+    record_ocr_success,
 )
 from core.processing.proc_lang import FTLLangDetectorLangId
 from core.processing.proc_ocrmypdf import FTLOCRmyPDF
@@ -27,9 +41,21 @@ from core.processing.proc_pgsql_tsvector import (
     SEARCH_VECTOR,
 )
 from core.processing.proc_thumb_only_office import FTLThumbnailGenerationOnlyOffice
-from core.processing.proc_tika import FTLTextExtractionTika
+from core.processing.proc_tika import (
+    FTLTextExtractionTika,
+    get_tika_parse_result,
+    get_tika_metadata,
+)
+from core.processing.tika_client import FTLTikaClient, get_tika_client
 from core.serializers import FTLDocumentDetailsOnlyOfficeSerializer
 from core.signals import pre_ftl_processing
+from ftl.enums import FTLPlugins, FTLProcessingStages
+from ftests.tools.setup_helpers import (
+    setup_org,
+    setup_admin,
+    setup_user,
+    setup_document,
+)
 
 
 class ProcTest(FTLDocProcessingBase):
@@ -43,6 +69,65 @@ class ProcTest(FTLDocProcessingBase):
         pass
 
 
+class ProcContentTest(FTLDocProcessingBase):
+    supported_documents_types = ["*"]
+
+    def process(self, ftl_doc, force):
+        atomic_ftl_doc_update(
+            ftl_doc.pid, {"content_text": "Le renard brun saute", "count_pages": 1}
+        )
+
+
+class ProcLanguageTest(FTLDocProcessingBase):
+    supported_documents_types = ["*"]
+
+    def process(self, ftl_doc, force):
+        # Previous plugin updates are visible before being written
+        if ftl_doc.content_text == "Le renard brun saute":
+            atomic_ftl_doc_update(ftl_doc.pid, {"language": "french"})
+
+
+class DocumentProcessingContextTests(TestCase):
+    def setUp(self):
+        org = setup_org()
+        setup_admin(org)
+        user = setup_user(org)
+        self.doc = setup_document(org, user, text_content="", language="simple")
+
+        self.processing = FTLDocumentProcessing(
+            [
+                "core.test_processing.ProcContentTest",
+                "core.test_processing.ProcLanguageTest",
+                "core.processing.proc_pgsql_tsvector.FTLSearchEnginePgSQLTSVector",
+            ]
+        )
+
+    def _count_updates(self, force):
+        with CaptureQueriesContext(connection) as queries:
+            self.processing.apply_processing(self.doc, force)
+
+        return len([q for q in queries if q["sql"].startswith("UPDATE")])
+
+    def test_updates_written_at_once(self):
+        # Plain values at once, then tsvector computed from them
+        self.assertEqual(self._count_updates(True), 2)
+
+        self.doc.refresh_from_db()
+        self.assertEqual(self.doc.content_text, "Le renard brun saute")
+        self.assertEqual(self.doc.count_pages, 1)
+        self.assertEqual(self.doc.language, "french")
+        self.assertIn("'renard'", self.doc.tsvector)
+
+    @patch.object(ProcContentTest, "processing_checkpoint", True)
+    def test_updates_checkpoint(self):
+        self.assertEqual(self._count_updates(True), 3)
+
+        self.doc.refresh_from_db()
+        self.assertEqual(self.doc.content_text, "Le renard brun saute")
+        self.assertEqual(self.doc.language, "french")
+        self.assertIn("'renard'", self.doc.tsvector)
+
+
 class DocumentProcessingTests(TestCase):
     def setUp(self):
         configured_plugins = ["core.test_processing.ProcTest"]
@@ -158,6 +243,24 @@ class DocumentProcessingTests(TestCase):
         self.assertNotIn(mocked_plugin_2.__class__.__name__, error_logs.output[1])
         self.assertIn(mocked_plugin_3.__class__.__name__, error_logs.output[1])
 
+    def test_check_health(self):
+        mocked_plugin_1 = Mock()
+        mocked_plugin_1.__class__.__name__ = "OK"
+        mocked_plugin_2 = Mock()
+        mocked_plugin_2.__class__.__name__ = "Boum!"
+        mocked_plugin_2.check_health.side_effect = Exception("Invalid credentials")
+
+        self.processing.plugins = [mocked_plugin_1, mocked_plugin_2]
+
+        logger_name = ftl_processing.logger.name
+        with self.assertLogs(logger_name, "ERROR") as error_logs:
+            failing_plugins = self.processing.check_health()
+
+        self.assertEqual(failing_plugins, ["Boum!"])
+        self.assertEqual(len(error_logs.output), 1)
+        mocked_plugin_1.check_health.assert_called_once_with()
+        mocked_plugin_2.check_health.assert_called_once_with()
+
     def test_supported_type(self):
         mock_plugin_1 = Mock()
         mock_plugin_2 = Mock()
@@ -191,6 +294,395 @@ class DocumentProcessingTests(TestCase):
         mocked_signal.assert_called_once_with(sender=ProcTest, document=doc)
 
 
+class FieldsTestPlugin(FTLDocProcessingBase):
+    supported_documents_types = ["*"]
+
+    def __init__(self, requires, provides, process=None):
+        self.requires = requires
+        self.provides = provides
+        self._process = process
+
+    def process(self, ftl_doc, force):
+        if self._process:
+            self._process()
+
+
+class DocumentProcessingDependenciesTests(TestCase):
+    def test_plugins_dependencies(self):
+        plugins = [
+            FieldsTestPlugin([], ["thumbnail_binary"]),
+            FieldsTestPlugin([], ["content_text", "ocrized"]),
+            FieldsTestPlugin([], ["content_text", "count_pages"]),
+            FieldsTestPlugin(["content_text"], ["language"]),
+            FieldsTestPlugin(["content_text", "language"], ["tsvector"]),
+            # No dependencies declared
+            FieldsTestPlugin(None, []),
+            FieldsTestPlugin([], ["thumbnail_binary"]),
+        ]
+
+        self.assertEqual(
+            get_plugins_dependencies(plugins),
+            {
+                0: set(),
+                1: set(),
+                2: {1},
+                3: {1, 2},
+                4: {1, 2, 3},
+                5: {0, 1, 2, 3, 4},
+                6: {0, 5},
+            },
+        )
+
+    def test_independent_plugins_run_concurrently(self):
+        # Both plugins have to wait for each other
+        barrier = threading.Barrier(2, timeout=5)
+        plugins_done = list()
+
+        def process_independent():
+            barrier.wait()
+            plugins_done.append("independent")
+
+        def process_dependent():
+            plugins_done.append("dependent")
+
+        processing = FTLDocumentProcessing([])
+        processing.plugins = [
+            FieldsTestPlugin([], ["thumbnail_binary"], process_independent),
+            FieldsTestPlugin([], ["content_text"], process_independent),
+            FieldsTestPlugin(
+                ["content_text", "thumbnail_binary"], ["language"], process_dependent
+            ),
+        ]
+
+        processing.apply_processing(Mock())
+
+        # Plugins running sequentially would fail on barrier timeout
+        self.assertEqual(plugins_done, ["independent", "independent", "dependent"])
+
+    def test_plugins_reading(self):
+        processing = FTLDocumentProcessing(
+            [
+                FTLPlugins.OCR_OCR_MY_PDF,
+                FTLPlugins.TEXT_EXTRACTION_TIKA,
+                FTLPlugins.LANG_DETECTOR_LANGID,
+                FTLPlugins.SEARCH_ENGINE_PGSQL_TSVECTOR,
+            ]
+        )
+
+        # Text extraction doesn't read the OCR results, search reads them through the lang detection
+        self.assertEqual(
+            processing.get_plugins_reading([FTLPlugins.OCR_OCR_MY_PDF]),
+            [FTLPlugins.LANG_DETECTOR_LANGID, FTLPlugins.SEARCH_ENGINE_PGSQL_TSVECTOR,],
+        )
+        self.assertEqual(
+            processing.get_plugins_reading([FTLPlugins.SEARCH_ENGINE_PGSQL_TSVECTOR]),
+            [],
+        )
+
+
+class DocumentProcessingStagesTests(TestCase):
+    def setUp(self):
+        self.processing = FTLDocumentProcessing(
+            [
+                FTLPlugins.THUMBNAIL_ONLY_OFFICE,
+                FTLPlugins.OCR_OCR_MY_PDF,
+                FTLPlugins.TEXT_EXTRACTION_TIKA,
+                FTLPlugins.LANG_DETECTOR_LANGID,
+                FTLPlugins.SEARCH_ENGINE_PGSQL_TSVECTOR,
+                "core.test_processing.ProcTest",
+            ]
+        )
+
+    def test_get_stages(self):
+        self.assertEqual(
+            self.processing.get_stages(),
+            [
+                (FTLProcessingStages.THUMB, [FTLPlugins.THUMBNAIL_ONLY_OFFICE]),
+                (FTLProcessingStages.OCR, [FTLPlugins.OCR_OCR_MY_PDF]),
+                (FTLProcessingStages.EXTRACT, [FTLPlugins.TEXT_EXTRACTION_TIKA]),
+                (
+                    FTLProcessingStages.INDEX,
+                    [
+                        FTLPlugins.LANG_DETECTOR_LANGID,
+                        FTLPlugins.SEARCH_ENGINE_PGSQL_TSVECTOR,
+                    ],
+                ),
+                # Plugins without stage
+                (FTLProcessingStages.EXTRACT, ["core.test_processing.ProcTest"]),
+            ],
+        )
+
+    def test_apply_processing_stage(self):
+        mock_plugins = list()
+        for plugin in self.processing.plugins:
+            mock_plugin = Mock(spec=plugin)
+            mock_plugin.supported_documents_types = ["*"]
+            mock_plugins.append(mock_plugin)
+        self.processing.plugins = mock_plugins
+
+        doc = Mock()
+        self.processing.apply_processing_stage(
+            doc,
+            False,
+            [FTLPlugins.LANG_DETECTOR_LANGID, FTLPlugins.SEARCH_ENGINE_PGSQL_TSVECTOR],
+        )
+
+        for mock_plugin in mock_plugins[:3] + mock_plugins[5:]:
+            mock_plugin.process.assert_not_called()
+        for mock_plugin in mock_plugins[3:5]:
+            mock_plugin.process.assert_called_once_with(doc, False)
+
+
+class DocumentProcessingSuspensionTests(TestCase):
+    def setUp(self):
+        org = setup_org()
+        setup_admin(org)
+        user = setup_user(org)
+        self.doc = setup_document(org, user, text_content="")
+
+    @patch.object(ftl_processing.celery.app, "send_task")
+    def test_processing_suspended(self, mocked_send_task):
+        plugins_done = list()
+
+        def process_ocr():
+            raise ProcessingSuspended("job-1")
+
+        processing = FTLDocumentProcessing([])
+        processing.plugins = [
+            FieldsTestPlugin([], ["content_text", "ocrized"], process_ocr),
+            FieldsTestPlugin(
+                [], ["thumbnail_binary"], lambda: plugins_done.append("thumbnail")
+            ),
+            FieldsTestPlugin(
+                ["content_text"], ["language"], lambda: plugins_done.append("lang")
+            ),
+            FieldsTestPlugin(
+                ["language"], ["tsvector"], lambda: plugins_done.append("tsvector")
+            ),
+        ]
+
+        ocr_jobs = processing.apply_processing(self.doc, ["my.plugin"])
+
+        # Plugins depending on the OCR (even indirectly) are skipped, the other ones run
+        self.assertEqual(plugins_done, ["thumbnail"])
+
+        ocr_job = FTLOCRJob.objects.get(ftl_doc=self.doc)
+        self.assertEqual(ocr_jobs, [ocr_job])
+        self.assertEqual(ocr_job.status, FTLOCRJob.PENDING)
+        self.assertEqual(ocr_job.job_id, "job-1")
+        self.assertEqual(ocr_job.plugin, "core.test_processing.FieldsTestPlugin")
+        self.assertEqual(ocr_job.force, ["my.plugin"])
+        self.assertEqual(
+            ocr_job.resume_plugins,
+            [
+                "core.test_processing.FieldsTestPlugin",
+                "core.test_processing.FieldsTestPlugin",
+            ],
+        )
+
+        mocked_send_task.assert_called_once_with(
+            "core.tasks.poll_ocr_job", args=[str(ocr_job.pid)], countdown=10
+        )
+
+    @patch.object(ftl_processing.celery.app, "send_task")
+    def test_processing_stage_suspended(self, mocked_send_task):
+        processing = FTLDocumentProcessing(
+            [
+                FTLPlugins.OCR_OCR_MY_PDF,
+                FTLPlugins.TEXT_EXTRACTION_TIKA,
+                FTLPlugins.LANG_DETECTOR_LANGID,
+            ]
+        )
+
+        with patch.object(
+            processing.plugins[0], "process", side_effect=ProcessingSuspended("job-1"),
+        ):
+            ocr_jobs = processing.apply_processing_stage(
+                self.doc, False, [FTLPlugins.OCR_OCR_MY_PDF]
+            )
+
+        # Plugins of the next stages are resumed once the OCR is done
+        self.assertEqual(len(ocr_jobs), 1)
+        self.assertEqual(
+            ocr_jobs[0].resume_plugins,
+            [FTLPlugins.TEXT_EXTRACTION_TIKA, FTLPlugins.LANG_DETECTOR_LANGID],
+        )
+        mocked_send_task.assert_called_once()
+
+    @patch.object(ftl_processing, "chord")
+    @patch.object(ftl_processing.celery.app, "send_task")
+    def test_processing_suspended_pages_chunks(self, mocked_send_task, mocked_chord):
+        def process_ocr():
+            raise ProcessingSuspended("2 pages chunks", ["chunk-0.pdf", "chunk-1.pdf"])
+
+        processing = FTLDocumentProcessing([])
+        processing.plugins = [
+            FieldsTestPlugin([], ["content_text", "ocrized"], process_ocr),
+        ]
+
+        ocr_jobs = processing.apply_processing(self.doc)
+
+        # Chunks are OCRized in parallel and merged, the job isn't polled
+        mocked_send_task.assert_not_called()
+        header = mocked_chord.call_args[0][0]
+        self.assertEqual(
+            [signature.task for signature in header],
+            ["core.tasks.apply_ocr_pages_chunk", "core.tasks.apply_ocr_pages_chunk"],
+        )
+        self.assertEqual(
+            [signature.args for signature in header],
+            [
+                (str(ocr_jobs[0].pid), "chunk-0.pdf"),
+                (str(ocr_jobs[0].pid), "chunk-1.pdf"),
+            ],
+        )
+
+        callback = mocked_chord.return_value.call_args[0][0]
+        self.assertEqual(callback.task, "core.tasks.merge_ocr_pages_chunks")
+        self.assertEqual(
+            callback.args, (str(ocr_jobs[0].pid), ["chunk-0.pdf", "chunk-1.pdf"])
+        )
+
+
+@override_settings(
+    FTL_OCR_MAX_RETRIES=3,
+    FTL_OCR_RETRY_DELAY=timedelta(minutes=5),
+    FTL_OCR_RETRY_MAX_DELAY=timedelta(minutes=15),
+)
+class OCRRetryTests(TestCase):
+    def setUp(self):
+        self.org = setup_org()
+        setup_admin(self.org)
+        self.user = setup_user(self.org)
+        self.doc = setup_document(self.org, self.user)
+
+    def _record_failure(self):
+        self.doc.refresh_from_db()
+        record_ocr_failure(self.doc, FTLPlugins.OCR_OCR_MY_PDF)
+        self.doc.refresh_from_db()
+        return self.doc.ocr_retry_at
+
+    def test_record_ocr_failure(self):
+        now = django_timezone.now()
+
+        # Retry delay doubles after each failure, up to the max delay
+        for delay in [5, 10, 15]:
+            ocr_retry_at = self._record_failure()
+            self.assertAlmostEqual(
+                ocr_retry_at,
+                now + timedelta(minutes=delay),
+                delta=timedelta(minutes=1),
+            )
+
+        self.assertEqual(self.doc.ocr_retry, 3)
+        self.assertEqual(self.doc.ocr_retry_plugins, [FTLPlugins.OCR_OCR_MY_PDF])
+
+        # Document isn't retried anymore after max retries
+        self.assertIsNone(self._record_failure())
+        self.assertEqual(self.doc.ocr_retry, 4)
+
+    def test_record_ocr_success(self):
+        self._record_failure()
+
+        record_ocr_success(self.doc)
+
+        self.doc.refresh_from_db()
+        self.assertEqual(self.doc.ocr_retry, 0)
+        self.assertIsNone(self.doc.ocr_retry_at)
+        self.assertEqual(self.doc.ocr_retry_plugins, [])
+
+    @override_settings(
+        FTL_OCR_CACHE=False, FTL_OCR_JOBS=False, FTL_OCR_PAGES_PER_CHUNK=0
+    )
+    @patch.object(FTLOCRmyPDF, "_extract_text")
+    def test_processing_records_ocr_failure(self, mocked_extract_text):
+        mocked_extract_text.side_effect = Exception("OCR server down")
+        processing = FTLDocumentProcessing([FTLPlugins.OCR_OCR_MY_PDF])
+        processing.plugins[0].supported_storages.append(settings.DEFAULT_FILE_STORAGE)
+
+        processing.apply_processing(self.doc, force=[FTLPlugins.OCR_OCR_MY_PDF])
+
+        self.doc.refresh_from_db()
+        self.assertEqual(self.doc.ocr_retry, 1)
+        self.assertIsNotNone(self.doc.ocr_retry_at)
+        self.assertEqual(self.doc.ocr_retry_plugins, [FTLPlugins.OCR_OCR_MY_PDF])
+
+        # Successful retry resets the retries
+        mocked_extract_text.side_effect = None
+        mocked_extract_text.return_value = "OCR text"
+
+        processing.apply_processing(self.doc, force=[FTLPlugins.OCR_OCR_MY_PDF])
+
+        self.doc.refresh_from_db()
+        self.assertEqual(self.doc.ocr_retry, 0)
+        self.assertIsNone(self.doc.ocr_retry_at)
+
+    @override_settings(
+        FTL_OCR_CACHE=False, FTL_OCR_JOBS=False, FTL_OCR_PAGES_PER_CHUNK=0
+    )
+    @patch.object(FTLOCRmyPDF, "_extract_text")
+    def test_processing_records_ocr_timeout(self, mocked_extract_text):
+        # OCR result not available in time
+        mocked_extract_text.return_value = None
+        processing = FTLDocumentProcessing(
+            [
+                "core.test_processing.ProcLanguageTest",
+                FTLPlugins.OCR_OCR_MY_PDF,
+                "core.processing.proc_tika.FTLTextExtractionTika",
+            ]
+        )
+        processing.plugins[1].supported_storages.append(settings.DEFAULT_FILE_STORAGE)
+
+        with patch.object(
+            FTLTextExtractionTika, "process"
+        ) as mocked_tika_process, patch.object(
+            ProcLanguageTest, "process"
+        ) as mocked_lang_process:
+            mocked_lang_process.side_effect = lambda ftl_doc, force: atomic_ftl_doc_update(
+                ftl_doc.pid, {"language": "french"}
+            )
+            processing.apply_processing(self.doc, force=True)
+
+            mocked_tika_process.assert_called_once()
+            self.assertIsNotNone(self.doc.content_text)
+
+        self.doc.refresh_from_db()
+        self.assertEqual(self.doc.ocr_retry, 1)
+        self.assertFalse(self.doc.ocrized)
+        self.assertEqual(self.doc.language, "french")
+
+    def test_processing_context_invalid_values_dropped(self):
+        self.doc.refresh_from_db()
+        content_text = self.doc.content_text
+
+        with FTLProcessingContext(self.doc) as processing_context:
+            atomic_ftl_doc_update(self.doc.pid, {"content_text": None})
+
+            with self.assertRaises(IntegrityError):
+                processing_context.flush()
+
+            # The document is restored and the next updates are written
+            self.assertEqual(self.doc.content_text, content_text)
+            record_ocr_failure(self.doc, FTLPlugins.OCR_OCR_MY_PDF)
+
+        self.doc.refresh_from_db()
+        self.assertEqual(self.doc.content_text, content_text)
+        self.assertEqual(self.doc.ocr_retry, 1)
+
+    @patch.object(FTLOCRmyPDF, "_extract_text")
+    def test_processing_unsupported_storage_not_retried(self, mocked_extract_text):
+        processing = FTLDocumentProcessing([FTLPlugins.OCR_OCR_MY_PDF])
+        processing.plugins[0].supported_storages = []
+
+        processing.apply_processing(self.doc, force=[FTLPlugins.OCR_OCR_MY_PDF])
+
+        # Configuration error isn't an OCR failure
+        mocked_extract_text.assert_not_called()
+        self.doc.refresh_from_db()
+        self.assertEqual(self.doc.ocr_retry, 0)
+        self.assertIsNone(self.doc.ocr_retry_at)
+
+
 class ProcLangTests(TestCase):
     @patch.object(FTLDocument, "objects")
     @patch("core.processing.proc_lang.language_identifier")
@@ -266,8 +758,8 @@ class ProcTikaTests(TestCase):
         mocked_from_buffer.assert_called_once()
         self.assertEqual(doc.content_text, indexed_text["content"])
         self.assertEqual(doc.count_pages, indexed_text["metadata"]["xmpTPg:NPages"])
-        doc.save.assert_called()
-        self.assertEqual(doc.save.call_count, 2)
+        # Parsed once, page count and text written at once
+        doc.save.assert_called_once_with(update_fields=["count_pages", "content_text"])
 
     @patch.object(parser, "from_buffer")
     def test_process_value_exists(self, mocked_from_buffer):
@@ -280,6 +772,146 @@ class ProcTikaTests(TestCase):
         mocked_from_buffer.assert_not_called()
         doc.save.assert_not_called()
 
+    @patch.object(parser, "from_buffer")
+    def test_parse_result_shared(self, mocked_from_buffer):
+        doc = Mock()
+        doc.binary = MagicMock()
+        mocked_from_buffer.return_value = {
+            "content": "indexed text",
+            "metadata": {
+                "xmpTPg:NPages": "3",
+                "dc:creator": ["Jane Doe", "John Doe"],
+                "dcterms:created": "2021-02-03T10:11:12Z",
+                "Last-Modified": "not a date",
+            },
+        }
+
+        with FTLProcessingContext(doc):
+            parse_result = get_tika_parse_result(doc)
+            metadata = get_tika_metadata(doc)
+
+        # Document parsed once during a processing, its binary is streamed
+        mocked_from_buffer.assert_called_once_with(
+            doc.binary.open.return_value.__enter__.return_value
+        )
+        self.assertEqual(parse_result, mocked_from_buffer.return_value)
+        self.assertEqual(
+            metadata,
+            {
+                "count_pages": 3,
+                "author": "Jane Doe",
+                "created": datetime(2021, 2, 3, 10, 11, 12, tzinfo=timezone.utc),
+                "modified": None,
+            },
+        )
+
+        # Outside of a processing, document is parsed again
+        get_tika_parse_result(doc)
+        self.assertEqual(mocked_from_buffer.call_count, 2)
+
+
+class TikaClientTests(TestCase):
+    def setUp(self):
+        self.client = FTLTikaClient(
+            ["http://tika1:9998", "http://tika2:9998/"], max_concurrency=1, timeout=0.2
+        )
+        self.response = Mock(status_code=200)
+        self.response.json.return_value = [
+            {
+                "X-TIKA:content": "indexed text",
+                "xmpTPg:NPages": "2",
+                "dc:creator": "Jane Doe",
+            },
+            # Embedded document
+            {"X-TIKA:content": " attachment", "dc:creator": "John Doe"},
+        ]
+
+    @patch.object(requests.Session, "put")
+    def test_parse(self, mocked_put):
+        mocked_put.return_value = self.response
+        file = Mock()
+
+        parsed = self.client.parse(file)
+
+        self.assertEqual(parsed["status"], 200)
+        self.assertEqual(parsed["content"], "indexed text attachment")
+        self.assertEqual(parsed["metadata"]["xmpTPg:NPages"], "2")
+        self.assertEqual(parsed["metadata"]["dc:creator"], ["Jane Doe", "John Doe"])
+        mocked_put.assert_called_once_with(
+            ANY, data=file, headers={"Accept": "application/json"}, timeout=0.2,
+        )
+
+    def test_sessions_pooled(self):
+        # One persistent session per server, the same one is used for all the requests
+        sessions = [endpoint.session for endpoint in self.client.endpoints]
+        self.assertEqual(len(set(map(id, sessions))), 2)
+
+        with patch.object(requests.Session, "put", autospec=True) as mocked_put:
+            mocked_put.return_value = self.response
+            for _ in range(4):
+                self.client.parse(Mock())
+
+        used_sessions = [c[0][0] for c in mocked_put.call_args_list]
+        self.assertCountEqual(used_sessions, sessions * 2)
+
+    @patch.object(requests.Session, "put")
+    def test_parse_round_robin(self, mocked_put):
+        mocked_put.return_value = self.response
+
+        for _ in range(4):
+            self.client.parse(Mock())
+
+        urls = [c[0][0] for c in mocked_put.call_args_list]
+        self.assertCountEqual(
+            urls, ["http://tika1:9998/rmeta/text", "http://tika2:9998/rmeta/text"] * 2
+        )
+        self.assertNotEqual(urls[0], urls[1])
+
+    @patch.object(requests.Session, "put")
+    def test_parse_server_error(self, mocked_put):
+        mocked_put.return_value.raise_for_status.side_effect = requests.HTTPError()
+
+        with self.assertRaises(requests.HTTPError):
+            self.client.parse(Mock())
+
+    @patch.object(requests.Session, "put")
+    def test_parse_servers_busy(self, mocked_put):
+        mocked_put.return_value = self.response
+
+        # Both servers have reached their concurrency limit
+        busy_endpoints = [self.client._acquire_endpoint() for _ in range(2)]
+        with self.assertRaises(TikaServersBusy):
+            self.client.parse(Mock())
+        mocked_put.assert_not_called()
+
+        self.client._release_endpoint(busy_endpoints[0])
+        self.client.parse(Mock())
+        mocked_put.assert_called_once()
+
+    @patch.object(requests.Session, "put")
+    def test_parse_error_release_server(self, mocked_put):
+        mocked_put.side_effect = requests.Timeout()
+
+        for _ in range(3):
+            with self.assertRaises(requests.Timeout):
+                self.client.parse(Mock())
+
+    @override_settings(FTL_TIKA_SERVER_ENDPOINTS=["http://tika:9998"])
+    @patch.object(FTLTikaClient, "parse")
+    @patch.object(parser, "from_buffer")
+    def test_tika_plugin_uses_client(self, mocked_from_buffer, mocked_parse):
+        get_tika_client.cache_clear()
+        self.addCleanup(get_tika_client.cache_clear)
+        doc = Mock()
+        doc.binary = MagicMock()
+
+        get_tika_parse_result(doc)
+
+        mocked_parse.assert_called_once_with(
+            doc.binary.open.return_value.__enter__.return_value
+        )
+        mocked_from_buffer.assert_not_called()
+
 
 class ProcPGsqlTests(TestCase):
     @patch.object(FTLDocument, "objects")
@@ -400,7 +1032,63 @@ class ProcOnlyOfficeTests(TestCase):
             "test-pid", {"thumbnail_binary": AnyFile(mock.ANY, "thumb.png")}
         )
 
+    @override_settings(FTL_ONLY_OFFICE_ASYNC_CONVERSION=True)
+    @patch.object(ftl_processing.celery.app, "send_task")
+    @patch.object(requests, "get")
+    @patch.object(requests, "post")
+    @patch.object(FTLDocumentDetailsOnlyOfficeSerializer, "get_download_url_temp")
+    def test_process_async(
+        self,
+        mock_get_download_url_temp,
+        mock_requests_post,
+        mock_requests_get,
+        mock_send_task,
+    ):
+        only_office = FTLThumbnailGenerationOnlyOffice()
+
+        doc = Mock()
+        doc.pid = "test-pid"
+        doc.type = "application/msword"
+        doc.thumbnail_binary = None
+
+        mock_get_download_url_temp.return_value = (
+            "http://example-download.org/title.doc"
+        )
+
+        requests_post_response = Mock()
+        requests_post_response.status_code = 200
+        requests_post_response.json.side_effect = [
+            {"endConvert": False, "percent": 10},
+            {"endConvert": False, "percent": 50},
+            {"endConvert": True, "fileUrl": "http://example-oo.org/thumb.png"},
+        ]
+        mock_requests_post.return_value = requests_post_response
+        mock_requests_get.return_value.content = b"PNG"
+
+        # Conversion is running, the processing goes on and the conversion is checked later
+        only_office.process(doc, False)
+        self.assertTrue(mock_requests_post.call_args[1]["json"]["async"])
+        mock_send_task.assert_called_once_with(
+            "core.tasks.poll_thumbnail_conversion", args=["test-pid"], countdown=5
+        )
+
+        # Conversion is checked by sending the request again
+        self.assertIsNone(only_office.poll_conversion(doc))
+        thumbnail_binary = only_office.poll_conversion(doc)
+
+        self.assertEqual(mock_requests_post.call_count, 3)
+        mock_requests_get.assert_called_once_with("http://example-oo.org/thumb.png")
+        self.assertEqual(thumbnail_binary.name, "thumb.png")
+        self.assertEqual(thumbnail_binary.read(), b"PNG")
+
 
+class OCRJobTest(FTLOCRBase):
+    def _submit_job(self, ftl_doc_binary, callback_url=None):
+        return "job-1"
+
+
+# OCR cache is tested with actual documents, see OCRCacheTests
+@override_settings(FTL_OCR_CACHE=False)
 class FTLOCRBaseTests(TestCase):
     @patch.object(FTLDocument, "objects")
     @patch.object(FTLOCRBase, "_extract_text")
@@ -437,6 +1125,70 @@ class FTLOCRBaseTests(TestCase):
         self.assertEqual(mocked_doc.content_text, original_doc_content)
         mocked_doc.save.assert_not_called()
 
+    @override_settings(FTL_OCR_JOBS=True)
+    @patch.object(FTLOCRBase, "_extract_text")
+    def test_process_submit_job(self, mocked_extract_text):
+        ocr = OCRJobTest()
+        ocr.supported_storages.append(settings.DEFAULT_FILE_STORAGE)
+        self.assertTrue(ocr.supports_jobs())
+        self.assertFalse(FTLOCRBase().supports_jobs())
+
+        mocked_doc = Mock()
+        mocked_doc.content_text = ""
+
+        # The processing is suspended until the job is done
+        with self.assertRaises(ProcessingSuspended) as cm:
+            ocr.process(mocked_doc, False)
+
+        self.assertEqual(cm.exception.job_id, "job-1")
+        mocked_extract_text.assert_not_called()
+
+    @patch.object(FTLOCRBase, "_split_pages")
+    @patch.object(FTLOCRBase, "_extract_text")
+    def test_process_pages_chunks(self, mocked_extract_text, mocked_split_pages):
+        mocked_split_pages.return_value = ["chunk-0.pdf", "chunk-1.pdf"]
+        base_ocr = FTLOCRBase()
+        base_ocr.supported_storages.append(settings.DEFAULT_FILE_STORAGE)
+
+        mocked_doc = Mock()
+        mocked_doc.content_text = ""
+
+        # Large document is OCRized by chunks of pages
+        with self.assertRaises(ProcessingSuspended) as cm:
+            base_ocr.process(mocked_doc, False)
+
+        self.assertEqual(cm.exception.pages_chunks, ["chunk-0.pdf", "chunk-1.pdf"])
+        mocked_extract_text.assert_not_called()
+
+    @patch.object(FTLOCRBase, "_extract_text")
+    def test_extract_text(self, mocked_extract_text):
+        mocked_extract_text.return_value = b"bingo!"
+
+        self.assertEqual(FTLOCRBase().extract_text(Mock()), "bingo!")
+
+        # OCR timeout
+        mocked_extract_text.return_value = None
+        with self.assertRaises(OCRFailed):
+            FTLOCRBase().extract_text(Mock())
+
+    @override_settings(FTL_OCR_JOBS=False)
+    @patch.object(FTLDocument, "objects")
+    @patch.object(FTLOCRBase, "_extract_text")
+    def test_process_jobs_disabled(self, mocked_extract_text, mocked_select_ftl_doc):
+        mocked_extract_text.return_value = "bingo!"
+        ocr = OCRJobTest()
+        ocr.supported_storages.append(settings.DEFAULT_FILE_STORAGE)
+
+        mocked_doc = Mock()
+        mocked_doc.content_text = ""
+        mocked_select_ftl_doc.select_for_update().get.return_value = mocked_doc
+
+        ocr.process(mocked_doc, False)
+
+        # The worker waits for the OCR
+        mocked_extract_text.assert_called_once()
+        self.assertEqual(mocked_doc.content_text, "bingo!")
+
     @patch.object(FTLOCRBase, "_extract_text")
     def test_process_with_invalid_storage(self, mocked_extract_text):
         base_ocr = FTLOCRBase()
@@ -475,6 +1227,69 @@ class FTLOCRBaseTests(TestCase):
         )
 
 
+class OCRCacheTests(TestCase):
+    def setUp(self):
+        self.org = setup_org()
+        setup_admin(self.org)
+        user = setup_user(self.org)
+        self.doc = setup_document(self.org, user, text_content="")
+        self.doc.md5 = "d85fce92a5789f66f58096402da6b98f"
+        self.doc.size = 20247
+        self.doc.save()
+
+        self.ocr = OCRJobTest()
+        self.ocr.supported_storages.append(settings.DEFAULT_FILE_STORAGE)
+
+    @override_settings(FTL_OCR_JOBS=False)
+    @patch.object(FTLOCRBase, "_extract_text", return_value="bingo!")
+    def test_process_cached(self, mocked_extract_text):
+        self.ocr.process(self.doc, False)
+        mocked_extract_text.assert_called_once()
+
+        ocr_result = FTLOCRResult.objects.get()
+        self.assertEqual(ocr_result.content_text, "bingo!")
+        self.assertEqual(ocr_result.text_size, 6)
+        self.assertEqual(ocr_result.plugin, "core.test_processing.OCRJobTest")
+
+        # Forced OCR of the same content uses the cached result
+        FTLDocument.objects.filter(pid=self.doc.pid).update(content_text="")
+        self.doc.refresh_from_db()
+        self.ocr.process(self.doc, True)
+
+        mocked_extract_text.assert_called_once()
+        self.doc.refresh_from_db()
+        self.assertEqual(self.doc.content_text, "bingo!")
+        self.assertTrue(self.doc.ocrized)
+
+        # Another plugin configuration doesn't
+        with patch.object(OCRJobTest, "get_config", return_value="deu"):
+            self.ocr.process(self.doc, True)
+        self.assertEqual(mocked_extract_text.call_count, 2)
+        self.assertEqual(FTLOCRResult.objects.count(), 2)
+
+    @override_settings(FTL_OCR_JOBS=True)
+    @patch.object(FTLOCRBase, "_get_job_result", return_value="bingo!")
+    def test_poll_job_cached(self, mocked_get_job_result):
+        self.ocr.poll_job("job-1", self.doc)
+
+        # Submitting a job isn't needed for the same content
+        self.assertEqual(self.ocr.get_cached_text(self.doc), "bingo!")
+
+        with patch.object(OCRJobTest, "_submit_job") as mocked_submit_job:
+            self.ocr.process(self.doc, True)
+        mocked_submit_job.assert_not_called()
+
+    @override_settings(FTL_OCR_JOBS=False)
+    @patch.object(FTLOCRBase, "_extract_text", return_value="bingo!")
+    def test_process_without_md5(self, mocked_extract_text):
+        self.doc.md5 = None
+
+        self.ocr.process(self.doc, False)
+
+        mocked_extract_text.assert_called_once()
+        self.assertFalse(FTLOCRResult.objects.exists())
+
+
 class ProcOCRMyPDFTests(TestCase):
     @patch.object(requests, "get")
     @patch.object(requests, "post")
@@ -528,3 +1343,34 @@ class ProcOCRMyPDFTests(TestCase):
             "http://ocrmypdf-api.example.org/ocr/test-pid/txt",
             headers={"X-API-KEY": "secret-api-key"},
         )
+
+    @override_settings(FTL_OCR_CACHE=False)
+    @patch.object(requests, "get")
+    def test_get_job_result(self, mock_requests_get):
+        proc = FTLOCRmyPDF("http://ocrmypdf-api.example.org", "secret-api-key")
+
+        requests_get_response = MagicMock()
+        requests_get_response.status_code = 200
+        requests_get_response.json.side_effect = [
+            {"pid": "test-pid", "status": "processing"},
+            {"pid": "test-pid", "status": "done"},
+        ]
+        requests_get_response.content = "OCR TEXT DATA"
+        mock_requests_get.return_value = requests_get_response
+
+        # Job still running
+        self.assertIsNone(proc.poll_job("test-pid", Mock()))
+        mock_requests_get.assert_called_once_with(
+            "http://ocrmypdf-api.example.org/ocr/test-pid",
+            headers={"X-API-KEY": "secret-api-key"},
+        )
+
+        # Job done
+        self.assertEqual(
+            proc.poll_job("test-pid", Mock()),
+            {"content_text": "OCR TEXT DATA", "ocrized": True},
+        )
+        mock_requests_get.assert_called_with(
+            "http://ocrmypdf-api.example.org/ocr/test-pid/txt",
+            headers={"X-API-KEY": "secret-api-key"},
+        )
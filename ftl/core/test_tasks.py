@@ -1,15 +1,43 @@
 #  Copyright (c) 2021 Exotic Matter SAS. All rights reserved.
 #  Licensed under the Business Source License. See LICENSE at project root for more information.
 import datetime
-from unittest.mock import patch, call, ANY
+import uuid
+from unittest.mock import patch, call, ANY, Mock
 
 import pytz
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.test import override_settings
 from django.utils import timezone
 from rest_framework.test import APITestCase
 
-from core.models import FTLDocument, FTLOrg, FTLDocumentReminder
-from core.tasks import batch_delete_doc, batch_delete_org, batch_documents_reminder
+from core.models import (
+    FTLDocument,
+    FTLOrg,
+    FTLDocumentReminder,
+    FTLDocumentUpload,
+    FTLOCRJob,
+    FTLOCRResult,
+)
+from core.processing.ftl_processing import FTLDocumentProcessing
+from ftl.enums import FTLPlugins, FTLProcessingStages
+from core.tasks import (
+    apply_ftl_processing,
+    apply_ftl_processing_batch,
+    apply_ftl_processing_stage,
+    get_ftl_document_processing,
+    init_ftl_document_processing,
+    poll_ocr_job,
+    apply_ocr_pages_chunk,
+    merge_ocr_pages_chunks,
+    poll_thumbnail_conversion,
+    batch_delete_doc,
+    batch_delete_org,
+    batch_documents_reminder,
+    batch_delete_expired_uploads,
+    batch_evict_ocr_results,
+    batch_retry_ocr,
+)
 from ftests.tools import test_values as tv
 from ftests.tools.setup_helpers import (
     setup_org,
@@ -51,6 +79,28 @@ class RecurringTasksTests(APITestCase):
         self.org_without_docs_1 = setup_org(name=tv.ORG_NAME_3, slug=tv.ORG_SLUG_3)
         self.org_without_docs_2 = setup_org(name=tv.ORG_NAME_4, slug=tv.ORG_SLUG_4)
 
+    @patch.object(FTLDocumentUpload, "delete", autospec=True)
+    def test_batch_delete_expired_uploads(self, mocked_delete):
+        expired_upload = FTLDocumentUpload.objects.create(
+            org=self.org_with_docs,
+            ftl_user=self.user,
+            filename="expired.pdf",
+            type="application/pdf",
+            size=42,
+            created=timezone.now() - datetime.timedelta(days=2),
+        )
+        FTLDocumentUpload.objects.create(
+            org=self.org_with_docs,
+            ftl_user=self.user,
+            filename="in_progress.pdf",
+            type="application/pdf",
+            size=42,
+        )
+
+        batch_delete_expired_uploads()
+
+        mocked_delete.assert_called_once_with(expired_upload)
+
     def test_batch_delete_document(self):
         binary_f = setup_temporary_file().name
         ftl_document = FTLDocument.objects.create(
@@ -234,3 +284,381 @@ class RecurringTasksTests(APITestCase):
             alert_db_plus_1_week.refresh_from_db()
         with self.assertRaises(FTLDocumentReminder.DoesNotExist):
             alert_db_plus_1_month.refresh_from_db()
+
+    @override_settings(FTL_OCR_CACHE_MAX_SIZE=10)
+    def test_batch_evict_ocr_results(self):
+        org = setup_org(name="OCR org", slug="ocr-org")
+        now = timezone.now()
+
+        for i, text in enumerate(["first", "second", "third", "fourth"]):
+            FTLOCRResult.objects.create(
+                org=org,
+                md5=f"{i:032d}",
+                size=1,
+                plugin=FTLPlugins.OCR_OCR_MY_PDF,
+                content_text=text,
+                text_size=len(text),
+                last_used=now - datetime.timedelta(hours=4 - i),
+            )
+
+        batch_evict_ocr_results()
+
+        # Least recently used results are evicted until the cache fits
+        self.assertCountEqual(
+            FTLOCRResult.objects.values_list("content_text", flat=True), ["fourth"],
+        )
+
+    @patch("core.tasks.get_ftl_document_processing")
+    @patch("core.tasks.apply_ftl_processing_batch")
+    def test_batch_retry_ocr(self, mocked_apply_batch, mocked_get_processing):
+        mocked_get_processing.return_value.get_plugins_reading.return_value = [
+            FTLPlugins.LANG_DETECTOR_LANGID
+        ]
+        now = timezone.now()
+        FTLDocument.objects.filter(pid=self.doc.pid).update(
+            ocr_retry=1,
+            ocr_retry_at=now - datetime.timedelta(minutes=1),
+            ocr_retry_plugins=[FTLPlugins.OCR_OCR_MY_PDF],
+        )
+        # Retry delay not over yet
+        FTLDocument.objects.filter(pid=self.doc_bis.pid).update(
+            ocr_retry=2,
+            ocr_retry_at=now + datetime.timedelta(minutes=10),
+            ocr_retry_plugins=[FTLPlugins.OCR_OCR_MY_PDF],
+        )
+
+        batch_retry_ocr()
+
+        # Failed OCR and the next plugins reading its results are forced
+        mocked_apply_batch.delay.assert_called_once_with(
+            [self.doc.pid],
+            force=[FTLPlugins.OCR_OCR_MY_PDF, FTLPlugins.LANG_DETECTOR_LANGID],
+        )
+
+        # Document isn't retried again while being processed
+        self.doc.refresh_from_db()
+        self.assertGreater(self.doc.ocr_retry_at, now)
+        mocked_apply_batch.reset_mock()
+        batch_retry_ocr()
+        mocked_apply_batch.delay.assert_not_called()
+
+        # Nothing to evict
+        batch_evict_ocr_results()
+        self.assertEqual(FTLOCRResult.objects.count(), 1)
+
+
+class ProcessingTasksTests(APITestCase):
+    def setUp(self):
+        self.org = setup_org()
+        setup_admin(self.org)
+        self.user = setup_user(self.org)
+
+        self.doc = setup_document(self.org, self.user)
+        self.doc_bis = setup_document(self.org, self.user, title=tv.DOCUMENT2_TITLE)
+
+        get_ftl_document_processing.cache_clear()
+        self.addCleanup(get_ftl_document_processing.cache_clear)
+
+    @patch.object(FTLDocumentProcessing, "__init__", return_value=None)
+    @patch.object(FTLDocumentProcessing, "apply_processing")
+    def test_processing_pipeline_cached(self, mocked_apply_processing, mocked_init):
+        apply_ftl_processing(self.doc.pid, self.org.pk, self.user.pk, force=False)
+        apply_ftl_processing(self.doc_bis.pid, self.org.pk, self.user.pk, force=False)
+
+        # Plugins are only instantiated once
+        mocked_init.assert_called_once()
+        self.assertEqual(mocked_apply_processing.call_count, 2)
+
+    @patch.object(FTLDocumentProcessing, "__init__", return_value=None)
+    @patch.object(FTLDocumentProcessing, "apply_processing")
+    def test_apply_ftl_processing_batch(self, mocked_apply_processing, mocked_init):
+        with self.assertNumQueries(1):
+            apply_ftl_processing_batch(
+                [self.doc.pid, self.doc_bis.pid, uuid.uuid4()], force=["my.plugin"]
+            )
+
+        self.assertCountEqual(
+            mocked_apply_processing.call_args_list,
+            [call(self.doc, ["my.plugin"]), call(self.doc_bis, ["my.plugin"])],
+        )
+
+    @patch.object(FTLDocumentProcessing, "__init__", return_value=None)
+    @patch.object(FTLDocumentProcessing, "apply_processing")
+    def test_apply_ftl_processing_batch_error(
+        self, mocked_apply_processing, mocked_init
+    ):
+        mocked_apply_processing.side_effect = [Exception("Processing error"), []]
+
+        apply_ftl_processing_batch([self.doc.pid, self.doc_bis.pid], force=False)
+
+        # A failing document doesn't stop the batch
+        self.assertEqual(mocked_apply_processing.call_count, 2)
+
+    @override_settings(FTL_PROCESSING_BATCH_TIME_BUDGET=datetime.timedelta(0))
+    @patch.object(FTLDocumentProcessing, "__init__", return_value=None)
+    @patch.object(FTLDocumentProcessing, "apply_processing")
+    @patch.object(apply_ftl_processing_batch, "delay")
+    def test_apply_ftl_processing_batch_time_budget(
+        self, mocked_delay, mocked_apply_processing, mocked_init
+    ):
+        apply_ftl_processing_batch([self.doc.pid, self.doc_bis.pid], force=False)
+
+        # Remaining documents are processed by a new task
+        mocked_apply_processing.assert_not_called()
+        mocked_delay.assert_called_once()
+        self.assertCountEqual(
+            mocked_delay.call_args[0][0], [str(self.doc.pid), str(self.doc_bis.pid)]
+        )
+        self.assertEqual(mocked_delay.call_args[1], {"force": False})
+
+    @patch.object(FTLDocumentProcessing, "__init__", return_value=None)
+    @patch.object(FTLDocumentProcessing, "check_health", return_value=[])
+    @patch.object(FTLDocumentProcessing, "apply_processing")
+    def test_processing_pipeline_warm_up(
+        self, mocked_apply_processing, mocked_check_health, mocked_init
+    ):
+        # Worker process startup
+        init_ftl_document_processing()
+        mocked_init.assert_called_once()
+        mocked_check_health.assert_called_once()
+
+        # The pipeline is ready for the tasks
+        apply_ftl_processing(self.doc.pid, self.org.pk, self.user.pk, force=False)
+        mocked_init.assert_called_once()
+        mocked_apply_processing.assert_called_once_with(self.doc, False)
+
+    @override_settings(FTL_DOC_PROCESSING_STAGED=True)
+    @patch("core.tasks.chain")
+    @patch.object(FTLDocumentProcessing, "apply_processing")
+    def test_apply_ftl_processing_staged(self, mocked_apply_processing, mocked_chain):
+        apply_ftl_processing(self.doc.pid, self.org.pk, self.user.pk, force=True)
+
+        # Processing is dispatched to a chain of stages tasks
+        mocked_apply_processing.assert_not_called()
+        mocked_chain.return_value.apply_async.assert_called_once_with()
+
+        signatures = mocked_chain.call_args[0][0]
+        self.assertEqual(
+            [signature.options["queue"] for signature in signatures],
+            [FTLProcessingStages.EXTRACT, FTLProcessingStages.INDEX],
+        )
+        self.assertEqual(
+            [signature.args for signature in signatures],
+            [
+                (
+                    self.doc.pid,
+                    self.org.pk,
+                    self.user.pk,
+                    True,
+                    [FTLPlugins.TEXT_EXTRACTION_TIKA],
+                ),
+                (
+                    self.doc.pid,
+                    self.org.pk,
+                    self.user.pk,
+                    True,
+                    [
+                        FTLPlugins.LANG_DETECTOR_LANGID,
+                        FTLPlugins.SEARCH_ENGINE_PGSQL_TSVECTOR,
+                    ],
+                ),
+            ],
+        )
+        for signature in signatures:
+            self.assertEqual(signature.task, apply_ftl_processing_stage.name)
+            self.assertTrue(signature.immutable)
+
+    @patch.object(FTLDocumentProcessing, "apply_processing_stage", return_value=[])
+    def test_apply_ftl_processing_stage(self, mocked_apply_processing_stage):
+        apply_ftl_processing_stage(
+            self.doc.pid,
+            self.org.pk,
+            self.user.pk,
+            False,
+            [FTLPlugins.TEXT_EXTRACTION_TIKA],
+        )
+
+        mocked_apply_processing_stage.assert_called_once_with(
+            self.doc, False, [FTLPlugins.TEXT_EXTRACTION_TIKA]
+        )
+
+    @patch("core.tasks.poll_thumbnail_conversion.apply_async")
+    @patch.object(FTLDocumentProcessing, "get_plugin")
+    def test_poll_thumbnail_conversion(self, mocked_get_plugin, mocked_apply_async):
+        plugin = mocked_get_plugin.return_value
+        plugin.poll_conversion.return_value = None
+
+        # Conversion is running, it's checked again later
+        poll_thumbnail_conversion(str(self.doc.pid))
+
+        mocked_get_plugin.assert_called_with(FTLPlugins.THUMBNAIL_ONLY_OFFICE)
+        mocked_apply_async.assert_called_once_with((str(self.doc.pid), 2), countdown=5)
+
+        # Conversion is done, the thumbnail is saved
+        mocked_apply_async.reset_mock()
+        plugin.poll_conversion.return_value = ContentFile(b"PNG", "thumb.png")
+
+        poll_thumbnail_conversion(str(self.doc.pid), 2)
+
+        mocked_apply_async.assert_not_called()
+        self.doc.refresh_from_db()
+        self.assertTrue(self.doc.thumbnail_binary)
+
+        # Conversion times out
+        plugin.poll_conversion.return_value = None
+
+        poll_thumbnail_conversion(str(self.doc.pid), 120)
+
+        mocked_apply_async.assert_not_called()
+
+
+class OCRJobsTasksTests(APITestCase):
+    def setUp(self):
+        self.org = setup_org()
+        setup_admin(self.org)
+        self.user = setup_user(self.org)
+        self.doc = setup_document(self.org, self.user, text_content="")
+
+        self.ocr_job = FTLOCRJob.objects.create(
+            ftl_doc=self.doc,
+            plugin=FTLPlugins.OCR_OCR_MY_PDF,
+            job_id="job-1",
+            force=False,
+            resume_plugins=[FTLPlugins.TEXT_EXTRACTION_TIKA],
+        )
+        self.plugin = Mock()
+
+        get_ftl_document_processing.cache_clear()
+        self.addCleanup(get_ftl_document_processing.cache_clear)
+
+    def _poll(self):
+        with patch.object(
+            FTLDocumentProcessing, "get_plugin", return_value=self.plugin
+        ) as mocked_get_plugin:
+            poll_ocr_job(str(self.ocr_job.pid))
+
+        mocked_get_plugin.assert_called_once_with(FTLPlugins.OCR_OCR_MY_PDF)
+        self.ocr_job.refresh_from_db()
+        self.doc.refresh_from_db()
+
+    @patch("core.tasks.apply_ftl_processing_stage.delay")
+    @patch("core.tasks.poll_ocr_job.apply_async")
+    def test_poll_ocr_job_running(self, mocked_apply_async, mocked_delay):
+        self.plugin.poll_job.return_value = None
+
+        self._poll()
+
+        # Job is checked again later
+        self.plugin.poll_job.assert_called_once_with("job-1", ANY)
+        mocked_apply_async.assert_called_once_with(
+            (str(self.ocr_job.pid),), countdown=10
+        )
+        self.assertEqual(self.ocr_job.status, FTLOCRJob.PENDING)
+        mocked_delay.assert_not_called()
+
+    @patch("core.tasks.apply_ftl_processing_stage.delay")
+    @patch("core.tasks.poll_ocr_job.apply_async")
+    def test_poll_ocr_job_done(self, mocked_apply_async, mocked_delay):
+        self.plugin.poll_job.return_value = {
+            "content_text": "OCR text",
+            "ocrized": True,
+        }
+
+        self._poll()
+
+        # OCR result is saved and the processing resumed
+        mocked_apply_async.assert_not_called()
+        self.assertEqual(self.ocr_job.status, FTLOCRJob.DONE)
+        self.assertEqual(self.doc.content_text, "OCR text")
+        self.assertTrue(self.doc.ocrized)
+        mocked_delay.assert_called_once_with(
+            self.doc.pid,
+            self.org.pk,
+            self.user.pk,
+            False,
+            [FTLPlugins.TEXT_EXTRACTION_TIKA],
+        )
+
+        # Job is only handled once
+        mocked_delay.reset_mock()
+        self._poll()
+        self.plugin.poll_job.assert_called_once()
+        mocked_delay.assert_not_called()
+
+    @patch("core.tasks.apply_ftl_processing_stage.delay")
+    @patch("core.tasks.poll_ocr_job.apply_async")
+    def test_poll_ocr_job_timeout(self, mocked_apply_async, mocked_delay):
+        self.plugin.poll_job.return_value = None
+        FTLOCRJob.objects.filter(pk=self.ocr_job.pk).update(
+            created=timezone.now() - datetime.timedelta(hours=2)
+        )
+
+        self._poll()
+
+        # Processing is resumed without the OCR
+        mocked_apply_async.assert_not_called()
+        self.assertEqual(self.ocr_job.status, FTLOCRJob.FAILED)
+        self.assertFalse(self.doc.ocrized)
+        mocked_delay.assert_called_once()
+
+    @override_settings(FTL_DOC_PROCESSING_STAGED=True)
+    @patch("core.tasks.chain")
+    def test_poll_ocr_job_error_staged(self, mocked_chain):
+        self.plugin.poll_job.side_effect = Exception("OCR service error")
+
+        self._poll()
+
+        # Resumed plugins are dispatched to their stages
+        self.assertEqual(self.ocr_job.status, FTLOCRJob.FAILED)
+        mocked_chain.return_value.apply_async.assert_called_once_with()
+        signatures = mocked_chain.call_args[0][0]
+        self.assertEqual(
+            [signature.options["queue"] for signature in signatures],
+            [FTLProcessingStages.EXTRACT],
+        )
+        self.assertEqual(
+            signatures[0].args[-1], [FTLPlugins.TEXT_EXTRACTION_TIKA],
+        )
+
+    def test_apply_ocr_pages_chunk(self):
+        chunk_name = default_storage.save("ocr/chunks/test.pdf", ContentFile(b"PDF"))
+        self.addCleanup(default_storage.delete, chunk_name)
+        self.plugin.extract_text.return_value = "Pages text"
+
+        with patch.object(
+            FTLDocumentProcessing, "get_plugin", return_value=self.plugin
+        ):
+            self.assertEqual(
+                apply_ocr_pages_chunk(str(self.ocr_job.pid), chunk_name), "Pages text"
+            )
+
+            # Errors are returned as result, to not prevent the merge
+            self.plugin.extract_text.side_effect = Exception("OCR service error")
+            self.assertIsNone(apply_ocr_pages_chunk(str(self.ocr_job.pid), chunk_name))
+
+    @patch("core.tasks.apply_ftl_processing_stage.delay")
+    def test_merge_ocr_pages_chunks(self, mocked_delay):
+        chunk_name = default_storage.save("ocr/chunks/test.pdf", ContentFile(b"PDF"))
+
+        merge_ocr_pages_chunks(
+            ["Pages 1-10", "Pages 11-12"], str(self.ocr_job.pid), [chunk_name]
+        )
+
+        self.ocr_job.refresh_from_db()
+        self.doc.refresh_from_db()
+        self.assertEqual(self.ocr_job.status, FTLOCRJob.DONE)
+        self.assertEqual(self.doc.content_text, "Pages 1-10\nPages 11-12")
+        self.assertTrue(self.doc.ocrized)
+        self.assertFalse(default_storage.exists(chunk_name))
+        mocked_delay.assert_called_once()
+
+    @patch("core.tasks.apply_ftl_processing_stage.delay")
+    def test_merge_ocr_pages_chunks_failed(self, mocked_delay):
+        merge_ocr_pages_chunks(["Pages 1-10", None], str(self.ocr_job.pid), [])
+
+        # Processing is resumed without the OCR
+        self.ocr_job.refresh_from_db()
+        self.doc.refresh_from_db()
+        self.assertEqual(self.ocr_job.status, FTLOCRJob.FAILED)
+        self.assertFalse(self.doc.ocrized)
+        mocked_delay.assert_called_once()
@@ -6,6 +6,8 @@ import uuid
 from unittest.mock import patch
 
 from django.contrib.staticfiles import finders
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
 from django.test import TestCase, override_settings
 from django.urls import reverse_lazy
 
@@ -18,7 +20,7 @@ from ftests.tools.setup_helpers import (
     setup_document,
     setup_document_share,
 )
-from ftl.enums import FTLStorages
+from ftl.enums import FTLStorages, FTLFileOffloads
 
 
 class CorePagesTests(TestCase):
@@ -87,7 +89,134 @@ class DownloadDocumentTests(TestCase):
         response = self.client.get(f"/app/api/v1/documents/{doc.pid}/download")
 
         with open(doc.binary.path, "rb") as uploaded_doc:
-            self.assertEqual(uploaded_doc.read(), response.content)
+            self.assertEqual(uploaded_doc.read(), b"".join(response.streaming_content))
+
+    @override_settings(DEFAULT_FILE_STORAGE=FTLStorages.FILE_SYSTEM)
+    def test_document_download_range(self):
+        doc = setup_document(self.org, self.user)
+        doc.md5 = "d85fce92a5789f66f58096402da6b98f"
+        doc.save()
+        setup_authenticated_session(self.client, self.org, self.user)
+
+        with open(doc.binary.path, "rb") as uploaded_doc:
+            uploaded_content = uploaded_doc.read()
+
+        response = self.client.get(
+            f"/app/api/v1/documents/{doc.pid}/download", HTTP_RANGE="bytes=10-19"
+        )
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Length"], "10")
+        self.assertEqual(
+            response["Content-Range"], f"bytes 10-19/{len(uploaded_content)}"
+        )
+        self.assertEqual(b"".join(response.streaming_content), uploaded_content[10:20])
+
+        # Suffix range
+        response = self.client.get(
+            f"/app/api/v1/documents/{doc.pid}/download", HTTP_RANGE="bytes=-5"
+        )
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b"".join(response.streaming_content), uploaded_content[-5:])
+
+        # Unsatisfiable range
+        response = self.client.get(
+            f"/app/api/v1/documents/{doc.pid}/download",
+            HTTP_RANGE=f"bytes={len(uploaded_content)}-",
+        )
+        self.assertEqual(response.status_code, 416)
+
+        # Outdated If-Range, whole file is sent
+        response = self.client.get(
+            f"/app/api/v1/documents/{doc.pid}/download",
+            HTTP_RANGE="bytes=10-19",
+            HTTP_IF_RANGE='"outdated"',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), uploaded_content)
+
+    @override_settings(DEFAULT_FILE_STORAGE=FTLStorages.FILE_SYSTEM)
+    def test_document_download_conditional(self):
+        doc = setup_document(self.org, self.user)
+        doc.md5 = "d85fce92a5789f66f58096402da6b98f"
+        doc.save()
+        setup_authenticated_session(self.client, self.org, self.user)
+
+        response = self.client.get(f"/app/api/v1/documents/{doc.pid}/download")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["ETag"], f'"{doc.md5}"')
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+
+        response = self.client.get(
+            f"/app/api/v1/documents/{doc.pid}/download",
+            HTTP_IF_NONE_MATCH=f'"{doc.md5}"',
+        )
+        self.assertEqual(response.status_code, 304)
+
+    @override_settings(
+        DEFAULT_FILE_STORAGE=FTLStorages.FILE_SYSTEM,
+        FTL_FILE_OFFLOAD=FTLFileOffloads.X_ACCEL_REDIRECT,
+        FTL_FILE_OFFLOAD_X_ACCEL_PREFIX="/protected/",
+    )
+    def test_document_download_x_accel_redirect(self):
+        doc = setup_document(self.org, self.user)
+        setup_authenticated_session(self.client, self.org, self.user)
+
+        response = self.client.get(f"/app/api/v1/documents/{doc.pid}/download")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Accel-Redirect"], f"/protected/{doc.binary.name}")
+        self.assertEqual(response["Content-Type"], "application/octet-stream")
+        self.assertIn("attachment;", response["Content-Disposition"])
+        self.assertEqual(response.content, b"")
+
+    @override_settings(
+        DEFAULT_FILE_STORAGE=FTLStorages.FILE_SYSTEM,
+        FTL_FILE_OFFLOAD=FTLFileOffloads.X_SENDFILE,
+    )
+    def test_document_view_x_sendfile(self):
+        doc = setup_document(self.org, self.user)
+        setup_authenticated_session(self.client, self.org, self.user)
+
+        response = self.client.get(
+            f"/app/api/v1/documents/{doc.pid}/download/document.pdf"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Sendfile"], doc.binary.path)
+        self.assertEqual(response.content, b"")
+
+    @override_settings(DEFAULT_FILE_STORAGE=FTLStorages.FILE_SYSTEM)
+    def test_document_thumbnail_caching(self):
+        doc = setup_document(self.org, self.user)
+        doc.thumbnail_binary.save("thumb.png", ContentFile(b"thumbnail"))
+        self.addCleanup(doc.thumbnail_binary.delete, False)
+        setup_authenticated_session(self.client, self.org, self.user)
+
+        response = self.client.get(f"/app/api/v1/documents/{doc.pid}")
+        thumbnail_url = response.data["thumbnail_url"]
+        self.assertTrue(thumbnail_url.endswith(f"?v={doc.thumbnail_version}"))
+
+        response = self.client.get(thumbnail_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"thumbnail")
+        self.assertEqual(response["ETag"], f'"{doc.thumbnail_version}"')
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertIn("private", response["Cache-Control"])
+
+        # Revalidation doesn't access the storage
+        with patch.object(FileSystemStorage, "open") as mocked_open, patch.object(
+            FileSystemStorage, "size"
+        ) as mocked_size:
+            response = self.client.get(
+                thumbnail_url, HTTP_IF_NONE_MATCH=f'"{doc.thumbnail_version}"'
+            )
+            self.assertEqual(response.status_code, 304)
+            mocked_open.assert_not_called()
+            mocked_size.assert_not_called()
+
+        # Unversioned url must be revalidated
+        response = self.client.get(f"/app/api/v1/documents/{doc.pid}/thumbnail.png")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("no-cache", response["Cache-Control"])
+        self.assertNotIn("immutable", response["Cache-Control"])
 
     def test_document_download_doesnt_work_if_not_logged(self):
         # Add a document in first org with first user
@@ -141,7 +270,7 @@ class DownloadDocumentTests(TestCase):
         )
 
         with open(doc.binary.path, "rb") as uploaded_doc:
-            self.assertEqual(uploaded_doc.read(), response.content)
+            self.assertEqual(uploaded_doc.read(), b"".join(response.streaming_content))
 
     @override_settings(FTL_ENABLE_ONLY_OFFICE=True)
     @override_settings(FTL_ONLY_OFFICE_PUBLIC_JS_URL="http://example.org/oo.js")
@@ -40,6 +40,24 @@ urlpatterns = [
         name="api_thumbnail_url",
     ),
     path("api/v1/documents/upload", views.FileUploadView.as_view()),
+    path("api/v1/documents/upload/direct", views.DirectUploadView.as_view()),
+    path(
+        "api/v1/documents/upload/direct/<str:token>",
+        views.DirectUploadLocalView.as_view(),
+        name="api_direct_upload_local",
+    ),
+    path("api/v1/documents/upload/finalize", views.DirectUploadFinalizeView.as_view()),
+    path(
+        "api/v1/processing/callback/<str:token>",
+        views.ProcessingJobCallbackView.as_view(),
+        name="api_processing_job_callback",
+    ),
+    path("api/v1/documents/uploads", views.ChunkedUploadList.as_view()),
+    path("api/v1/documents/uploads/<uuid:pid>", views.ChunkedUploadDetail.as_view()),
+    path(
+        "api/v1/documents/uploads/<uuid:pid>/finalize",
+        views.ChunkedUploadFinalize.as_view(),
+    ),
     path(
         "api/v1/documents/<str:pid>/download",
         views.DownloadView.as_view(),
@@ -2,6 +2,7 @@
 #  Licensed under the Business Source License. See LICENSE in the project root for more information.
 import hashlib
 import json
+import re
 import urllib
 from base64 import b64decode
 from datetime import timedelta
@@ -10,19 +11,19 @@ from pathlib import Path
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib.postgres.search import SearchQuery, SearchRank
-from django.core.files.base import ContentFile
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import default_storage
 from django.core.signing import TimestampSigner, BadSignature
 from django.db import IntegrityError, transaction
-from django.db.models import F, Count
+from django.db.models import F
 from django.http import (
-    HttpResponse,
     HttpResponseNotFound,
     HttpResponseRedirect,
     Http404,
 )
 from django.shortcuts import render, get_object_or_404
+from django.utils.cache import patch_cache_control
 from django.utils.decorators import method_decorator
-from django.utils.http import http_date
 from django.utils.text import slugify
 from django.views import View
 from django_otp.decorators import otp_required
@@ -33,10 +34,31 @@ from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
-from core.errors import ERROR_CODES_DETAILS, BadRequestError
+from core.direct_upload import (
+    get_direct_upload_backend,
+    get_direct_upload_name,
+    sign_direct_upload,
+    unsign_direct_upload,
+)
+from core.chunked_upload import FTLSequentialReader, save_chunk, ASSEMBLY_RETRY_AFTER
+from core.errors import ERROR_CODES_DETAILS, BadRequestError, ConflictError
 from core.ftl_account_processors_mixin import FTLAccountProcessorContextMixin
-from core.mimes import mimetype_to_ext, guess_mimetype
-from core.models import FTLDocument, FTLFolder, FTLDocumentSharing, FTLDocumentReminder
+from core.mimes import mimetype_to_ext, guess_mimetype, guess_mimetype_from_name
+from core.models import (
+    FTLDocument,
+    FTLFolder,
+    FTLDocumentSharing,
+    FTLDocumentReminder,
+    FTLDocumentUpload,
+    FTLDirectUpload,
+    FTLOCRJob,
+    use_document_blob,
+    create_document_blob,
+)
+from core.pagination import FTLDocumentPagination
+from core.processing.ftl_processing import unsign_job_callback
+from core.processing.proc_pgsql_tsvector import SEARCH_VECTOR
+from core.responses import file_response
 from core.serializers import (
     FTLDocumentSerializer,
     FTLFolderSerializer,
@@ -44,10 +66,16 @@ from core.serializers import (
     FTLDocumentDetailsOnlyOfficeSerializer,
     FTLDocumentReminderSerializer,
 )
-from core.tasks import apply_ftl_processing
+from core.tasks import apply_ftl_processing, poll_ocr_job, assemble_chunked_upload
 from ftl.enums import FTLStorages, FTLPlugins
 
 
+MD5_RE = re.compile(r"^[0-9a-fA-F]{32}$")
+
+# Thumbnails are served from versioned urls (see `FTLDocument.thumbnail_version`)
+THUMBNAIL_MAX_AGE = 365 * 24 * 60 * 60
+
+
 def _extract_binary_from_data_uri(data_uri):
     header, encoded = data_uri.split(",", 1)
     return b64decode(encoded)
@@ -115,8 +143,13 @@ class DownloadView(views.APIView):
 
             return HttpResponseRedirect(f"{doc.binary.url}&{urlencode}")
         else:
-            response = HttpResponse(doc.binary, "application/octet-stream")
-            response["Last-Modified"] = http_date(doc.edited.timestamp())
+            response = file_response(
+                request,
+                doc.binary,
+                "application/octet-stream",
+                etag=doc.md5,
+                last_modified=doc.edited,
+            )
             response["Content-Disposition"] = f'attachment; filename="{title}"'
             return response
 
@@ -134,12 +167,18 @@ class ViewDocument(DownloadView):
 
             return HttpResponseRedirect(f"{doc.binary.url}&{urlencode}")
         else:
-            response = HttpResponse(doc.binary, doc.type)
             if doc.type == "text/plain":
-                response["Content-Type"] = f"text/plain; charset=utf-8"
+                content_type = f"text/plain; charset=utf-8"
             else:
-                response["Content-Type"] = doc.type
-
+                content_type = doc.type
+
+            response = file_response(
+                request,
+                doc.binary,
+                content_type,
+                etag=doc.md5,
+                last_modified=doc.edited,
+            )
             response["Content-Disposition"] = f'inline; filename="{title}"'
             return response
 
@@ -169,6 +208,7 @@ class TempDownloadView(DownloadView):
 
 class FTLDocumentList(generics.ListAPIView):
     serializer_class = FTLDocumentSerializer
+    pagination_class = FTLDocumentPagination
     filter_backends = [filters.OrderingFilter]
     ordering_fields = ["created", "title"]
 
@@ -180,9 +220,8 @@ class FTLDocumentList(generics.ListAPIView):
         text_search = self.request.query_params.get("search", None)
 
         queryset = (
-            FTLDocument.objects.annotate(reminders_count=Count("reminders"))
-            .annotate(shares_count=Count("share_pids"))
-            .filter(org=self.request.user.org, deleted=False)
+            FTLDocument.objects.filter(org=self.request.user.org, deleted=False)
+            .select_related("ftl_folder")
             .order_by("-created")
         )
 
@@ -225,11 +264,7 @@ class FTLDocumentDetail(generics.RetrieveUpdateDestroyAPIView):
         )
 
     def get_queryset(self):
-        return (
-            FTLDocument.objects.annotate(reminders_count=Count("reminders"))
-            .annotate(shares_count=Count("share_pids"))
-            .filter(org=self.request.user.org, deleted=False)
-        )
+        return FTLDocument.objects.filter(org=self.request.user.org, deleted=False)
 
     def perform_update(self, serializer):
         need_processing = False
@@ -277,12 +312,114 @@ class FTLDocumentThumbnail(views.APIView):
         if settings.DEFAULT_FILE_STORAGE in [FTLStorages.GCS, FTLStorages.AWS_S3]:
             return HttpResponseRedirect(doc.thumbnail_binary.url)
         else:
-            response = HttpResponse(doc.thumbnail_binary, "image/png")
-            response["Last-Modified"] = http_date(doc.edited.timestamp())
-            # TODO add ETAG and last modified for caching
+            # Conditional requests are answered without accessing the storage
+            response = file_response(
+                request,
+                doc.thumbnail_binary,
+                "image/png",
+                etag=doc.thumbnail_version,
+                last_modified=doc.edited,
+            )
+
+            if request.GET.get("v") == doc.thumbnail_version:
+                patch_cache_control(
+                    response, private=True, max_age=THUMBNAIL_MAX_AGE, immutable=True
+                )
+            else:
+                # Unversioned or outdated url, the browser has to revalidate its copy
+                patch_cache_control(response, private=True, no_cache=True)
+
             return response
 
 
+def _save_uploaded_document(request, ftl_doc, payload, filename, extension, thumbnail):
+    """
+    Set the optional document data sent along the upload, save the document and start its processing
+    """
+    if "ftl_folder" in payload and payload["ftl_folder"]:
+        try:
+            ftl_folder = get_object_or_404(
+                FTLFolder.objects.filter(org=request.user.org),
+                id=payload["ftl_folder"],
+            )
+        except Http404:
+            raise BadRequestError(
+                ERROR_CODES_DETAILS["ftl_folder_not_found"], "ftl_folder_not_found",
+            )
+    else:
+        ftl_folder = None
+
+    ftl_doc.ftl_folder = ftl_folder
+    ftl_doc.ftl_user = request.user
+    ftl_doc.org = request.user.org
+
+    if "title" in payload and payload["title"]:
+        ftl_doc.title = payload["title"]
+    else:
+        if filename.lower().endswith(extension):
+            ftl_doc.title = filename[: -(len(extension))]
+        else:
+            ftl_doc.title = filename
+
+    if "created" in payload and payload["created"]:
+        ftl_doc.created = payload["created"]
+
+    if "note" in payload and payload["note"]:
+        ftl_doc.note = payload["note"]
+
+    if thumbnail:
+        try:
+            ftl_doc.thumbnail_binary = ContentFile(
+                _extract_binary_from_data_uri(thumbnail), "thumb.png",
+            )
+        except ValueError as e:
+            if (
+                "ignore_thumbnail_generation_error" in payload
+                and not payload["ignore_thumbnail_generation_error"]
+            ):
+                raise BadRequestError(
+                    ERROR_CODES_DETAILS["ftl_thumbnail_generation_error"],
+                    "ftl_thumbnail_generation_error",
+                )
+            else:
+                pass
+
+    # Identical document already uploaded in the org, its binary and processing results are reused
+    duplicate_doc = use_document_blob(ftl_doc)
+    processed_doc = duplicate_doc if duplicate_doc and duplicate_doc.tsvector else None
+
+    if processed_doc:
+        ftl_doc.content_text = processed_doc.content_text
+        ftl_doc.language = processed_doc.language
+        ftl_doc.count_pages = processed_doc.count_pages
+        ftl_doc.ocrized = processed_doc.ocrized
+
+        if not ftl_doc.thumbnail_binary and processed_doc.thumbnail_binary:
+            with processed_doc.thumbnail_binary.open("rb") as f:
+                ftl_doc.thumbnail_binary = ContentFile(f.read(), "thumb.png")
+
+    ftl_doc.save()
+
+    if processed_doc:
+        # Title and note may differ from the duplicate, only the search vector has to be computed
+        FTLDocument.objects.filter(pk=ftl_doc.pk).update(tsvector=SEARCH_VECTOR)
+        ftl_doc.refresh_from_db(fields=["tsvector"])
+    else:
+        if not ftl_doc.blob_id:
+            create_document_blob(ftl_doc)
+
+        transaction.on_commit(
+            lambda: apply_ftl_processing.delay(
+                ftl_doc.pid,
+                ftl_doc.org.pk,
+                ftl_doc.ftl_user.pk,
+                force=[FTLPlugins.LANG_DETECTOR_LANGID],
+            )
+        )
+
+    return Response(FTLDocumentSerializer(ftl_doc).data, status=201)
+
+
 class FileUploadView(views.APIView):
     parser_classes = (MultiPartParser,)
     serializer_class = FTLDocumentSerializer
@@ -314,22 +451,7 @@ class FileUploadView(views.APIView):
 
         payload = json.loads(request.POST["json"])
 
-        if "ftl_folder" in payload and payload["ftl_folder"]:
-            try:
-                ftl_folder = get_object_or_404(
-                    FTLFolder.objects.filter(org=self.request.user.org),
-                    id=payload["ftl_folder"],
-                )
-            except Http404:
-                raise BadRequestError(
-                    ERROR_CODES_DETAILS["ftl_folder_not_found"], "ftl_folder_not_found",
-                )
-        else:
-            ftl_folder = None
-
         ftl_doc = FTLDocument()
-        ftl_doc.ftl_folder = ftl_folder
-        ftl_doc.ftl_user = self.request.user
         ftl_doc.binary = file_obj
         ftl_doc.size = file_obj.size
         ftl_doc.type = mime
@@ -346,56 +468,434 @@ class FileUploadView(views.APIView):
                     "ftl_document_md5_mismatch",
                 )
 
-        ftl_doc.org = self.request.user.org
-
-        if "title" in payload and payload["title"]:
-            ftl_doc.title = payload["title"]
-        else:
-            if file_obj.name.lower().endswith(extension):
-                ftl_doc.title = file_obj.name[: -(len(extension))]
-            else:
-                ftl_doc.title = file_obj.name
-
         # The actual name of the file doesn't matter because we use a random UUID. On the contrary, the extension
         # is important.
         ftl_doc.binary.name = f"document{extension}"
 
-        if "created" in payload and payload["created"]:
-            ftl_doc.created = payload["created"]
+        return _save_uploaded_document(
+            request,
+            ftl_doc,
+            payload,
+            file_obj.name,
+            extension,
+            request.POST.get("thumbnail"),
+        )
+
+
+class DirectUploadView(views.APIView):
+    """
+    First step of a direct upload: return an url to PUT the document binary directly to the storage.
+    """
+
+    serializer_class = FTLDocumentSerializer
+    # Needed for applying permission checking on view that don't have any queryset
+    queryset = FTLDocument.objects.none()
+
+    def post(self, request, *args, **kwargs):
+        name = request.data.get("name")
+        md5 = request.data.get("md5")
+
+        if not name or not md5 or not MD5_RE.match(md5):
+            raise BadRequestError(
+                ERROR_CODES_DETAILS["ftl_missing_name_or_md5_in_body"],
+                "ftl_missing_name_or_md5_in_body",
+            )
+
+        mime = guess_mimetype_from_name(name, request.data.get("type"))
+        extension = mimetype_to_ext(mime)
+        if not extension:
+            raise UnsupportedMediaType(
+                mime,
+                ERROR_CODES_DETAILS["ftl_document_type_unsupported"],
+                "ftl_document_type_unsupported",
+            )
+
+        binary_name = get_direct_upload_name(extension)
+        token = sign_direct_upload(
+            {
+                "name": binary_name,
+                "filename": name,
+                "md5": md5.lower(),
+                "org": request.user.org_id,
+                "user": request.user.id,
+            }
+        )
+
+        upload_url, upload_headers = get_direct_upload_backend().get_upload_request(
+            request, binary_name, mime, md5.lower(), token
+        )
+
+        return Response(
+            {
+                "token": token,
+                "upload_url": upload_url,
+                "upload_method": "PUT",
+                "upload_headers": upload_headers,
+            },
+            status=201,
+        )
+
+
+class DirectUploadLocalView(views.APIView):
+    """
+    Receive the document binary of a direct upload for storages without presigned urls (FILE_SYSTEM).
+    Authentication is not enabled because the signed token in url authorizes the upload, like a presigned url.
+    """
+
+    authentication_classes = []
+    permission_classes = []
+
+    def put(self, request, *args, **kwargs):
+        upload = _get_direct_upload(kwargs["token"])
+
+        if (
+            default_storage.exists(upload["name"])
+            or FTLDirectUpload.objects.filter(name=upload["name"]).exists()
+        ):
+            raise BadRequestError(
+                ERROR_CODES_DETAILS["ftl_direct_upload_invalid_token"],
+                "ftl_direct_upload_invalid_token",
+            )
+
+        if request.stream is None:
+            raise BadRequestError(
+                ERROR_CODES_DETAILS["ftl_file_empty"], "ftl_file_empty",
+            )
+
+        # The request body can't be read beyond its Content-Length
+        length = int(request.META.get("CONTENT_LENGTH") or 0)
+        if length > getattr(settings, "FTL_MAX_DIRECT_UPLOAD_SIZE", 1024 ** 3):
+            raise BadRequestError(
+                ERROR_CODES_DETAILS["ftl_file_too_large"], "ftl_file_too_large",
+            )
+
+        # Stored by chunks, the request body is never entirely loaded in memory
+        reader = FTLSequentialReader([request.stream], length)
+        saved_name = default_storage.save(upload["name"], File(reader, upload["name"]))
+
+        # Interrupted upload
+        if saved_name != upload["name"] or reader.tell() != length:
+            default_storage.delete(saved_name)
+            raise BadRequestError(
+                ERROR_CODES_DETAILS["ftl_upload_invalid_chunk"],
+                "ftl_upload_invalid_chunk",
+            )
+
+        return Response(status=204)
+
+
+class ProcessingJobCallbackView(views.APIView):
+    """
+    Called by an asynchronous processing service (eg. OCRmyPDF) when a job is done, the job result is fetched and the
+    document processing resumed right away instead of at the next poll (see `core.tasks.poll_ocr_job`).
+    Authentication is not enabled because the signed token in url authorizes the call.
+    """
+
+    authentication_classes = []
+    permission_classes = []
+
+    def post(self, request, *args, **kwargs):
+        try:
+            job = unsign_job_callback(kwargs["token"])
+        except BadSignature:
+            raise BadRequestError(
+                ERROR_CODES_DETAILS["ftl_processing_callback_invalid_token"],
+                "ftl_processing_callback_invalid_token",
+            )
+
+        ocr_jobs_pids = FTLOCRJob.objects.filter(
+            ftl_doc__pid=job["doc"], plugin=job["plugin"], status=FTLOCRJob.PENDING
+        ).values_list("pid", flat=True)
+
+        # The job may not be saved yet if the service is fast, the scheduled poll handles it
+        for ocr_job_pid in ocr_jobs_pids:
+            poll_ocr_job.delay(str(ocr_job_pid))
+
+        return Response(status=204)
+
+
+class DirectUploadFinalizeView(views.APIView):
+    """
+    Last step of a direct upload: create the document from the binary uploaded to the storage.
+    """
+
+    serializer_class = FTLDocumentSerializer
+    # Needed for applying permission checking on view that don't have any queryset
+    queryset = FTLDocument.objects.none()
+
+    def post(self, request, *args, **kwargs):
+        upload = _get_direct_upload(request.data.get("token"))
 
-        if "note" in payload and payload["note"]:
-            ftl_doc.note = payload["note"]
+        if upload["org"] != request.user.org_id or upload["user"] != request.user.id:
+            raise BadRequestError(
+                ERROR_CODES_DETAILS["ftl_direct_upload_invalid_token"],
+                "ftl_direct_upload_invalid_token",
+            )
 
-        if "thumbnail" in request.POST and request.POST["thumbnail"]:
-            try:
-                ftl_doc.thumbnail_binary = ContentFile(
-                    _extract_binary_from_data_uri(request.POST["thumbnail"]),
-                    "thumb.png",
+        # The token is consumed, even if the document ends up using the binary of an identical document (see
+        # `use_document_blob`). Rolled back with the request transaction if the upload can't be finalized.
+        try:
+            with transaction.atomic():
+                FTLDirectUpload.objects.create(name=upload["name"])
+        except IntegrityError:
+            raise BadRequestError(
+                ERROR_CODES_DETAILS["ftl_direct_upload_invalid_token"],
+                "ftl_direct_upload_invalid_token",
+            )
+
+        metadata = get_direct_upload_backend().get_metadata(upload["name"])
+        if metadata is None:
+            raise BadRequestError(
+                ERROR_CODES_DETAILS["ftl_direct_upload_not_found"],
+                "ftl_direct_upload_not_found",
+            )
+
+        size, md5, mime = metadata
+
+        try:
+            if size == 0:
+                raise BadRequestError(
+                    ERROR_CODES_DETAILS["ftl_file_empty"], "ftl_file_empty",
+                )
+
+            if md5 != upload["md5"]:
+                raise BadRequestError(
+                    ERROR_CODES_DETAILS["ftl_document_md5_mismatch"],
+                    "ftl_document_md5_mismatch",
                 )
-            except ValueError as e:
-                if (
-                    "ignore_thumbnail_generation_error" in payload
-                    and not payload["ignore_thumbnail_generation_error"]
-                ):
-                    raise BadRequestError(
-                        ERROR_CODES_DETAILS["ftl_thumbnail_generation_error"],
-                        "ftl_thumbnail_generation_error",
-                    )
-                else:
-                    pass
 
-        ftl_doc.save()
+            # The content has to match the type declared when the upload was requested
+            extension = mimetype_to_ext(mime)
+            if not extension or extension != Path(upload["name"]).suffix:
+                raise UnsupportedMediaType(
+                    mime,
+                    ERROR_CODES_DETAILS["ftl_document_type_unsupported"],
+                    "ftl_document_type_unsupported",
+                )
+        except (BadRequestError, UnsupportedMediaType):
+            # The upload can't be retried with the same token
+            default_storage.delete(upload["name"])
+            raise
 
-        transaction.on_commit(
-            lambda: apply_ftl_processing.delay(
-                ftl_doc.pid,
-                ftl_doc.org.pk,
-                ftl_doc.ftl_user.pk,
-                force=[FTLPlugins.LANG_DETECTOR_LANGID],
+        ftl_doc = FTLDocument()
+        ftl_doc.binary = upload["name"]
+        ftl_doc.size = size
+        ftl_doc.md5 = md5
+        ftl_doc.type = mime
+
+        return _save_uploaded_document(
+            request,
+            ftl_doc,
+            request.data,
+            upload["filename"],
+            extension,
+            request.data.get("thumbnail"),
+        )
+
+
+class ChunkedUploadList(views.APIView):
+    """
+    Create a resumable upload, the document is then sent by chunks (see `ChunkedUploadDetail`).
+    """
+
+    serializer_class = FTLDocumentSerializer
+    # Needed for applying permission checking on view that don't have any queryset
+    queryset = FTLDocument.objects.none()
+
+    def post(self, request, *args, **kwargs):
+        name = request.data.get("name")
+        size = request.data.get("size")
+        md5 = request.data.get("md5")
+
+        if not name or not isinstance(size, int) or size <= 0:
+            raise BadRequestError(
+                ERROR_CODES_DETAILS["ftl_missing_name_or_size_in_body"],
+                "ftl_missing_name_or_size_in_body",
+            )
+
+        if md5 and not MD5_RE.match(md5):
+            raise BadRequestError(
+                ERROR_CODES_DETAILS["ftl_missing_name_or_md5_in_body"],
+                "ftl_missing_name_or_md5_in_body",
+            )
+
+        mime = guess_mimetype_from_name(name, request.data.get("type"))
+        if not mimetype_to_ext(mime):
+            raise UnsupportedMediaType(
+                mime,
+                ERROR_CODES_DETAILS["ftl_document_type_unsupported"],
+                "ftl_document_type_unsupported",
+            )
+
+        upload = FTLDocumentUpload.objects.create(
+            org=request.user.org,
+            ftl_user=request.user,
+            filename=name,
+            type=mime,
+            size=size,
+            md5=md5.lower() if md5 else None,
+        )
+
+        return _chunked_upload_response(upload, status=201)
+
+
+class ChunkedUploadDetail(views.APIView):
+    """
+    Get the offset of a resumable upload (GET), send the next chunk (PATCH) or abort the upload (DELETE).
+    Chunks have to be sent in order, the `Upload-Offset` header of each chunk must match the current upload offset.
+    """
+
+    serializer_class = FTLDocumentSerializer
+    # Needed for applying permission checking on view that don't have any queryset
+    queryset = FTLDocument.objects.none()
+
+    def get_queryset(self):
+        return FTLDocumentUpload.objects.filter(
+            org=self.request.user.org, ftl_user=self.request.user
+        )
+
+    def get(self, request, *args, **kwargs):
+        upload = get_object_or_404(self.get_queryset(), pid=kwargs["pid"])
+        return _chunked_upload_response(upload)
+
+    def patch(self, request, *args, **kwargs):
+        # Lock the upload to prevent concurrent chunks
+        upload = get_object_or_404(
+            self.get_queryset().select_for_update(), pid=kwargs["pid"]
+        )
+
+        try:
+            offset = int(request.META.get("HTTP_UPLOAD_OFFSET"))
+            length = int(request.META.get("CONTENT_LENGTH") or 0)
+        except (TypeError, ValueError):
+            raise BadRequestError(
+                ERROR_CODES_DETAILS["ftl_upload_invalid_chunk"],
+                "ftl_upload_invalid_chunk",
+            )
+
+        if offset != upload.offset:
+            raise ConflictError(
+                ERROR_CODES_DETAILS["ftl_upload_offset_mismatch"],
+                "ftl_upload_offset_mismatch",
+            )
+
+        if length <= 0 or offset + length > upload.size:
+            raise BadRequestError(
+                ERROR_CODES_DETAILS["ftl_upload_invalid_chunk"],
+                "ftl_upload_invalid_chunk",
+            )
+
+        received = save_chunk(upload, offset, request.stream, length)
+        if not received:
+            raise BadRequestError(
+                ERROR_CODES_DETAILS["ftl_upload_invalid_chunk"],
+                "ftl_upload_invalid_chunk",
             )
+
+        upload.chunks.append(offset)
+        upload.offset += received
+        upload.save(update_fields=["chunks", "offset"])
+
+        return _chunked_upload_response(upload)
+
+    def delete(self, request, *args, **kwargs):
+        upload = get_object_or_404(self.get_queryset(), pid=kwargs["pid"])
+        upload.delete()
+        return Response(status=204)
+
+
+class ChunkedUploadFinalize(views.APIView):
+    """
+    Assemble the chunks of a resumable upload on the storage and create the document. The chunks are assembled by a
+    task, the client finalizes the upload again until the document is created (`202` responses while it's assembled).
+    """
+
+    serializer_class = FTLDocumentSerializer
+    # Needed for applying permission checking on view that don't have any queryset
+    queryset = FTLDocument.objects.none()
+
+    def get_queryset(self):
+        return FTLDocumentUpload.objects.filter(
+            org=self.request.user.org, ftl_user=self.request.user
         )
 
-        return Response(self.serializer_class(ftl_doc).data, status=201)
+    def post(self, request, *args, **kwargs):
+        upload = get_object_or_404(
+            self.get_queryset().select_for_update(), pid=kwargs["pid"]
+        )
+
+        if upload.offset != upload.size:
+            raise BadRequestError(
+                ERROR_CODES_DETAILS["ftl_upload_incomplete"], "ftl_upload_incomplete",
+            )
+
+        if upload.status == FTLDocumentUpload.FAILED:
+            # The chunks are deleted once assembled, the upload can't be retried. It's deleted with the expired ones.
+            if upload.error == "ftl_document_type_unsupported":
+                raise UnsupportedMediaType(
+                    upload.type,
+                    ERROR_CODES_DETAILS["ftl_document_type_unsupported"],
+                    "ftl_document_type_unsupported",
+                )
+            raise BadRequestError(ERROR_CODES_DETAILS[upload.error], upload.error)
+
+        if upload.status != FTLDocumentUpload.ASSEMBLED:
+            if upload.status == FTLDocumentUpload.UPLOADING:
+                upload.status = FTLDocumentUpload.ASSEMBLING
+                upload.save(update_fields=["status"])
+                transaction.on_commit(
+                    lambda: assemble_chunked_upload.delay(str(upload.pid))
+                )
+
+            response = _chunked_upload_response(upload, status=202)
+            response["Retry-After"] = ASSEMBLY_RETRY_AFTER
+            return response
+
+        ftl_doc = FTLDocument()
+        ftl_doc.binary = upload.binary
+        ftl_doc.size = upload.size
+        ftl_doc.md5 = upload.md5
+        ftl_doc.type = upload.type
+
+        # On error (eg. invalid folder) the upload stays assembled, it can be finalized again with valid data
+        response = _save_uploaded_document(
+            request,
+            ftl_doc,
+            request.data,
+            upload.filename,
+            mimetype_to_ext(upload.type),
+            request.data.get("thumbnail"),
+        )
+
+        # The assembled binary now belongs to the document, the chunks are already deleted
+        FTLDocumentUpload.objects.filter(pk=upload.pk).delete()
+        return response
+
+
+def _chunked_upload_response(upload, status=200):
+    response = Response(
+        {
+            "pid": upload.pid,
+            "offset": upload.offset,
+            "size": upload.size,
+            "status": upload.status,
+            "created": upload.created,
+        },
+        status=status,
+    )
+    response["Upload-Offset"] = upload.offset
+    response["Upload-Length"] = upload.size
+    return response
+
+
+def _get_direct_upload(token):
+    try:
+        return unsign_direct_upload(token or "")
+    except BadSignature:
+        raise BadRequestError(
+            ERROR_CODES_DETAILS["ftl_direct_upload_invalid_token"],
+            "ftl_direct_upload_invalid_token",
+        )
 
 
 class FTLFolderList(generics.ListCreateAPIView):
@@ -405,7 +905,9 @@ class FTLFolderList(generics.ListCreateAPIView):
     def get_queryset(self):
         current_folder = self.request.query_params.get("level")
 
-        queryset = FTLFolder.objects.filter(org=self.request.user.org)
+        queryset = FTLFolder.objects.filter(org=self.request.user.org).select_related(
+            "parent"
+        )
         if current_folder is not None and int(current_folder) > 0:
             queryset = queryset.filter(parent__id=current_folder)
         else:
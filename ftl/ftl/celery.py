@@ -15,6 +15,13 @@ app.config_from_object("django.conf:settings", namespace="CELERY")
 app.autodiscover_tasks()
 
 
+@app.on_after_configure.connect
+def default_result_backend(sender, **kwargs):
+    # The broker stores the results when no result backend is set (Redis broker)
+    if not sender.conf.result_backend:
+        sender.conf.result_backend = sender.conf.broker_url
+
+
 @app.task(bind=True)
 def debug_task(self):
     print("Request: {0!r}".format(self.request))
@@ -18,6 +18,41 @@ class FTLStorages:
     GCS = "storages.backends.gcloud.GoogleCloudStorage"
 
 
+class FTLFileOffloads:
+    """
+    Enum of supported file transfer offloads (only for FILE_SYSTEM storage)
+
+    Permissions are checked by Django, then the transfer of the file is delegated to the front server through a
+    response header, so the worker is freed immediately.
+
+    X_ACCEL_REDIRECT, for nginx
+    - Require an `internal` location matching FTL_FILE_OFFLOAD_X_ACCEL_PREFIX, aliased to the storage directory
+    X_SENDFILE, for uWSGI (see docker/app/ftl_uwsgi.ini), Apache mod_xsendfile or lighttpd
+    """
+
+    X_ACCEL_REDIRECT = "X-Accel-Redirect"
+    X_SENDFILE = "X-Sendfile"
+
+
+class FTLProcessingStages:
+    """
+    Enum of document processing stages (see `processing_stage` of core.processing.ftl_processing.FTLDocProcessingBase)
+
+    When FTL_DOC_PROCESSING_STAGED is enabled, each stage runs in its own task routed to the queue of the same name, so
+    workers of each stage can be scaled independently.
+
+    OCR, OCR plugins (slow, rely on external services)
+    EXTRACT, text extraction, and plugins without a stage
+    INDEX, lang detection and search engine
+    THUMB, thumbnail generation
+    """
+
+    OCR = "ocr"
+    EXTRACT = "extract"
+    INDEX = "index"
+    THUMB = "thumb"
+
+
 class FTLPlugins:
     """
     Enum of supported plugins
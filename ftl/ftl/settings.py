@@ -283,6 +283,18 @@ os.environ["TIKA_SERVER_JAR"] = pathlib.Path(
     os.path.join(BASE_DIR, "vendors", "tika-server-1.20.jar")
 ).as_uri()
 
+"""
+Tika servers used by the text extraction plugin (see FTLPlugins.TEXT_EXTRACTION_TIKA). When empty, a local Tika server is
+started with the jar above.
+- FTL_TIKA_SERVER_ENDPOINTS: list of Tika servers urls (eg. "http://tika:9998"), requests are distributed by round-robin
+- FTL_TIKA_MAX_CONCURRENCY: maximum number of parallel requests to each server, per worker process. The limit isn't
+  shared between processes, a server receives up to FTL_TIKA_MAX_CONCURRENCY x number of worker processes requests.
+- FTL_TIKA_TIMEOUT: timeout in seconds of a request, and to wait for an available server when all are busy
+"""
+FTL_TIKA_SERVER_ENDPOINTS = []
+FTL_TIKA_MAX_CONCURRENCY = 2
+FTL_TIKA_TIMEOUT = 60
+
 # SMTP EMAIL SERVER conf
 EMAIL_HOST = "localhost"
 EMAIL_HOST_USER = ""
@@ -308,6 +320,20 @@ Remote storage requires:
 """
 DEFAULT_FILE_STORAGE = FTLStorages.FILE_SYSTEM
 
+"""
+Offload documents and thumbnails transfers to the front server (FILE_SYSTEM storage only)
+- Set FTL_FILE_OFFLOAD to one of ftl.enums.FTLFileOffloads value, check its docstring to know the front server config
+- None to send files from Django
+"""
+FTL_FILE_OFFLOAD = None
+FTL_FILE_OFFLOAD_X_ACCEL_PREFIX = "/protected-files/"
+
+"""
+Maximum size of a document sent by direct upload to the FILE_SYSTEM storage (other storages use presigned urls, the
+document doesn't go through Django)
+"""
+FTL_MAX_DIRECT_UPLOAD_SIZE = 1024 ** 3
+
 """
 DOCUMENT PROCESSING PLUGINS (order is important)
 ================================================
@@ -327,6 +353,72 @@ FTL_DOC_PROCESSING_PLUGINS = [
     FTLPlugins.SEARCH_ENGINE_PGSQL_TSVECTOR,
 ]
 
+"""
+Maximum number of document processing plugins running concurrently for a document. Plugins which don't depend on each
+other (see `requires` and `provides` of core.processing.ftl_processing.FTLDocProcessingBase) run in parallel, eg.
+thumbnail generation and text extraction.
+"""
+FTL_DOC_PROCESSING_THREADS = 4
+
+"""
+Mass processing (`reindex_docs`, `import_docs` and OCR retries) processes documents by batches in a single task. Once a
+batch task has been running for FTL_PROCESSING_BATCH_TIME_BUDGET, its remaining documents are processed by a new task,
+so it isn't killed by the worker time limit (JOB_TIMELIMIT). It should be lower than the time limit minus the
+longest processing of a single document (eg. OCR_MY_PDF waits up to 5 minutes).
+"""
+FTL_PROCESSING_BATCH_TIME_BUDGET = timedelta(minutes=5)
+
+"""
+Staged document processing: plugins of each processing stage (see ftl.enums.FTLProcessingStages) run in their own
+task, chained and routed to the queue of the stage (`ocr`, `extract`, `index` and `thumb`), so slow OCR doesn't delay
+the other documents and OCR workers can be scaled independently. Workers have to consume these queues in addition to
+`ftl_processing`.
+"""
+FTL_DOC_PROCESSING_STAGED = False
+
+"""
+OCR jobs: OCR plugins relying on an asynchronous service (OCR_MY_PDF, OCR_AWS_TEXTRACT and OCR_GOOGLE_VISION_ASYNC)
+submit the OCR and suspend the document processing instead of waiting for the result in the worker. The job is checked
+every FTL_OCR_JOB_POLL_INTERVAL seconds by a task of the `med` queue, the processing is resumed once the job is done or
+after FTL_OCR_JOB_TIMEOUT. Disabled by default (workers wait for the OCR result), enabling it requires workers consuming
+the `med` queue.
+
+FTL_PROCESSING_CALLBACK_HOST: address of FTL reachable by the processing services, including the scheme and port (eg.
+"http://ftl-app:8000"). When set, services supporting it (OCR_MY_PDF) call a signed url when the job is done, so the
+result doesn't wait for the next poll.
+"""
+FTL_OCR_JOBS = False
+FTL_OCR_JOB_POLL_INTERVAL = 10
+FTL_OCR_JOB_TIMEOUT = timedelta(hours=1)
+FTL_PROCESSING_CALLBACK_HOST = None
+
+"""
+Large PDF are split by chunks of FTL_OCR_PAGES_PER_CHUNK pages, OCRized in parallel by several workers and the texts
+merged in pages order, so a single task doesn't hit the worker time limit. Requires the PyPDF2 module and a Celery
+result backend (see CELERY_RESULT_BACKEND). 0 disables it.
+"""
+FTL_OCR_PAGES_PER_CHUNK = 0
+
+"""
+OCR results are cached by document content (md5 and size), OCR plugin and plugin configuration, so reprocessing a
+document (even forced) or processing an identical document of the org doesn't run the OCR again.
+- FTL_OCR_CACHE: enable the cache
+- FTL_OCR_CACHE_MAX_SIZE: maximum size of the cached texts (in characters), the least recently used results are
+  evicted every hour
+"""
+FTL_OCR_CACHE = True
+FTL_OCR_CACHE_MAX_SIZE = 1024 ** 3
+
+"""
+Failed OCR are retried with an exponential backoff: FTL_OCR_RETRY_DELAY after the first failure, then twice longer
+after each failure up to FTL_OCR_RETRY_MAX_DELAY. After FTL_OCR_MAX_RETRIES failures the document is parked, it's only
+processed again by `reindex_docs`. Up to FTL_OCR_RETRY_BATCH_SIZE documents are submitted every 5 minutes.
+"""
+FTL_OCR_MAX_RETRIES = 5
+FTL_OCR_RETRY_DELAY = timedelta(minutes=5)
+FTL_OCR_RETRY_MAX_DELAY = timedelta(days=1)
+FTL_OCR_RETRY_BATCH_SIZE = 500
+
 """
 EXTRA SETTINGS FOR REMOTE STORAGE OR OCR_GOOGLE_VISION_SYNC
 """
@@ -405,9 +497,20 @@ CAPTCHA_FONT_SIZE = 42
 Celery settings
 """
 CELERY_BROKER_URL = "redis://localhost:6379"
+# Results are only stored for tasks which need it (pages chunks OCR, required when FTL_OCR_PAGES_PER_CHUNK > 0).
+# None to use the broker url (see `ftl.celery.default_result_backend`).
+CELERY_RESULT_BACKEND = None
+CELERY_TASK_IGNORE_RESULT = True
 CELERY_TASK_ROUTES = {
     "core.tasks.apply_ftl_processing": {"queue": "ftl_processing"},
+    "core.tasks.apply_ftl_processing_batch": {"queue": "ftl_processing"},
+    "core.tasks.apply_ftl_processing_stage": {"queue": "ftl_processing"},
+    "core.tasks.poll_ocr_job": {"queue": "med"},
+    "core.tasks.apply_ocr_pages_chunk": {"queue": "ftl_processing"},
+    "core.tasks.merge_ocr_pages_chunks": {"queue": "med"},
+    "core.tasks.poll_thumbnail_conversion": {"queue": "med"},
     "core.tasks.delete_document": {"queue": "med"},
+    "core.tasks.assemble_chunked_upload": {"queue": "med"},
     "core.tasks.send_email_async": {"queue": "med"},
 }
 CELERY_BEAT_SCHEDULE = {
@@ -419,6 +522,18 @@ CELERY_BEAT_SCHEDULE = {
         "task": "core.tasks.batch_delete_doc",
         "schedule": crontab(minute=0, hour="*"),
     },
+    "clean-uploads-everyhour": {
+        "task": "core.tasks.batch_delete_expired_uploads",
+        "schedule": crontab(minute=30, hour="*"),
+    },
+    "retry-ocr-every-5-minutes": {
+        "task": "core.tasks.batch_retry_ocr",
+        "schedule": crontab(minute="*/5"),
+    },
+    "evict-ocr-results-everyhour": {
+        "task": "core.tasks.batch_evict_ocr_results",
+        "schedule": crontab(minute=45, hour="*"),
+    },
     "clean-oauth-tokens-everyday": {
         "task": "core.tasks.batch_delete_oauth_tokens",
         "schedule": crontab(minute=15, hour=1),
@@ -474,6 +589,8 @@ FTL_ONLY_OFFICE_API_SERVER_URL = "http://localhost:8080"
 FTL_ONLY_OFFICE_INTERNAL_DOWNLOAD_SERVER_URL = "http://localhost:8080"
 # This is the JWT_SECRET in your OnlyOffice conf
 FTL_ONLY_OFFICE_SECRET_KEY = "NOT-SECURE"
+# Use the async mode of OnlyOffice conversion, workers don't wait for the thumbnail (checked by a task of the `med` queue)
+FTL_ONLY_OFFICE_ASYNC_CONVERSION = False
 # This setting shouldn't be updated
 FTL_ONLY_OFFICE_SUPPORTED_DOCUMENTS_TYPES = {
     "text/plain",